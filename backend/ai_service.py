@@ -1,9 +1,64 @@
 import json
 import re
-from openai import OpenAI
+import time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+import httpx
+from openai import OpenAI, AsyncOpenAI
 from config import settings
+from cache import make_cache_key, get_cached, set_cached, get_cached_async, set_cached_async
+from singleflight import run_coalesced, run_coalesced_async
+from stream_parser import IncrementalJSONParser, complete_fields
+from token_budget import prepare_prompt, remap_lines, count_tokens
+from model_router import route_model, record_latency
+from rate_limit import call_with_retries, call_with_retries_async, UpstreamUnavailableError
+from cancellation import JobCancelledError
+from metrics import stage, record_tokens, CACHE_LOOKUPS, PARSE_FALLBACKS, PARSE_RESULTS, FIELD_REPAIRS, STAGE_SECONDS
+from schemas import SCHEMAS, invalid_fields, response_format, subset_schema
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+MODEL = settings.MODEL_DEFAULT
+TEMPERATURE = 0.3
+MAX_TOKENS = 4000
+# Tools that return the submitted file rewritten. Their code is sent as-is so
+# license headers and formatting survive into the returned file.
+CODE_ECHO_TOOLS = ("debug", "refactor", "optimize", "fused")
+
+REPAIR_PROMPT = """Your previous reply was cut off or had invalid values for: {keys}.
+Return JSON only: an object with just these keys, in the format described above."""
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+
+
+# Shared, pooled clients. All requests go to a single host, so the pool limits
+# are effectively per-host limits. Retries are left to rate_limit so they are
+# paced by the shared quota.
+client = OpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL or None,
+    max_retries=0,
+    http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout()),
+)
+async_client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL or None,
+    max_retries=0,
+    http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout()),
+)
+
+
+async def close_ai_clients():
+    """Close pooled connections; called on application shutdown."""
+    await async_client.close()
+    client.close()
 
 def _parse_ai_json(content: str) -> dict:
     """Parse JSON from model output, including fenced or prefixed responses."""
@@ -40,44 +95,360 @@ def _parse_ai_json(content: str) -> dict:
     return {"raw": content}
 
 
-async def analyze_with_ai(system_prompt: str, user_prompt: str) -> dict:
-    """Call OpenAI API for code analysis."""
+def _is_raw(result) -> bool:
+    return isinstance(result, dict) and list(result) == ["raw"]
+
+
+def _parse(content: str, tool: str, model: str, schema: Optional[dict] = None) -> Tuple[object, List[str]]:
+    """Parse a reply and list the schema fields that are missing or invalid.
+
+    Well-formed replies (the norm with structured output) take a single
+    json.loads. Anything else goes through _parse_ai_json, and if that fails
+    the fields that did close are salvaged so only the rest need repair.
+    """
+    with stage("json_parse", tool, model):
+        path = "fast"
+        try:
+            result = json.loads(content)
+        except json.JSONDecodeError:
+            result = None
+        if not isinstance(result, dict):
+            path = "lenient"
+            result = _parse_ai_json(content)
+            if schema is not None and (_is_raw(result) or not isinstance(result, dict)):
+                salvaged = complete_fields(content)
+                if salvaged:
+                    path, result = "salvaged", salvaged
+        invalid = invalid_fields(result, schema) if schema is not None else []
+    if _is_raw(result):
+        path = "raw"
+        PARSE_FALLBACKS.labels(tool or "", model).inc()
+    PARSE_RESULTS.labels(tool or "", path).inc()
+    return result, invalid
+
+
+def _merge_repair(tool: str, result, patch, invalid: List[str], still_invalid: List[str]):
+    """Replace invalid fields with repaired values; fields that stay invalid are listed in invalidFields."""
+    base = result if isinstance(result, dict) and not _is_raw(result) else {}
+    merged = {key: value for key, value in base.items() if key not in invalid}
+    for key in invalid:
+        repaired = key not in still_invalid
+        FIELD_REPAIRS.labels(tool or "", key, "repaired" if repaired else "failed").inc()
+        if repaired:
+            merged[key] = patch[key]
+    if not merged:
+        return result
+    if still_invalid:
+        merged["invalidFields"] = still_invalid
+    return merged
+
+
+def _repair_messages(system_prompt: str, prepared: dict, invalid: List[str]) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prepared["user_prompt"]},
+        {"role": "user", "content": REPAIR_PROMPT.format(keys=", ".join(invalid))},
+    ]
+
+
+def _completion_args(model: str, messages: list, max_tokens: int, response_format: Optional[dict] = None,
+                     stream: bool = False) -> dict:
+    args = {"model": model, "messages": messages, "temperature": TEMPERATURE, "max_tokens": max_tokens}
+    if response_format is not None:
+        args["response_format"] = response_format
+    if stream:
+        args["stream"] = True
+    return args
+
+
+def _needs_repair(invalid: List[str]) -> bool:
+    return bool(invalid) and settings.PARSE_REPAIR_ENABLED
+
+
+def _record_usage(tool: str, model: str, prepared: dict, content: str, usage=None):
+    """Count tokens in and out; streamed replies carry no usage, so count their text."""
+    output_tokens = usage.completion_tokens if usage is not None else count_tokens(content, model)
+    record_tokens(tool, model, prepared["usage"]["inputTokens"], output_tokens)
+
+
+def _cache_lookup(tool: str, cached) -> bool:
+    CACHE_LOOKUPS.labels(tool, "hit" if cached is not None else "miss").inc()
+    return cached is not None
+
+
+def _compacts(tool: str) -> bool:
+    return tool not in CODE_ECHO_TOOLS
+
+
+def _quota_tokens(prepared: dict) -> int:
+    """Tokens a call counts against TPM: its input plus the reply it may produce."""
+    return prepared["usage"]["inputTokens"] + prepared["max_tokens"]
+
+
+def _finish(result, prepared: dict, model: str):
+    """Point line numbers back at the uncompacted source and report token usage and model."""
+    result = remap_lines(result, prepared["line_map"])
+    if isinstance(result, dict):
+        result = {**result, "tokenUsage": prepared["usage"], "model": model}
+    return result
+
+
+def _messages(system_prompt: str, prepared: dict) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prepared["user_prompt"]}
+    ]
+
+
+async def _repair(system_prompt: str, prepared: dict, model: str, tool: str, schema: dict,
+                  result, invalid: List[str]):
+    """Re-request only the invalid fields of a reply and merge them in."""
+    partial = subset_schema(schema, invalid)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=4000,
-        )
+        with stage("repair", tool, model):
+            response = await call_with_retries_async(lambda: async_client.chat.completions.create(**_completion_args(
+                model, _repair_messages(system_prompt, prepared, invalid), prepared["max_tokens"],
+                response_format(partial, model, tool, system_prompt),
+            )), _quota_tokens(prepared))
         content = response.choices[0].message.content
+        _record_usage(tool, model, prepared, content, response.usage)
+        patch, still_invalid = _parse(content, tool, model, partial)
+    except Exception:
+        # The first reply was usable in part; keep that rather than fail.
+        patch, still_invalid = {}, invalid
+    return _merge_repair(tool, result, patch, invalid, still_invalid)
+
 
-        return _parse_ai_json(content)
+def _repair_sync(system_prompt: str, prepared: dict, model: str, tool: str, schema: dict,
+                 result, invalid: List[str]):
+    """Synchronous version of _repair."""
+    partial = subset_schema(schema, invalid)
+    try:
+        with stage("repair", tool, model):
+            response = call_with_retries(lambda: client.chat.completions.create(**_completion_args(
+                model, _repair_messages(system_prompt, prepared, invalid), prepared["max_tokens"],
+                response_format(partial, model, tool, system_prompt),
+            )), _quota_tokens(prepared))
+        content = response.choices[0].message.content
+        _record_usage(tool, model, prepared, content, response.usage)
+        patch, still_invalid = _parse(content, tool, model, partial)
+    except Exception:
+        patch, still_invalid = {}, invalid
+    return _merge_repair(tool, result, patch, invalid, still_invalid)
+
+
+async def _call_model(system_prompt: str, user_prompt: str, model: str = MODEL, tool: str = "") -> dict:
+    schema = SCHEMAS.get(tool)
+    with stage("prompt_build", tool, model):
+        prepared = prepare_prompt(system_prompt, user_prompt, model, MAX_TOKENS, _compacts(tool))
+    started = time.monotonic()
+    try:
+        with stage("model_call", tool, model):
+            response = await call_with_retries_async(lambda: async_client.chat.completions.create(**_completion_args(
+                model, _messages(system_prompt, prepared), prepared["max_tokens"],
+                response_format(schema, model, tool, system_prompt),
+            )), _quota_tokens(prepared))
+        content = response.choices[0].message.content
+        record_latency(model, time.monotonic() - started)
+        _record_usage(tool, model, prepared, content, response.usage)
+
+        result, invalid = _parse(content, tool, model, schema)
+        if _needs_repair(invalid):
+            result = await _repair(system_prompt, prepared, model, tool, schema, result, invalid)
+        return _finish(result, prepared, model)
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
+        record_latency(model, time.monotonic() - started, ok=False)
         raise Exception(f"AI Analysis failed: {str(e)}")
 
 
-def analyze_with_ai_sync(system_prompt: str, user_prompt: str) -> dict:
-    """Synchronous version for Celery tasks."""
+def _call_model_sync(system_prompt: str, user_prompt: str, on_delta: Optional[Callable[[str], None]] = None,
+                     model: str = MODEL, max_tokens: int = MAX_TOKENS, tool: str = "",
+                     schema: Optional[dict] = None) -> dict:
+    schema = schema or SCHEMAS.get(tool)
+    with stage("prompt_build", tool, model):
+        prepared = prepare_prompt(system_prompt, user_prompt, model, max_tokens, _compacts(tool))
+    started = time.monotonic()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=4000,
-        )
-        content = response.choices[0].message.content
+        with stage("model_call", tool, model):
+            response = call_with_retries(lambda: client.chat.completions.create(**_completion_args(
+                model, _messages(system_prompt, prepared), prepared["max_tokens"],
+                response_format(schema, model, tool, system_prompt), stream=on_delta is not None,
+            )), _quota_tokens(prepared))
+            usage = None
+            if on_delta is None:
+                content = response.choices[0].message.content
+                usage = response.usage
+            else:
+                parts = []
+                try:
+                    for chunk in response:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            parts.append(delta)
+                            on_delta(delta)
+                    on_delta("")
+                finally:
+                    # Closing the connection is what stops generation when on_delta aborts.
+                    response.close()
+                content = "".join(parts)
+        record_latency(model, time.monotonic() - started)
+        _record_usage(tool, model, prepared, content, usage)
 
-        return _parse_ai_json(content)
+        result, invalid = _parse(content, tool, model, schema)
+        if _needs_repair(invalid):
+            result = _repair_sync(system_prompt, prepared, model, tool, schema, result, invalid)
+        return _finish(result, prepared, model)
+    except (UpstreamUnavailableError, JobCancelledError):
+        raise
     except Exception as e:
+        record_latency(model, time.monotonic() - started, ok=False)
         raise Exception(f"AI Analysis failed: {str(e)}")
 
 
+async def analyze_with_ai(system_prompt: str, user_prompt: str, tool: str = "", use_cache: bool = True,
+                          model: Optional[str] = None, latency_target_ms: Optional[int] = None) -> dict:
+    """Call OpenAI API for code analysis.
+
+    The model is chosen by the router unless ``model`` names one this
+    deployment serves. Calls made with a ``tool`` name go through the result
+    cache unless ``use_cache`` is False, and identical calls already in flight
+    anywhere in the deployment are joined instead of repeated.
+    """
+    model = route_model(tool, user_prompt, model, latency_target_ms)
+    if not tool:
+        return await _call_model(system_prompt, user_prompt, model)
+
+    cache_key = make_cache_key(tool, system_prompt, model, TEMPERATURE, user_prompt)
+    if use_cache:
+        cached = await get_cached_async(cache_key)
+        if _cache_lookup(tool, cached):
+            return cached
+
+    result = await run_coalesced_async(cache_key, lambda: _call_model(system_prompt, user_prompt, model, tool))
+    with stage("result_store", tool, model):
+        await set_cached_async(cache_key, result)
+    return result
+
+
+def analyze_with_ai_sync(system_prompt: str, user_prompt: str, tool: str = "", use_cache: bool = True,
+                         on_delta: Optional[Callable[[str], None]] = None, model: Optional[str] = None,
+                         latency_target_ms: Optional[int] = None, max_tokens: int = MAX_TOKENS,
+                         schema: Optional[dict] = None) -> dict:
+    """Synchronous version for Celery tasks.
+
+    ``on_delta`` receives model output as it streams in; cached and coalesced
+    results are returned without replaying deltas. ``max_tokens`` caps the
+    reply, for prompts that ask for more than one tool's output; ``schema``
+    replaces the tool's own response schema for such prompts.
+    """
+    model = route_model(tool, user_prompt, model, latency_target_ms)
+    if not tool:
+        return _call_model_sync(system_prompt, user_prompt, on_delta, model, max_tokens, schema=schema)
+
+    cache_key = make_cache_key(tool, system_prompt, model, TEMPERATURE, user_prompt)
+    if use_cache:
+        cached = get_cached(cache_key)
+        if _cache_lookup(tool, cached):
+            return cached
+
+    result = run_coalesced(
+        cache_key, lambda: _call_model_sync(system_prompt, user_prompt, on_delta, model, max_tokens, tool, schema)
+    )
+    with stage("result_store", tool, model):
+        set_cached(cache_key, result)
+    return result
+
+
+async def stream_with_ai(system_prompt: str, user_prompt: str, tool: str = "", use_cache: bool = True,
+                         model: Optional[str] = None,
+                         latency_target_ms: Optional[int] = None) -> AsyncIterator[Tuple[str, dict]]:
+    """Streaming version of analyze_with_ai.
+
+    Yields ("delta", ...) events with raw model output, ("field", ...) and
+    ("item", ...) events as top-level JSON fields and array elements close,
+    and a final ("done", {"data": ...}) event whose data matches what
+    analyze_with_ai would return.
+    """
+    model = route_model(tool, user_prompt, model, latency_target_ms)
+    cache_key = make_cache_key(tool, system_prompt, model, TEMPERATURE, user_prompt) if tool else None
+    if cache_key and use_cache:
+        cached = await get_cached_async(cache_key)
+        if _cache_lookup(tool, cached):
+            yield "done", {"data": cached, "cached": True}
+            return
+
+    schema = SCHEMAS.get(tool)
+    with stage("prompt_build", tool, model):
+        prepared = prepare_prompt(system_prompt, user_prompt, model, MAX_TOKENS, _compacts(tool))
+    line_map = prepared["line_map"]
+    parser = IncrementalJSONParser()
+    parts = []
+    started = time.monotonic()
+    try:
+        stream = await call_with_retries_async(lambda: async_client.chat.completions.create(**_completion_args(
+            model, _messages(system_prompt, prepared), prepared["max_tokens"],
+            response_format(schema, model, tool, system_prompt), stream=True,
+        )), _quota_tokens(prepared))
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                yield "delta", {"text": delta}
+                for event in parser.feed(delta):
+                    if event[0] == "field":
+                        yield "field", {"name": event[1], "value": remap_lines(event[2], line_map)}
+                    else:
+                        yield "item", {"field": event[1], "index": event[2], "value": remap_lines(event[3], line_map)}
+        finally:
+            # Runs when the consumer stops early too: closing the connection stops generation.
+            await stream.close()
+    except UpstreamUnavailableError:
+        raise
+    except Exception as e:
+        record_latency(model, time.monotonic() - started, ok=False)
+        raise Exception(f"AI Analysis failed: {str(e)}")
+    record_latency(model, time.monotonic() - started)
+    STAGE_SECONDS.labels("model_call", tool, model).observe(time.monotonic() - started)
+    content = "".join(parts)
+    _record_usage(tool, model, prepared, content)
+
+    result, invalid = _parse(content, tool, model, schema)
+    if _needs_repair(invalid):
+        result = await _repair(system_prompt, prepared, model, tool, schema, result, invalid)
+    result = _finish(result, prepared, model)
+    if cache_key:
+        with stage("result_store", tool, model):
+            await set_cached_async(cache_key, result)
+    yield "done", {"data": result, "cached": False}
+
+
+def build_system_prompt(tool: str, principles: list = None, focus_areas: list = None, test_framework: str = "") -> str:
+    """Return the effective system prompt for a tool after option substitution."""
+    if tool == "refactor":
+        selected_principles = principles or ["SOLID", "DRY", "KISS", "Clean Code"]
+        return PROMPTS["refactor"].replace(
+            "SOLID, DRY, KISS, Clean Code",
+            ", ".join(selected_principles)
+        )
+    if tool == "optimize":
+        areas = focus_areas or ["time complexity", "space complexity", "memory usage", "execution speed"]
+        return PROMPTS["optimize"].replace(
+            "time complexity, space complexity, memory usage, execution speed",
+            ", ".join(areas)
+        )
+    if tool == "test":
+        framework = test_framework or "auto-detect"
+        return PROMPTS["test"].replace(
+            "Generate comprehensive test cases",
+            f"Generate comprehensive test cases using {framework} framework"
+        )
+    return PROMPTS[tool]
+
+
 # Tool-specific prompts
 PROMPTS = {
     "debug": """You are an expert code debugger. Analyze the provided code and identify issues.
@@ -167,6 +538,13 @@ Return JSON only; no code fences or extra text.
 {
   "reply": "short, helpful response",
   "items": ["optional list item"]
+}""",
+    "chat-summary": """You maintain a running summary of a conversation about code.
+Merge the existing summary with the new turns. Keep decisions, open questions, names of functions and files, and user preferences; drop pleasantries.
+
+Return JSON only; no code fences or extra text.
+{
+  "summary": "updated summary in at most 200 words"
 }""",
     "generate": """You are an expert code generator. Produce working code based on the user's prompt.
 If a framework is implied, include minimal setup and clear instructions in comments.
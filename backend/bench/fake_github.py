@@ -0,0 +1,196 @@
+"""A stand-in for the parts of the GitHub REST API used by /api/github/export.
+
+Keeps repositories in memory and implements the git data endpoints (refs,
+commits, trees), repository metadata and pull requests. Point the backend at
+it with GITHUB_API_URL=http://localhost:8200; /stats counts calls per route.
+
+    python bench/fake_github.py --port 8200 --repo octo/demo
+"""
+import argparse
+import hashlib
+import json
+from typing import Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def _sha(kind: str, payload) -> str:
+    return hashlib.sha1(f"{kind}\n{json.dumps(payload, sort_keys=True)}".encode()).hexdigest()
+
+
+class FakeRepo:
+    def __init__(self, full_name: str, default_branch: str = "main", empty: bool = False):
+        self.full_name = full_name
+        self.default_branch = default_branch
+        # tree sha -> {path: {"mode", "content"}}
+        self.trees: Dict[str, Dict[str, dict]] = {}
+        self.commits: Dict[str, dict] = {}
+        self.refs: Dict[str, str] = {}
+        self.pulls: List[dict] = []
+        if not empty:
+            root = self.add_tree({
+                "README.md": {"mode": "100644", "content": "# demo\n"},
+                "run.sh": {"mode": "100755", "content": "#!/bin/sh\necho demo\n"},
+            })
+            self.refs[default_branch] = self.add_commit("Initial commit", root, [])
+
+    @property
+    def html_url(self) -> str:
+        return f"https://github.com/{self.full_name}"
+
+    def add_tree(self, files: Dict[str, dict]) -> str:
+        sha = _sha("tree", files)
+        self.trees[sha] = dict(files)
+        return sha
+
+    def add_commit(self, message: str, tree: str, parents: List[str]) -> str:
+        sha = _sha("commit", {"message": message, "tree": tree, "parents": parents, "n": len(self.commits)})
+        self.commits[sha] = {"message": message, "tree": tree, "parents": parents}
+        return sha
+
+    def commit_json(self, sha: str) -> dict:
+        commit = self.commits[sha]
+        return {
+            "sha": sha,
+            "html_url": f"{self.html_url}/commit/{sha}",
+            "message": commit["message"],
+            "tree": {"sha": commit["tree"]},
+            "parents": [{"sha": parent} for parent in commit["parents"]],
+        }
+
+    def is_ancestor(self, ancestor: str, sha: str) -> bool:
+        pending = [sha]
+        while pending:
+            current = pending.pop()
+            if current == ancestor:
+                return True
+            pending.extend(self.commits.get(current, {}).get("parents", []))
+        return False
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse({"message": message}, status_code=status)
+
+
+def create_app(repos: Dict[str, FakeRepo], token: str = "") -> FastAPI:
+    app = FastAPI(title="Fake GitHub")
+    stats: Dict[str, int] = {}
+
+    @app.middleware("http")
+    async def check_auth(request: Request, call_next):
+        if request.url.path != "/stats":
+            route = f"{request.method} {request.url.path}"
+            stats[route] = stats.get(route, 0) + 1
+            if token and request.headers.get("authorization") != f"Bearer {token}":
+                return _error(401, "Bad credentials")
+        return await call_next(request)
+
+    @app.get("/stats")
+    async def get_stats():
+        return {"calls": sum(stats.values()), "routes": stats}
+
+    def lookup(owner: str, name: str):
+        return repos.get(f"{owner}/{name}")
+
+    @app.get("/repos/{owner}/{name}")
+    async def get_repo(owner: str, name: str):
+        repo = lookup(owner, name)
+        if repo is None:
+            return _error(404, "Not Found")
+        return {"full_name": repo.full_name, "default_branch": repo.default_branch, "html_url": repo.html_url}
+
+    @app.get("/repos/{owner}/{name}/git/ref/heads/{branch:path}")
+    async def get_ref(owner: str, name: str, branch: str):
+        repo = lookup(owner, name)
+        if repo is not None and not repo.commits:
+            return _error(409, "Git Repository is empty.")
+        if repo is None or branch not in repo.refs:
+            return _error(404, "Not Found")
+        return {"ref": f"refs/heads/{branch}", "object": {"sha": repo.refs[branch], "type": "commit"}}
+
+    @app.post("/repos/{owner}/{name}/git/refs")
+    async def create_ref(owner: str, name: str, request: Request):
+        repo, body = lookup(owner, name), await request.json()
+        branch = body["ref"].removeprefix("refs/heads/")
+        if repo is None or body["sha"] not in repo.commits:
+            return _error(422, "Object does not exist")
+        if branch in repo.refs:
+            return _error(422, "Reference already exists")
+        repo.refs[branch] = body["sha"]
+        return JSONResponse({"ref": body["ref"], "object": {"sha": body["sha"]}}, status_code=201)
+
+    @app.patch("/repos/{owner}/{name}/git/refs/heads/{branch:path}")
+    async def update_ref(owner: str, name: str, branch: str, request: Request):
+        repo, body = lookup(owner, name), await request.json()
+        if repo is None or branch not in repo.refs:
+            return _error(422, "Reference does not exist")
+        if not body.get("force") and not repo.is_ancestor(repo.refs[branch], body["sha"]):
+            return _error(422, "Update is not a fast forward")
+        repo.refs[branch] = body["sha"]
+        return {"ref": f"refs/heads/{branch}", "object": {"sha": body["sha"]}}
+
+    @app.get("/repos/{owner}/{name}/git/commits/{sha}")
+    async def get_commit(owner: str, name: str, sha: str):
+        repo = lookup(owner, name)
+        if repo is None or sha not in repo.commits:
+            return _error(404, "Not Found")
+        return repo.commit_json(sha)
+
+    @app.post("/repos/{owner}/{name}/git/commits")
+    async def create_commit(owner: str, name: str, request: Request):
+        repo, body = lookup(owner, name), await request.json()
+        if repo is None or body["tree"] not in repo.trees:
+            return _error(422, "Tree does not exist")
+        sha = repo.add_commit(body["message"], body["tree"], body.get("parents", []))
+        return JSONResponse(repo.commit_json(sha), status_code=201)
+
+    @app.get("/repos/{owner}/{name}/git/trees/{sha}")
+    async def get_tree(owner: str, name: str, sha: str):
+        repo = lookup(owner, name)
+        if repo is None or sha not in repo.trees:
+            return _error(404, "Not Found")
+        files = repo.trees[sha]
+        return {"sha": sha, "truncated": False, "tree": [
+            {"path": path, "mode": files[path]["mode"], "type": "blob"} for path in sorted(files)
+        ]}
+
+    @app.post("/repos/{owner}/{name}/git/trees")
+    async def create_tree(owner: str, name: str, request: Request):
+        repo, body = lookup(owner, name), await request.json()
+        if repo is None:
+            return _error(404, "Not Found")
+        files = dict(repo.trees.get(body.get("base_tree"), {}))
+        for entry in body["tree"]:
+            files[entry["path"]] = {"mode": entry["mode"], "content": entry["content"]}
+        sha = repo.add_tree(files)
+        return JSONResponse({"sha": sha, "tree": [{"path": path} for path in sorted(files)]}, status_code=201)
+
+    @app.post("/repos/{owner}/{name}/pulls")
+    async def create_pull(owner: str, name: str, request: Request):
+        repo, body = lookup(owner, name), await request.json()
+        if repo is None or body["head"] not in repo.refs or body["base"] not in repo.refs:
+            return _error(422, "Validation Failed")
+        number = len(repo.pulls) + 1
+        repo.pulls.append({**body, "number": number})
+        return JSONResponse({"number": number, "html_url": f"{repo.html_url}/pull/{number}"}, status_code=201)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--repo", action="append", default=None, help="owner/name to serve (repeatable)")
+    parser.add_argument("--empty-repo", action="append", default=[], help="owner/name to serve with no commits")
+    parser.add_argument("--token", default="", help="require this bearer token")
+    args = parser.parse_args()
+    repos = {name: FakeRepo(name) for name in args.repo or ["octo/demo"]}
+    repos.update({name: FakeRepo(name, empty=True) for name in args.empty_repo})
+    uvicorn.run(create_app(repos, args.token), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""A stand-in for the OpenAI chat-completions API, for load tests and benchmarks.
+
+Point the backend at it with OPENAI_BASE_URL=http://localhost:8100/v1. Replies
+follow the JSON example at the end of each tool's system prompt (or a
+--responses file), after a sampled latency, at a fixed token rate, with
+optional 429/500 injection.
+
+    python bench/fake_openai.py --port 8100 --latency lognormal:800,0.5 --tokens-per-second 80
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Placeholders in the prompt templates that are not valid JSON on their own.
+_BARE_WORDS = re.compile(r":\s*number\b")
+_SECTION = re.compile(r'^Section "([^"]+)": ', re.MULTILINE)
+# Roughly four characters per token, as the backend assumes without tiktoken.
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class FakeConfig:
+    latency: str = "fixed:200"
+    tokens_per_second: float = 100.0
+    rate_429: float = 0.0
+    rate_500: float = 0.0
+    retry_after_ms: int = 1000
+    responses: Dict[str, object] = field(default_factory=dict)
+    seed: Optional[int] = None
+
+
+def sample_latency(spec: str, rng: random.Random) -> float:
+    """Seconds before the first token, from "fixed:ms", "uniform:lo,hi" or "lognormal:median_ms,sigma"."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return values[0] / 1000
+    if kind == "uniform":
+        return rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        return rng.lognormvariate(0, values[1]) * values[0] / 1000
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+def _example(text: str):
+    """The JSON example object at the end of a prompt, or None."""
+    if "{" not in text:
+        return None
+    try:
+        return json.loads(_BARE_WORDS.sub(": 0", text[text.index("{"):]))
+    except json.JSONDecodeError:
+        return None
+
+
+def canned_reply(system_prompt: str, responses: Dict[str, object]) -> str:
+    """Reply text for a system prompt.
+
+    A --responses entry whose key appears in the prompt wins; fused prompts
+    get one example per section; otherwise the prompt's own example is echoed.
+    """
+    for match, response in responses.items():
+        if match in system_prompt:
+            return response if isinstance(response, str) else json.dumps(response)
+
+    sections = _SECTION.split(system_prompt)
+    if len(sections) > 1:
+        names, bodies = sections[1::2], sections[2::2]
+        return json.dumps({name: _example(body) for name, body in zip(names, bodies)})
+
+    example = _example(system_prompt)
+    return json.dumps(example) if example is not None else "This is a canned reply from the fake OpenAI server."
+
+
+def _tokens(text: str) -> List[str]:
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+
+def _error(status: int, message: str, headers: dict = None) -> JSONResponse:
+    return JSONResponse({"error": {"message": message, "type": "fake_error", "code": status}},
+                        status_code=status, headers=headers)
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "streamed": 0, "injected429": 0, "injected500": 0, "completionTokens": 0}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        roll = rng.random()
+        if roll < config.rate_429:
+            stats["injected429"] += 1
+            return _error(429, "Rate limit reached (injected)", {"retry-after-ms": str(config.retry_after_ms)})
+        if roll < config.rate_429 + config.rate_500:
+            stats["injected500"] += 1
+            return _error(500, "Internal server error (injected)")
+
+        messages = body.get("messages") or []
+        system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        tokens = _tokens(canned_reply(system_prompt, config.responses))
+        if body.get("max_tokens"):
+            tokens = tokens[:body["max_tokens"]]
+        stats["completionTokens"] += len(tokens)
+
+        completion_id = f"chatcmpl-{uuid4().hex}"
+        model = body.get("model", "gpt-4o")
+        created = int(time.time())
+        delay = sample_latency(config.latency, rng)
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+        usage = {
+            "prompt_tokens": prompt_chars // CHARS_PER_TOKEN + 1,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_chars // CHARS_PER_TOKEN + 1 + len(tokens),
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay + per_token * len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        stats["streamed"] += 1
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(delay)
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                await asyncio.sleep(per_token)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="fixed:200",
+                        help='time to first token: "fixed:ms", "uniform:lo,hi" or "lognormal:median_ms,sigma"')
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--retry-after-ms", type=int, default=1000)
+    parser.add_argument("--responses", help='JSON file of {"system prompt substring": reply}')
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    responses = {}
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+    config = FakeConfig(
+        latency=args.latency, tokens_per_second=args.tokens_per_second, rate_429=args.rate_429,
+        rate_500=args.rate_500, retry_after_ms=args.retry_after_ms, responses=responses, seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
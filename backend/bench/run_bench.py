@@ -0,0 +1,301 @@
+"""Benchmark the API and workers at fixed concurrency levels.
+
+Run the API and workers against bench/fake_openai.py, then:
+
+    python bench/run_bench.py --concurrency 1,8,32 --requests 64 --save-baseline bench/baseline.json
+    python bench/run_bench.py --concurrency 1,8,32 --requests 64 --compare bench/baseline.json
+
+Reports throughput, p50/p95/p99 latency and peak RSS of the API and worker
+processes for each scenario and level. With --compare, exits non-zero when
+p95 latency or throughput regress by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+TOOLS = ("debug", "refactor", "optimize", "test")
+FINISHED = ("completed", "failed", "cancelled")
+
+SAMPLE_CODE = '''def find_duplicates(items):
+    duplicates = []
+    for i in range(len(items)):
+        for j in range(len(items)):
+            if i != j and items[i] == items[j] and items[i] not in duplicates:
+                duplicates.append(items[i])
+    return duplicates
+
+
+def average(values):
+    return sum(values) / len(values)
+'''
+
+
+def _code(seed: int) -> str:
+    # A unique trailing comment keeps the result cache and request coalescing
+    # from answering repeated requests.
+    return f"{SAMPLE_CODE}\n# bench {seed}\n"
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+# ==================== PROCESS MEMORY ====================
+
+def find_processes() -> Dict[str, List[int]]:
+    """PIDs of local API (uvicorn) and worker (celery) processes, from /proc."""
+    found = {"api": [], "worker": []}
+    if not os.path.isdir("/proc"):
+        return found
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                argv = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        # Skip shells and wrappers whose arguments merely mention the commands.
+        if not os.path.basename(argv[0]).startswith(("python", "uvicorn", "celery", "gunicorn")):
+            continue
+        cmdline = " ".join(argv)
+        if "uvicorn" in cmdline and "main:app" in cmdline:
+            found["api"].append(int(pid))
+        elif "celery" in cmdline and "worker" in cmdline:
+            found["worker"].append(int(pid))
+    return found
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    """Peak RSS per process while a scenario runs."""
+
+    def __init__(self, processes: Dict[str, List[int]], interval: float = 0.5):
+        self.processes = processes
+        self.interval = interval
+        self.peaks: Dict[int, float] = {}
+        self._task = None
+
+    def _sample(self):
+        for pids in self.processes.values():
+            for pid in pids:
+                rss = rss_mb(pid)
+                if rss is not None:
+                    self.peaks[pid] = max(self.peaks.get(pid, 0.0), rss)
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.get_event_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self._sample()
+
+    def report(self) -> Dict[str, dict]:
+        return {
+            role: {str(pid): round(self.peaks[pid], 1) for pid in pids if pid in self.peaks}
+            for role, pids in self.processes.items()
+        }
+
+
+# ==================== SCENARIOS ====================
+
+async def _poll(client: httpx.AsyncClient, job_id: str, interval: float, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = await client.get(f"/api/jobs/{job_id}", params={"fields": "summary"})
+        response.raise_for_status()
+        status = response.json()
+        if status["status"] in FINISHED:
+            return status
+        await asyncio.sleep(interval)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
+
+
+def sync_scenario(args) -> Callable:
+    async def run(client: httpx.AsyncClient, seed: int):
+        tool = TOOLS[seed % len(TOOLS)]
+        response = await client.post(f"/api/{tool}", json={"code": _code(seed), "language": "python"})
+        response.raise_for_status()
+    return run
+
+
+def jobs_scenario(args) -> Callable:
+    async def run(client: httpx.AsyncClient, seed: int):
+        tool = TOOLS[seed % len(TOOLS)]
+        response = await client.post(f"/api/jobs/{tool}", json={"code": _code(seed), "language": "python"})
+        response.raise_for_status()
+        status = await _poll(client, response.json()["job_id"], args.poll_interval, args.job_timeout)
+        if status["status"] != "completed":
+            raise RuntimeError(status.get("error") or status["status"])
+    return run
+
+
+def analyze_all_scenario(args) -> Callable:
+    async def run(client: httpx.AsyncClient, seed: int):
+        response = await client.post("/api/jobs/analyze-all", json={
+            "code": _code(seed), "language": "python", "mode": args.analyze_mode,
+        })
+        response.raise_for_status()
+        status = await _poll(client, response.json()["job_id"], args.poll_interval, args.job_timeout)
+        if status["status"] != "completed":
+            raise RuntimeError(status.get("error") or status["status"])
+    return run
+
+
+SCENARIOS = {"sync": sync_scenario, "jobs": jobs_scenario, "analyze_all": analyze_all_scenario}
+
+
+async def run_level(client: httpx.AsyncClient, scenario: Callable, concurrency: int, total: int,
+                    seeds: List[int]) -> dict:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue = list(seeds[:total])
+
+    async def worker():
+        while queue:
+            seed = queue.pop()
+            started = time.perf_counter()
+            try:
+                await scenario(client, seed)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                key = type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latencyMs": {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (("p50", percentile(latencies, 0.50)), ("p95", percentile(latencies, 0.95)),
+                                ("p99", percentile(latencies, 0.99)))
+        },
+    }
+
+
+async def run_benchmark(args) -> dict:
+    processes = find_processes()
+    rng = random.Random(args.seed)
+    results = {"config": {
+        "api": args.api, "concurrency": args.concurrency, "requests": args.requests,
+        "analyzeMode": args.analyze_mode, "seed": args.seed,
+    }, "scenarios": {}}
+
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=args.api, timeout=args.job_timeout, limits=limits) as client:
+        (await client.get("/api/health")).raise_for_status()
+        for name in args.scenarios:
+            scenario = SCENARIOS[name](args)
+            levels = []
+            for concurrency in args.concurrency:
+                # Warm connections and imports outside the measured run.
+                await scenario(client, rng.randrange(1 << 30))
+                seeds = [rng.randrange(1 << 30) for _ in range(args.requests)]
+                with MemorySampler(processes) as memory:
+                    level = await run_level(client, scenario, concurrency, args.requests, seeds)
+                level["peakRssMb"] = memory.report()
+                levels.append(level)
+                print(_format_level(name, level))
+            results["scenarios"][name] = levels
+    return results
+
+
+def _format_level(name: str, level: dict) -> str:
+    latency = level["latencyMs"]
+    memory = ", ".join(
+        f"{role} {sum(pids.values()):.0f}MB/{len(pids)}p" for role, pids in level["peakRssMb"].items() if pids
+    )
+    errors = sum(level["errors"].values())
+    return (f"{name:<12} c={level['concurrency']:<4} {level['throughput']:>8} req/s  "
+            f"p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms  "
+            f"errors={errors}  {memory}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions against a saved baseline: slower p95 or lower throughput beyond tolerance."""
+    regressions = []
+    for name, levels in results["scenarios"].items():
+        previous = {level["concurrency"]: level for level in baseline.get("scenarios", {}).get(name, [])}
+        for level in levels:
+            before = previous.get(level["concurrency"])
+            if before is None:
+                continue
+            label = f"{name} c={level['concurrency']}"
+            p95, old_p95 = level["latencyMs"]["p95"], before["latencyMs"]["p95"]
+            if p95 is not None and old_p95 and p95 > old_p95 * (1 + tolerance):
+                regressions.append(f"{label}: p95 {old_p95}ms -> {p95}ms")
+            rate, old_rate = level["throughput"], before["throughput"]
+            if rate is not None and old_rate and rate < old_rate * (1 - tolerance):
+                regressions.append(f"{label}: throughput {old_rate} -> {rate} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--scenarios", default="sync,jobs,analyze_all",
+                        help=f"comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--analyze-mode", default="fanout", choices=("fanout", "sequential", "fused"))
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write full results as JSON")
+    parser.add_argument("--save-baseline", help="write results as the baseline for later --compare runs")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression fraction (default 0.10)")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run_benchmark(args))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
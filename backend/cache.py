@@ -0,0 +1,159 @@
+import hashlib
+import json
+import time
+import zlib
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from config import settings
+
+KEY_PREFIX = "result_cache:"
+INDEX_KEY = "result_cache:index"
+STATS_KEY = "result_cache:stats"
+# Marks zlib-compressed values; plain JSON never starts with a NUL byte.
+COMPRESSED_PREFIX = b"\x00z"
+
+redis_client = redis.from_url(settings.REDIS_URL)
+async_redis_client = aioredis.from_url(settings.REDIS_URL)
+
+
+def pack(value) -> bytes:
+    """Serialize a value for Redis, compressing it above RESULT_COMPRESS_MIN_BYTES."""
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    if len(raw) < settings.RESULT_COMPRESS_MIN_BYTES:
+        return raw
+    return COMPRESSED_PREFIX + zlib.compress(raw)
+
+
+def unpack(raw: bytes):
+    """Inverse of pack; also reads plain JSON written before compression."""
+    if raw[:2] == COMPRESSED_PREFIX:
+        raw = zlib.decompress(raw[2:])
+    return json.loads(raw)
+
+
+def normalize_code(text: str) -> str:
+    """Normalize line endings and trailing whitespace so trivial edits share a key."""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def make_cache_key(tool: str, system_prompt: str, model: str, temperature: float, user_prompt: str) -> str:
+    """Content-addressed key for a model call."""
+    digest = hashlib.sha256()
+    for part in (tool, system_prompt, model, repr(temperature), normalize_code(user_prompt)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return KEY_PREFIX + digest.hexdigest()
+
+
+def _is_cacheable(result: dict) -> bool:
+    # Unparsed or partly invalid model output is not worth replaying.
+    return isinstance(result, dict) and "raw" not in result and "invalidFields" not in result
+
+
+def _queue_set(pipe, key: str, result: dict):
+    now = time.time()
+    pipe.set(key, pack(result), ex=settings.RESULT_CACHE_TTL)
+    pipe.zadd(INDEX_KEY, {key: now})
+    pipe.zremrangebyscore(INDEX_KEY, 0, now - settings.RESULT_CACHE_TTL)
+    pipe.zcard(INDEX_KEY)
+
+
+def _overflow(size: int) -> int:
+    return max(0, size - settings.RESULT_CACHE_MAX_ENTRIES)
+
+
+def get_cached(key: str) -> Optional[dict]:
+    """Return a cached result and refresh its recency, or None on a miss."""
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    try:
+        raw = redis_client.get(key)
+        pipe = redis_client.pipeline()
+        if raw is None:
+            pipe.hincrby(STATS_KEY, "misses", 1)
+        else:
+            pipe.hincrby(STATS_KEY, "hits", 1)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+        pipe.execute()
+        return unpack(raw) if raw is not None else None
+    except redis.RedisError:
+        return None
+
+
+def set_cached(key: str, result: dict):
+    """Store a result, evicting the least recently used entries past the cap."""
+    if not settings.RESULT_CACHE_ENABLED or not _is_cacheable(result):
+        return
+    try:
+        pipe = redis_client.pipeline()
+        _queue_set(pipe, key, result)
+        size = pipe.execute()[-1]
+        excess = _overflow(size)
+        if excess:
+            evicted = [member for member, _ in redis_client.zpopmin(INDEX_KEY, excess)]
+            redis_client.delete(*evicted)
+    except redis.RedisError:
+        pass
+
+
+async def get_cached_async(key: str) -> Optional[dict]:
+    """Async variant of get_cached for the API event loop."""
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    try:
+        raw = await async_redis_client.get(key)
+        pipe = async_redis_client.pipeline()
+        if raw is None:
+            pipe.hincrby(STATS_KEY, "misses", 1)
+        else:
+            pipe.hincrby(STATS_KEY, "hits", 1)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+        await pipe.execute()
+        return unpack(raw) if raw is not None else None
+    except redis.RedisError:
+        return None
+
+
+async def set_cached_async(key: str, result: dict):
+    """Async variant of set_cached for the API event loop."""
+    if not settings.RESULT_CACHE_ENABLED or not _is_cacheable(result):
+        return
+    try:
+        pipe = async_redis_client.pipeline()
+        _queue_set(pipe, key, result)
+        size = (await pipe.execute())[-1]
+        excess = _overflow(size)
+        if excess:
+            evicted = [member for member, _ in await async_redis_client.zpopmin(INDEX_KEY, excess)]
+            await async_redis_client.delete(*evicted)
+    except redis.RedisError:
+        pass
+
+
+async def cache_stats() -> dict:
+    """Hit/miss counters and current size of the result cache."""
+    pipe = async_redis_client.pipeline()
+    pipe.hgetall(STATS_KEY)
+    pipe.zcard(INDEX_KEY)
+    counters, entries = await pipe.execute()
+    stats = {k.decode(): int(v) for k, v in counters.items()}
+    hits = stats.get("hits", 0)
+    misses = stats.get("misses", 0)
+    total = hits + misses
+    return {
+        "enabled": settings.RESULT_CACHE_ENABLED,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "entries": entries,
+        "max_entries": settings.RESULT_CACHE_MAX_ENTRIES,
+        "ttl": settings.RESULT_CACHE_TTL,
+    }
+
+
+async def close_cache():
+    await async_redis_client.aclose()
@@ -0,0 +1,69 @@
+import time
+from typing import Callable, Iterable, List, Optional, Set
+
+import redis
+
+from cache import redis_client
+
+CANCEL_KEY = "job:cancelled:{job_id}"
+CANCEL_TTL = 86400
+# How often a streaming call looks for its job's cancel flag.
+CHECK_INTERVAL = 0.5
+
+
+class JobCancelledError(Exception):
+    def __init__(self, job_id: str):
+        super().__init__("Job cancelled")
+        self.job_id = job_id
+
+
+def cancel_jobs(job_ids: Iterable[str]):
+    """Flag jobs (and their subtasks) as cancelled for workers to notice."""
+    pipe = redis_client.pipeline()
+    for job_id in job_ids:
+        if job_id:
+            pipe.set(CANCEL_KEY.format(job_id=job_id), "1", ex=CANCEL_TTL)
+    pipe.execute()
+
+
+def is_cancelled(job_id: Optional[str]) -> bool:
+    if not job_id:
+        return False
+    try:
+        return bool(redis_client.exists(CANCEL_KEY.format(job_id=job_id)))
+    except redis.RedisError:
+        return False
+
+
+def cancelled_among(job_ids: List[str]) -> Set[str]:
+    """The subset of job_ids flagged as cancelled, in one pipelined round-trip."""
+    if not job_ids:
+        return set()
+    try:
+        pipe = redis_client.pipeline()
+        for job_id in job_ids:
+            pipe.exists(CANCEL_KEY.format(job_id=job_id))
+        return {job_id for job_id, flagged in zip(job_ids, pipe.execute()) if flagged}
+    except redis.RedisError:
+        return set()
+
+
+def raise_if_cancelled(job_id: Optional[str]):
+    if is_cancelled(job_id):
+        raise JobCancelledError(job_id)
+
+
+def cancel_watcher(job_id: Optional[str]) -> Optional[Callable[[str], None]]:
+    """An on_delta callback that aborts a streaming model call once its job is cancelled."""
+    if not job_id:
+        return None
+    state = {"last_check": 0.0}
+
+    def on_delta(text: str):
+        now = time.monotonic()
+        if now - state["last_check"] < CHECK_INTERVAL:
+            return
+        state["last_check"] = now
+        raise_if_cancelled(job_id)
+
+    return on_delta
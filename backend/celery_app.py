@@ -1,10 +1,16 @@
 from celery import Celery
+from kombu import Queue
 from config import settings
 
+# Redis results go through a backend that compresses large payloads.
+result_backend = settings.CELERY_RESULT_BACKEND
+if result_backend.startswith("redis"):
+    result_backend = "result_backend:CompressedRedisBackend+" + result_backend
+
 celery_app = Celery(
     "code_assistant",
     broker=settings.CELERY_BROKER_URL,
-    backend=settings.CELERY_RESULT_BACKEND,
+    backend=result_backend,
     include=["tasks"]
 )
 
@@ -18,4 +24,17 @@ celery_app.conf.update(
     task_time_limit=300,  # 5 minutes max per task
     worker_prefetch_multiplier=1,
     task_acks_late=True,
+    # Job results hold several full copies of the code; expire them explicitly.
+    result_expires=settings.JOB_RESULT_TTL,
+    # Interactive single-tool jobs, multi-tool batches and whole-repo scans get
+    # separate queues so workers can be sized (and started) per queue.
+    task_queues=(Queue("interactive"), Queue("batch"), Queue("repo")),
+    task_default_queue="interactive",
+    task_routes={
+        "tasks.analyze_all": {"queue": "batch"},
+        "tasks.merge_analysis_results": {"queue": "batch"},
+        "tasks.fail_fanout_job": {"queue": "batch"},
+        "tasks.analyze_repo": {"queue": "repo"},
+        "tasks.analyze_upload": {"queue": "repo"},
+    },
 )
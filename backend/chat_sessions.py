@@ -0,0 +1,159 @@
+import json
+from typing import List, Optional
+from uuid import uuid4
+
+from config import settings
+from cache import async_redis_client
+from ai_service import analyze_with_ai, PROMPTS
+from token_budget import CODE_END_MARKER, count_tokens
+
+SESSION_KEY = "chat_session:{session_id}"
+HISTORY_KEY = "chat_session:{session_id}:history"
+COMPACT_LOCK_KEY = "chat_session:{session_id}:compacting"
+# Outlasts a summary call with its retries, so a lock is only lost if its holder died.
+COMPACT_LOCK_SECONDS = 300
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_release_lock = async_redis_client.register_script(RELEASE_SCRIPT)
+
+
+async def create_session(code: str = "", language: str = "") -> str:
+    session_id = uuid4().hex
+    key = SESSION_KEY.format(session_id=session_id)
+    pipe = async_redis_client.pipeline()
+    pipe.hset(key, mapping={"code": code, "language": language, "summary": ""})
+    pipe.expire(key, settings.CHAT_SESSION_TTL)
+    await pipe.execute()
+    return session_id
+
+
+async def get_session(session_id: str) -> Optional[dict]:
+    """Session code, language, rolling summary and verbatim recent history; None if expired."""
+    pipe = async_redis_client.pipeline()
+    pipe.hgetall(SESSION_KEY.format(session_id=session_id))
+    pipe.lrange(HISTORY_KEY.format(session_id=session_id), 0, -1)
+    fields, history = await pipe.execute()
+    if not fields:
+        return None
+    session = {k.decode(): v.decode() for k, v in fields.items()}
+    session["history"] = [json.loads(item) for item in history]
+    return session
+
+
+async def update_code(session_id: str, code: str, language: Optional[str] = None) -> bool:
+    key = SESSION_KEY.format(session_id=session_id)
+    if not await async_redis_client.exists(key):
+        return False
+    mapping = {"code": code}
+    if language is not None:
+        mapping["language"] = language
+    await async_redis_client.hset(key, mapping=mapping)
+    await _touch(session_id)
+    return True
+
+
+async def delete_session(session_id: str):
+    await async_redis_client.delete(SESSION_KEY.format(session_id=session_id), HISTORY_KEY.format(session_id=session_id))
+
+
+async def _touch(session_id: str):
+    pipe = async_redis_client.pipeline()
+    pipe.expire(SESSION_KEY.format(session_id=session_id), settings.CHAT_SESSION_TTL)
+    pipe.expire(HISTORY_KEY.format(session_id=session_id), settings.CHAT_SESSION_TTL)
+    await pipe.execute()
+
+
+def build_chat_prompt(message: str, code: str = "", language: str = "", history: List[dict] = None,
+                      summary: str = "") -> str:
+    history_text = "\n".join(f"{item['role']}: {item['content']}" for item in history or [])
+    summary_block = f"\nEarlier Conversation Summary:\n{summary}\n" if summary else ""
+    return f"""
+Language: {language or 'auto-detect'}
+
+Code:
+{code}{CODE_END_MARKER}{summary_block}
+History:
+{history_text or 'None'}
+
+User Question:
+{message}
+"""
+
+
+def _reply_text(result: dict) -> str:
+    if not isinstance(result, dict):
+        return str(result)
+    reply = result.get("reply") or result.get("raw") or ""
+    items = result.get("items") or []
+    return "\n".join([reply] + [f"- {item}" for item in items if item])
+
+
+async def chat_turn(session_id: str, message: str) -> Optional[dict]:
+    """Answer one message using the stored code, summary and recent history."""
+    session = await get_session(session_id)
+    if session is None:
+        return None
+
+    user_prompt = build_chat_prompt(
+        message, session["code"], session["language"], session["history"], session["summary"]
+    )
+    result = await analyze_with_ai(PROMPTS["assistant"], user_prompt, tool="assistant")
+
+    pipe = async_redis_client.pipeline()
+    pipe.rpush(
+        HISTORY_KEY.format(session_id=session_id),
+        json.dumps({"role": "user", "content": message}),
+        json.dumps({"role": "assistant", "content": _reply_text(result)}),
+    )
+    await pipe.execute()
+    await _touch(session_id)
+    return result
+
+
+async def compact_history(session_id: str):
+    """Fold the oldest turns into the rolling summary once history exceeds its token budget.
+
+    Runs after the response is sent, so compaction never adds to turn latency.
+    One compaction runs per session at a time: two overlapping ones would
+    both summarize the same turns and trim the list twice.
+    """
+    lock = COMPACT_LOCK_KEY.format(session_id=session_id)
+    token = uuid4().hex
+    if not await async_redis_client.set(lock, token, nx=True, ex=COMPACT_LOCK_SECONDS):
+        # The running compaction leaves anything newer for the next turn's pass.
+        return
+    try:
+        await _compact(session_id)
+    finally:
+        await _release_lock(keys=[lock], args=[token])
+
+
+async def _compact(session_id: str):
+    session = await get_session(session_id)
+    if session is None:
+        return
+    history = session["history"]
+    history_tokens = sum(count_tokens(item["content"]) for item in history)
+    keep = settings.CHAT_KEEP_RECENT_MESSAGES
+    if history_tokens <= settings.CHAT_HISTORY_TOKEN_BUDGET or len(history) <= keep:
+        return
+
+    oldest = history[:len(history) - keep]
+    transcript = "\n".join(f"{item['role']}: {item['content']}" for item in oldest)
+    user_prompt = f"Existing Summary:\n{session['summary'] or 'None'}\n\nNew Turns:\n{transcript}"
+    result = await analyze_with_ai(PROMPTS["chat-summary"], user_prompt, tool="chat-summary")
+    summary = result.get("summary") if isinstance(result, dict) else None
+    if not summary:
+        return
+
+    pipe = async_redis_client.pipeline()
+    # New turns are appended at the tail, so trimming the head is safe mid-conversation.
+    pipe.ltrim(HISTORY_KEY.format(session_id=session_id), len(oldest), -1)
+    pipe.hset(SESSION_KEY.format(session_id=session_id), "summary", summary)
+    await pipe.execute()
@@ -0,0 +1,234 @@
+import ast
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from config import settings
+from ai_service import analyze_with_ai, analyze_with_ai_sync, MODEL
+from token_budget import fits_in_context
+
+CHUNKED_TOOLS = ("debug", "optimize", "test")
+
+# Fields holding a full copy of the (rewritten) code; merged by concatenation.
+CODE_FIELDS = {"debug": "fixedCode", "optimize": "optimizedCode", "test": "testCode"}
+SEVERITY_ORDER = ["low", "medium", "high", "critical"]
+BLOCK_CLOSERS = ("}", ")", "]", "end")
+
+
+def _python_boundaries(code: str) -> List[int]:
+    """0-based line indexes where top-level Python definitions/statements start."""
+    tree = ast.parse(code)
+    boundaries = []
+    for node in tree.body:
+        start = node.lineno
+        for decorator in getattr(node, "decorator_list", []):
+            start = min(start, decorator.lineno)
+        boundaries.append(start - 1)
+    return boundaries
+
+
+def _generic_boundaries(lines: List[str]) -> List[int]:
+    """Top-level block starts for brace/keyword languages: unindented lines after a blank or closing line."""
+    boundaries = []
+    for i, line in enumerate(lines):
+        if not line.strip() or line[0].isspace() or line.lstrip().startswith(BLOCK_CLOSERS):
+            continue
+        previous = lines[i - 1].strip() if i else ""
+        if i == 0 or not previous or previous.startswith(BLOCK_CLOSERS):
+            boundaries.append(i)
+    return boundaries
+
+
+def split_code(code: str, language: str = "", max_lines: int = None) -> List[Tuple[int, str]]:
+    """Split code into chunks at function/class boundaries.
+
+    Returns (start_line, text) pairs with 1-based start lines. Units longer than
+    max_lines are split at line boundaries.
+    """
+    max_lines = max_lines or settings.CHUNK_MAX_LINES
+    lines = code.split("\n")
+    if len(lines) <= max_lines:
+        return [(1, code)]
+
+    boundaries = None
+    if not language or language.lower() in ("python", "py", "auto-detect"):
+        try:
+            boundaries = _python_boundaries(code)
+        except SyntaxError:
+            boundaries = None
+    if boundaries is None:
+        boundaries = _generic_boundaries(lines)
+
+    starts = sorted(set([0] + [b for b in boundaries if 0 < b < len(lines)]))
+    units = []
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < len(starts) else len(lines)
+        for offset in range(start, end, max_lines):
+            units.append((offset, min(offset + max_lines, end)))
+
+    chunks = []
+    chunk_start, chunk_end = units[0]
+    for start, end in units[1:]:
+        if end - chunk_start <= max_lines:
+            chunk_end = end
+        else:
+            chunks.append((chunk_start, chunk_end))
+            chunk_start, chunk_end = start, end
+    chunks.append((chunk_start, chunk_end))
+
+    return [(start + 1, "\n".join(lines[start:end])) for start, end in chunks]
+
+
+def chunk_prompt(language: str, start_line: int, total_chunks: int, text: str) -> str:
+    if total_chunks == 1:
+        return f"Language: {language or 'auto-detect'}\n\nCode:\n{text}"
+    end_line = start_line + text.count("\n")
+    return (
+        f"Language: {language or 'auto-detect'}\n"
+        f"This is an excerpt (lines {start_line}-{end_line}) of a larger file. "
+        f"Report line numbers relative to the first line of this excerpt.\n\n"
+        f"Code:\n{text}"
+    )
+
+
+def _dedupe(items: list) -> list:
+    seen = set()
+    unique = []
+    for item in items:
+        marker = json.dumps(item, sort_keys=True).lower() if not isinstance(item, str) else item.strip().lower()
+        if marker not in seen:
+            seen.add(marker)
+            unique.append(item)
+    return unique
+
+
+def _merge_values(values: list):
+    """Merge the same field across chunk results: lists concatenate, dicts recurse."""
+    values = [v for v in values if v not in (None, "", [], {})]
+    if not values:
+        return None
+    if all(isinstance(v, list) for v in values):
+        return _dedupe([item for v in values for item in v])
+    if all(isinstance(v, dict) for v in values):
+        keys = []
+        for v in values:
+            keys.extend(k for k in v if k not in keys)
+        return {k: _merge_values([v.get(k) for v in values]) for k in keys}
+    return values[0]
+
+
+def _remap_issues(issues: list, start_line: int) -> list:
+    remapped = []
+    for issue in issues or []:
+        if not isinstance(issue, dict):
+            continue
+        issue = dict(issue)
+        if isinstance(issue.get("line"), int):
+            issue["line"] = issue["line"] + start_line - 1
+        remapped.append(issue)
+    return remapped
+
+
+def merge_results(tool: str, chunks: List[Tuple[int, str]], results: List[dict]) -> dict:
+    """Reduce per-chunk results into one result shaped like a single-call response."""
+    if len(results) == 1:
+        return results[0]
+
+    parsed = [r if isinstance(r, dict) and "raw" not in r else {} for r in results]
+    merged = {}
+
+    summaries = [r.get("summary") for r in parsed if isinstance(r.get("summary"), str) and r.get("summary")]
+    merged["summary"] = " ".join(summaries)
+
+    code_field = CODE_FIELDS[tool]
+    if tool == "test":
+        merged[code_field] = "\n\n".join(r[code_field] for r in parsed if r.get(code_field))
+    else:
+        # Chunks without a rewrite keep their original text so the file stays whole.
+        merged[code_field] = "\n".join(
+            r.get(code_field) or text for r, (_, text) in zip(parsed, chunks)
+        )
+
+    if tool == "debug":
+        issues = []
+        for r, (start_line, _) in zip(parsed, chunks):
+            issues.extend(_remap_issues(r.get("issues"), start_line))
+        unique = {}
+        for issue in issues:
+            key = (issue.get("line"), str(issue.get("issue", "")).strip().lower())
+            unique.setdefault(key, issue)
+        merged["issues"] = sorted(unique.values(), key=lambda i: i.get("line") if isinstance(i.get("line"), int) else 0)
+        severities = [r.get("severity") for r in parsed if r.get("severity") in SEVERITY_ORDER]
+        merged["severity"] = max(severities, key=SEVERITY_ORDER.index) if severities else "low"
+
+    if tool == "optimize":
+        # Report the complexity of the largest chunk; it dominates the file.
+        largest = max(range(len(chunks)), key=lambda i: chunks[i][1].count("\n"))
+        merged["complexity"] = parsed[largest].get("complexity") or _merge_values([r.get("complexity") for r in parsed])
+
+    usages = [r["tokenUsage"] for r in parsed if isinstance(r.get("tokenUsage"), dict)]
+    if usages:
+        merged["tokenUsage"] = {
+            key: sum(usage.get(key, 0) for usage in usages) for key in ("inputTokens", "tokensSaved", "maxTokens")
+        }
+
+    keys = []
+    for r in parsed:
+        keys.extend(k for k in r if k not in keys and k not in merged)
+    for key in keys:
+        merged[key] = _merge_values([r.get(key) for r in parsed])
+
+    merged["chunks"] = [
+        {"startLine": start, "endLine": start + text.count("\n"), "parsed": bool(p)}
+        for p, (start, text) in zip(parsed, chunks)
+    ]
+    return merged
+
+
+def should_chunk(tool: str, code: str, chunked=None) -> bool:
+    """Chunk large inputs for map-reduce tools unless the caller opts out."""
+    if tool not in CHUNKED_TOOLS or chunked is False:
+        return False
+    if chunked is True or code.count("\n") + 1 > settings.CHUNK_MAX_LINES:
+        return True
+    # Inputs that cannot fit the model's context are routed to chunking.
+    return not fits_in_context(code, MODEL)
+
+
+async def analyze_chunked(tool: str, system_prompt: str, code: str, language: str = "",
+                          use_cache: bool = True, model: Optional[str] = None,
+                          latency_target_ms: Optional[int] = None) -> dict:
+    """Analyze chunks concurrently and merge them; latency tracks the slowest chunk."""
+    chunks = split_code(code, language)
+    semaphore = asyncio.Semaphore(settings.CHUNK_CONCURRENCY)
+
+    async def analyze_chunk(start: int, text: str) -> dict:
+        async with semaphore:
+            user_prompt = chunk_prompt(language, start, len(chunks), text)
+            return await analyze_with_ai(system_prompt, user_prompt, tool=tool, use_cache=use_cache,
+                                         model=model, latency_target_ms=latency_target_ms)
+
+    results = await asyncio.gather(*[analyze_chunk(start, text) for start, text in chunks])
+    return merge_results(tool, chunks, list(results))
+
+
+def analyze_chunked_sync(tool: str, system_prompt: str, code: str, language: str = "",
+                         use_cache: bool = True, model: Optional[str] = None,
+                         latency_target_ms: Optional[int] = None,
+                         on_delta: Optional[Callable[[str], None]] = None) -> dict:
+    """Thread-pool version of analyze_chunked for Celery tasks.
+
+    ``on_delta`` is shared by every chunk's call, so it should only watch the
+    stream (e.g. for cancellation) rather than forward text.
+    """
+    chunks = split_code(code, language)
+    with ThreadPoolExecutor(max_workers=min(len(chunks), settings.CHUNK_CONCURRENCY)) as pool:
+        results = list(pool.map(
+            lambda chunk: analyze_with_ai_sync(
+                system_prompt, chunk_prompt(language, chunk[0], len(chunks), chunk[1]), tool=tool, use_cache=use_cache,
+                model=model, latency_target_ms=latency_target_ms, on_delta=on_delta
+            ),
+            chunks,
+        ))
+    return merge_results(tool, chunks, results)
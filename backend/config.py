@@ -11,4 +11,121 @@ class Settings:
     CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
     ALLOWED_ORIGINS: str = os.getenv("ALLOWED_ORIGINS", "*")
 
+    # OpenAI HTTP connection pool
+    OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+    OPENAI_KEEPALIVE_EXPIRY: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    OPENAI_CONNECT_TIMEOUT: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+    OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "120"))
+    # Point at any OpenAI-compatible server (e.g. a local fake for tests)
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")
+
+    # Model routing
+    MODEL_DEFAULT: str = os.getenv("MODEL_DEFAULT", "gpt-4o")
+    MODEL_FAST: str = os.getenv("MODEL_FAST", "gpt-4o-mini")
+    MODEL_ALLOWED: str = os.getenv("MODEL_ALLOWED", "gpt-4-turbo")
+    ROUTER_ENABLED: bool = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+    ROUTER_SMALL_INPUT_TOKENS: int = int(os.getenv("ROUTER_SMALL_INPUT_TOKENS", "1500"))
+    ROUTER_DEGRADED_P95_MS: float = float(os.getenv("ROUTER_DEGRADED_P95_MS", "30000"))
+    ROUTER_MIN_SAMPLES: int = int(os.getenv("ROUTER_MIN_SAMPLES", "20"))
+    ROUTER_WINDOW: int = int(os.getenv("ROUTER_WINDOW", "200"))
+    # A worker's cached latency snapshot is refreshed after this long or this many of its own calls
+    ROUTER_REFRESH_SECONDS: float = float(os.getenv("ROUTER_REFRESH_SECONDS", "10"))
+    ROUTER_REFRESH_SAMPLES: int = int(os.getenv("ROUTER_REFRESH_SAMPLES", "20"))
+
+    # Prompt preparation and token budgeting
+    PROMPT_COMPACTION_ENABLED: bool = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+    PROMPT_MIN_OUTPUT_TOKENS: int = int(os.getenv("PROMPT_MIN_OUTPUT_TOKENS", "512"))
+
+    # Content-addressed result cache
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_TTL: int = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+    # Stored results above this size are zlib-compressed
+    RESULT_COMPRESS_MIN_BYTES: int = int(os.getenv("RESULT_COMPRESS_MIN_BYTES", "1024"))
+
+    # Celery job results
+    JOB_RESULT_TTL: int = int(os.getenv("JOB_RESULT_TTL", "86400"))
+    # Most job ids one bulk status request or event stream may track
+    JOB_STATUS_BATCH_MAX: int = int(os.getenv("JOB_STATUS_BATCH_MAX", "200"))
+
+    # In-flight request coalescing
+    SINGLEFLIGHT_ENABLED: bool = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+    # Longest a follower waits for the leader's result
+    SINGLEFLIGHT_TTL: int = int(os.getenv("SINGLEFLIGHT_TTL", "300"))
+    # Leader lock lifetime, renewed while it computes; a dead leader is replaced after this
+    SINGLEFLIGHT_LOCK_TTL: int = int(os.getenv("SINGLEFLIGHT_LOCK_TTL", "15"))
+
+    # OpenAI quota: shared token bucket, retries and circuit breaker
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    OPENAI_RPM: int = int(os.getenv("OPENAI_RPM", "500"))
+    OPENAI_TPM: int = int(os.getenv("OPENAI_TPM", "300000"))
+    # Longest a sync API request / worker call waits for quota before giving up
+    RATE_LIMIT_MAX_WAIT: float = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+    RATE_LIMIT_WORKER_MAX_WAIT: float = float(os.getenv("RATE_LIMIT_WORKER_MAX_WAIT", "300"))
+    # Waiting calls beyond which new API requests are rejected immediately
+    RATE_LIMIT_MAX_QUEUE: int = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "100"))
+    RETRY_MAX_ATTEMPTS: int = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+    RETRY_BASE_DELAY: float = float(os.getenv("RETRY_BASE_DELAY", "1"))
+    RETRY_MAX_DELAY: float = float(os.getenv("RETRY_MAX_DELAY", "30"))
+    BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    BREAKER_RESET_SECONDS: float = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+    # Map-reduce analysis of large files
+    CHUNK_MAX_LINES: int = int(os.getenv("CHUNK_MAX_LINES", "400"))
+    CHUNK_CONCURRENCY: int = int(os.getenv("CHUNK_CONCURRENCY", "8"))
+
+    # Local static pre-analysis for the debugger
+    PREANALYSIS_ENABLED: bool = os.getenv("PREANALYSIS_ENABLED", "true").lower() == "true"
+    PREANALYSIS_SHORT_CIRCUIT: bool = os.getenv("PREANALYSIS_SHORT_CIRCUIT", "true").lower() == "true"
+
+    # GitHub source fetches
+    SOURCE_MAX_BYTES: int = int(os.getenv("SOURCE_MAX_BYTES", str(2 * 1024 * 1024)))
+    SOURCE_CACHE_TTL: int = int(os.getenv("SOURCE_CACHE_TTL", "86400"))
+    SOURCE_FETCH_TIMEOUT: float = float(os.getenv("SOURCE_FETCH_TIMEOUT", "30"))
+    SOURCE_MAX_CONNECTIONS: int = int(os.getenv("SOURCE_MAX_CONNECTIONS", "50"))
+
+    # GitHub export (git data API); point GITHUB_API_URL at a mock server for tests
+    GITHUB_API_URL: str = os.getenv("GITHUB_API_URL", "https://api.github.com")
+    # Cached repository and branch-head metadata, per token
+    GITHUB_METADATA_TTL: int = int(os.getenv("GITHUB_METADATA_TTL", "300"))
+
+    # Server-side chat sessions
+    CHAT_SESSION_TTL: int = int(os.getenv("CHAT_SESSION_TTL", "86400"))
+    CHAT_HISTORY_TOKEN_BUDGET: int = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+    CHAT_KEEP_RECENT_MESSAGES: int = int(os.getenv("CHAT_KEEP_RECENT_MESSAGES", "6"))
+
+    # Whole-repository analysis
+    REPO_CONCURRENCY: int = int(os.getenv("REPO_CONCURRENCY", "8"))
+    REPO_MAX_FILES: int = int(os.getenv("REPO_MAX_FILES", "500"))
+    REPO_MAX_FILE_BYTES: int = int(os.getenv("REPO_MAX_FILE_BYTES", "200000"))
+    REPO_MAX_ARCHIVE_BYTES: int = int(os.getenv("REPO_MAX_ARCHIVE_BYTES", str(200 * 1024 * 1024)))
+    REPO_RESULTS_TTL: int = int(os.getenv("REPO_RESULTS_TTL", "86400"))
+    REPO_TIME_LIMIT: int = int(os.getenv("REPO_TIME_LIMIT", "3600"))
+
+    # Multipart file uploads; UPLOAD_DIR must be shared by the API and workers
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "/tmp/codeassistant-uploads")
+    UPLOAD_MAX_FILES: int = int(os.getenv("UPLOAD_MAX_FILES", "200"))
+    UPLOAD_MAX_FILE_BYTES: int = int(os.getenv("UPLOAD_MAX_FILE_BYTES", "200000"))
+    UPLOAD_MAX_TOTAL_BYTES: int = int(os.getenv("UPLOAD_MAX_TOTAL_BYTES", str(20 * 1024 * 1024)))
+
+    # Priority queues and per-tenant fairness
+    FAIR_SCHEDULING_ENABLED: bool = os.getenv("FAIR_SCHEDULING_ENABLED", "true").lower() == "true"
+    # Jobs one tenant may have queued or running per queue before the rest are held
+    TENANT_MAX_INFLIGHT: int = int(os.getenv("TENANT_MAX_INFLIGHT", "4"))
+    # How often the API frees slots held past their task's time limit (e.g. by a dead worker); 0 disables it
+    FAIR_SWEEP_SECONDS: float = float(os.getenv("FAIR_SWEEP_SECONDS", "30"))
+
+    # Structured output
+    STRUCTURED_OUTPUT_ENABLED: bool = os.getenv("STRUCTURED_OUTPUT_ENABLED", "true").lower() == "true"
+    # Models that accept json_schema response formats; others get JSON mode
+    STRUCTURED_OUTPUT_MODELS: str = os.getenv("STRUCTURED_OUTPUT_MODELS", "gpt-4o,gpt-4o-mini")
+    # Re-request only the fields of a reply that fail schema validation
+    PARSE_REPAIR_ENABLED: bool = os.getenv("PARSE_REPAIR_ENABLED", "true").lower() == "true"
+
+    # Prometheus metrics
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Port for the Celery worker's metrics exporter; 0 disables it
+    WORKER_METRICS_PORT: int = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
 settings = Settings()
@@ -0,0 +1,149 @@
+import json
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import redis
+
+from cache import redis_client, async_redis_client
+from cancellation import raise_if_cancelled
+
+CHANNEL_PREFIX = "job_events:"
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+# Events streamed as-is; anything else triggers a fresh status snapshot.
+FORWARDED_EVENTS = ("running", "token")
+
+# Keep-alive comment interval so proxies don't drop idle streams.
+HEARTBEAT_SECONDS = 15
+
+
+def publish_job_event(job_id: Optional[str], event: str, data: dict = None):
+    """Publish a job state change; a no-op for inline calls without a job id."""
+    if not job_id:
+        return
+    try:
+        redis_client.publish(CHANNEL_PREFIX + job_id, json.dumps({"event": event, "data": data or {}}))
+    except redis.RedisError:
+        pass
+
+
+def token_publisher(job_id: Optional[str], tool: str, flush_interval: float = 0.25,
+                    flush_chars: int = 256) -> Optional[Callable[[str], None]]:
+    """Return a callback that batches model deltas into "token" events.
+
+    Each flush also checks whether the job was cancelled and raises
+    JobCancelledError, which aborts the model stream.
+    """
+    if not job_id:
+        return None
+    buffer = []
+    state = {"size": 0, "last_flush": time.monotonic()}
+
+    def on_delta(text: str):
+        buffer.append(text)
+        state["size"] += len(text)
+        now = time.monotonic()
+        # An empty delta marks the end of the stream and forces a flush.
+        if text and state["size"] < flush_chars and now - state["last_flush"] < flush_interval:
+            return
+        if buffer:
+            publish_job_event(job_id, "token", {"tool": tool, "delta": "".join(buffer)})
+        buffer.clear()
+        state["size"] = 0
+        state["last_flush"] = now
+        raise_if_cancelled(job_id)
+
+    return on_delta
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def job_event_stream(job_id: str, snapshot: Callable[[], Awaitable[dict]]) -> AsyncIterator[str]:
+    """Yield Server-Sent Events for a job until it completes or fails.
+
+    ``snapshot`` returns the same payload as the polling endpoint; it is sent
+    first so late subscribers see the current state, and again on terminal
+    events so the final payload matches a poll.
+    """
+    pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe before taking the snapshot so no transition is missed.
+        await pubsub.subscribe(CHANNEL_PREFIX + job_id)
+        status = await snapshot()
+        yield format_sse(status["status"], status)
+        if status["status"] in TERMINAL_STATUSES:
+            return
+
+        last_sent = time.monotonic()
+        while True:
+            message = await pubsub.get_message(timeout=1.0)
+            if message is None:
+                if time.monotonic() - last_sent > HEARTBEAT_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                continue
+
+            payload = json.loads(message["data"])
+            event = payload["event"]
+            last_sent = time.monotonic()
+            if event in FORWARDED_EVENTS:
+                yield format_sse(event, {"job_id": job_id, **payload["data"]})
+                continue
+
+            # Results are read back from the result backend so the payload
+            # matches the polling endpoint exactly.
+            status = await snapshot()
+            yield format_sse(status["status"], status)
+            if status["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        await pubsub.aclose()
+
+
+async def jobs_event_stream(job_ids: List[str],
+                            snapshot: Callable[[List[str]], Awaitable[Dict[str, dict]]]) -> AsyncIterator[str]:
+    """Yield Server-Sent Events for several jobs over one stream until all finish.
+
+    Like job_event_stream, but ``snapshot`` takes the job ids that changed and
+    returns their payloads in one call; events that arrive together are
+    answered with a single snapshot.
+    """
+    pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(*(CHANNEL_PREFIX + job_id for job_id in job_ids))
+        remaining = set(job_ids)
+        changed = list(job_ids)
+        last_sent = time.monotonic()
+        while True:
+            if changed:
+                for job_id, status in (await snapshot(changed)).items():
+                    yield format_sse(status["status"], status)
+                    if status["status"] in TERMINAL_STATUSES and job_id in remaining:
+                        remaining.discard(job_id)
+                        await pubsub.unsubscribe(CHANNEL_PREFIX + job_id)
+                if not remaining:
+                    return
+                changed = []
+                last_sent = time.monotonic()
+
+            message = await pubsub.get_message(timeout=1.0)
+            if message is None:
+                if time.monotonic() - last_sent > HEARTBEAT_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                continue
+
+            # Drain whatever else is already waiting so a burst costs one snapshot.
+            while message is not None:
+                job_id = message["channel"].decode()[len(CHANNEL_PREFIX):]
+                payload = json.loads(message["data"])
+                if job_id in remaining:
+                    if payload["event"] in FORWARDED_EVENTS:
+                        yield format_sse(payload["event"], {"job_id": job_id, **payload["data"]})
+                    elif job_id not in changed:
+                        changed.append(job_id)
+                message = await pubsub.get_message(timeout=0)
+            last_sent = time.monotonic()
+    finally:
+        await pubsub.aclose()
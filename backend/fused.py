@@ -0,0 +1,81 @@
+from typing import Callable, Dict, List, Optional
+
+from ai_service import analyze_with_ai_sync, MAX_TOKENS
+from model_router import route_model
+from schemas import fused_schema, invalid_fields, SCHEMAS
+from token_budget import output_limit
+
+FUSED_TOOL = "fused"
+
+FUSED_PROMPT = """You are an expert code reviewer performing several analyses of the same code in one pass.
+Each section below describes one analysis and the JSON object it must produce.
+
+Return JSON only; no code fences or extra text.
+Return one object with exactly these top-level keys, each holding that section's JSON object:
+{keys}"""
+
+
+def _instructions(system_prompt: str) -> str:
+    """A tool prompt without its own "Return JSON only" wrapper."""
+    head = system_prompt[:system_prompt.index("{")]
+    lines = [line for line in head.splitlines() if "JSON" not in line]
+    return "\n".join(lines).strip()
+
+
+def build_fused_prompt(system_prompts: Dict[str, str]) -> str:
+    """Combine several tools' system prompts into one that asks for every section."""
+    parts = [FUSED_PROMPT.format(keys=", ".join(f'"{tool}"' for tool in system_prompts))]
+    for tool, system_prompt in system_prompts.items():
+        template = system_prompt[system_prompt.index("{"):]
+        parts.append(f'Section "{tool}": {_instructions(system_prompt)}\n{template}')
+    return "\n\n".join(parts)
+
+
+def _batches(tools: List[str], model: str) -> List[List[str]]:
+    """Split tools so each fused call's reply budget (MAX_TOKENS per tool) fits the model's output limit."""
+    per_call = max(1, output_limit(model) // MAX_TOKENS)
+    return [tools[start:start + per_call] for start in range(0, len(tools), per_call)]
+
+
+def analyze_fused_sync(system_prompts: Dict[str, str], user_prompt: str, use_cache: bool = True,
+                       on_delta: Optional[Callable[[str], None]] = None, model: Optional[str] = None,
+                       latency_target_ms: Optional[int] = None) -> dict:
+    """Run several tools in one model call, re-issuing only sections that come back unusable.
+
+    Tools are split over several fused calls when their combined reply would
+    not fit the routed model's output limit. Every tool must have a schema in
+    schemas.SCHEMAS; sections are checked against it. Returns {"data": {tool:
+    section}, "reissued": [tools], "inputTokens": n} where inputTokens covers
+    the fused calls and any re-issued calls.
+    """
+    tools: List[str] = list(system_prompts)
+    fused_model = route_model(FUSED_TOOL, user_prompt, model, latency_target_ms)
+    fused, input_tokens = {}, 0
+    for batch in _batches(tools, fused_model):
+        result = analyze_with_ai_sync(
+            build_fused_prompt({tool: system_prompts[tool] for tool in batch}), user_prompt, tool=FUSED_TOOL,
+            use_cache=use_cache, on_delta=on_delta, model=fused_model,
+            max_tokens=MAX_TOKENS * len(batch),
+            schema=fused_schema(batch),
+        )
+        fused.update(result)
+        input_tokens += (result.get("tokenUsage") or {}).get("inputTokens", 0)
+
+    data, reissued = {}, []
+    for tool in tools:
+        section = fused.get(tool)
+        # The same schemas the model was constrained to: a section passes only if it is complete.
+        if not invalid_fields(section, SCHEMAS[tool]):
+            data[tool] = section
+            continue
+
+        reissued.append(tool)
+        try:
+            section = analyze_with_ai_sync(system_prompts[tool], user_prompt, tool=tool, use_cache=use_cache,
+                                           model=model, latency_target_ms=latency_target_ms)
+            input_tokens += (section.get("tokenUsage") or {}).get("inputTokens", 0)
+            data[tool] = section
+        except Exception as e:
+            data[tool] = {"error": str(e)}
+
+    return {"data": data, "reissued": reissued, "inputTokens": input_tokens}
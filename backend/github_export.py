@@ -0,0 +1,263 @@
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import redis
+
+from config import settings
+from cache import async_redis_client
+from metrics import stage
+
+META_KEY = "github_meta:{key}"
+FILE_MODE = "100644"
+EXECUTABLE_MODE = "100755"
+EXPORT_MODES = (FILE_MODE, EXECUTABLE_MODE)
+
+
+class GitHubAPIError(Exception):
+    """A GitHub API call failed; status_code is GitHub's status (or 502 if it was unreachable)."""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=settings.GITHUB_API_URL.rstrip("/"),
+        headers={"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"},
+        limits=httpx.Limits(max_connections=settings.SOURCE_MAX_CONNECTIONS, max_keepalive_connections=20),
+        timeout=httpx.Timeout(settings.SOURCE_FETCH_TIMEOUT, connect=10),
+    )
+
+
+# Shared keep-alive client; the token is sent per request.
+client = _client()
+
+
+async def close_github_clients():
+    await client.aclose()
+
+
+async def _request(method: str, path: str, token: str, body: dict = None) -> dict:
+    try:
+        response = await client.request(method, path, json=body, headers={"Authorization": f"Bearer {token}"})
+    except httpx.HTTPError as e:
+        raise GitHubAPIError(f"GitHub API unreachable: {e}")
+    if response.status_code >= 400:
+        try:
+            message = response.json().get("message") or response.text
+        except ValueError:
+            message = response.text
+        raise GitHubAPIError(f"GitHub API {method} {path} failed: {message}", response.status_code)
+    return response.json()
+
+
+# ----- per-token metadata cache -----
+
+def _meta_key(token: str, repo: str) -> str:
+    # Hashing keeps tokens out of Redis and keeps one token's view of a
+    # private repo from being served to another.
+    return META_KEY.format(key=hashlib.sha256(f"{token}\n{repo}".encode()).hexdigest())
+
+
+async def _cached_meta(token: str, repo: str) -> dict:
+    try:
+        meta = await async_redis_client.hgetall(_meta_key(token, repo))
+    except redis.RedisError:
+        return {}
+    return {k.decode(): json.loads(v) for k, v in meta.items()}
+
+
+async def _cache_meta(token: str, repo: str, fields: dict):
+    key = _meta_key(token, repo)
+    try:
+        pipe = async_redis_client.pipeline()
+        pipe.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+        pipe.expire(key, settings.GITHUB_METADATA_TTL)
+        await pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+async def _repo_info(token: str, repo: str, meta: dict) -> dict:
+    if "repo" not in meta:
+        info = await _request("GET", f"/repos/{repo}", token)
+        meta["repo"] = {"default_branch": info["default_branch"], "html_url": info["html_url"]}
+        await _cache_meta(token, repo, {"repo": meta["repo"]})
+    return meta["repo"]
+
+
+def _is_empty_repo(error: GitHubAPIError) -> bool:
+    # GitHub answers git data reads on a repository without commits with 409.
+    return error.status_code == 409
+
+
+async def _branch_head(token: str, repo: str, branch: str, meta: dict, base_branch: str = "",
+                       refresh: bool = False) -> Optional[dict]:
+    """{"commit", "tree"} at the tip of a branch, creating the branch from base_branch if it is missing.
+
+    None means the repository has no commits yet: the export makes the first one.
+    """
+    field = f"branch:{branch}"
+    if field in meta and not refresh:
+        return meta[field]
+    try:
+        ref = await _request("GET", f"/repos/{repo}/git/ref/heads/{branch}", token)
+        commit = await _request("GET", f"/repos/{repo}/git/commits/{ref['object']['sha']}", token)
+        head = {"commit": commit["sha"], "tree": commit["tree"]["sha"]}
+    except GitHubAPIError as e:
+        if _is_empty_repo(e):
+            return None
+        if e.status_code != 404:
+            raise
+        base = base_branch or (await _repo_info(token, repo, meta))["default_branch"]
+        if base == branch:
+            # The default branch itself is missing: only the case in an empty repository.
+            return None
+        head = await _branch_head(token, repo, base, meta, refresh=refresh)
+        if head is None:
+            return None
+        await _request("POST", f"/repos/{repo}/git/refs", token, {"ref": f"refs/heads/{branch}", "sha": head["commit"]})
+    meta[field] = head
+    await _cache_meta(token, repo, {field: head})
+    return head
+
+
+async def _tree_modes(token: str, repo: str, head: Optional[dict], meta: dict) -> Dict[str, str]:
+    """Modes of files in the head tree that are not plain files (executables, symlinks).
+
+    Only read when an exported file has no explicit mode. The result is cached
+    for the latest tree, and kept current by export_files.
+    """
+    known = _known_modes(head, meta)
+    if known is not None:
+        return known
+    tree = await _request("GET", f"/repos/{repo}/git/trees/{head['tree']}?recursive=1", token)
+    modes = {
+        entry["path"]: entry["mode"] for entry in tree["tree"]
+        if entry["type"] == "blob" and entry["mode"] != FILE_MODE
+    }
+    meta["modes"] = {"tree": head["tree"], "modes": modes}
+    await _cache_meta(token, repo, {"modes": meta["modes"]})
+    return modes
+
+
+# ----- export -----
+
+def _tree_entries(files: List[Dict[str, str]]) -> List[dict]:
+    entries = {}
+    for item in files:
+        path = item["path"].strip().lstrip("/")
+        if not path or any(part in ("", ".", "..") for part in path.split("/")):
+            raise GitHubAPIError(f"Invalid file path: {item['path']!r}", 400)
+        mode = item.get("mode")
+        if mode is not None and mode not in EXPORT_MODES:
+            raise GitHubAPIError(f"Invalid mode for {path}: {mode!r} (use {' or '.join(EXPORT_MODES)})", 400)
+        # Inline content creates the blobs along with the tree: no call per file.
+        entries[path] = {"path": path, "mode": mode, "type": "blob", "content": item["content"]}
+    return list(entries.values())
+
+
+def _known_modes(head: Optional[dict], meta: dict) -> Optional[Dict[str, str]]:
+    """A copy of the cached non-plain modes of head's tree, or None if they aren't known."""
+    if head is None:
+        return {}
+    cached = meta.get("modes")
+    if cached and cached["tree"] == head["tree"]:
+        return dict(cached["modes"])
+    return None
+
+
+def _with_modes(entries: List[dict], existing: Dict[str, str]) -> List[dict]:
+    """Fill in modes not given explicitly: an existing file keeps its mode, a new one is a plain file."""
+    return [{**entry, "mode": entry["mode"] or existing.get(entry["path"], FILE_MODE)} for entry in entries]
+
+
+async def _commit(token: str, repo: str, head: Optional[dict], entries: List[dict], message: str) -> dict:
+    tree_body = {"tree": entries}
+    if head is not None:
+        tree_body["base_tree"] = head["tree"]
+    tree = await _request("POST", f"/repos/{repo}/git/trees", token, tree_body)
+    return await _request("POST", f"/repos/{repo}/git/commits", token, {
+        "message": message, "tree": tree["sha"], "parents": [head["commit"]] if head is not None else [],
+    })
+
+
+async def _commit_to_branch(token: str, repo: str, branch: str, head: Optional[dict], entries: List[dict],
+                            message: str, meta: dict) -> Tuple[dict, List[dict]]:
+    """Commit on head and move the branch to it; with no head, the commit is the first and creates the branch."""
+    if any(entry["mode"] is None for entry in entries):
+        entries = _with_modes(entries, await _tree_modes(token, repo, head, meta))
+    commit = await _commit(token, repo, head, entries, message)
+    if head is None:
+        await _request("POST", f"/repos/{repo}/git/refs", token, {"ref": f"refs/heads/{branch}", "sha": commit["sha"]})
+    else:
+        await _request("PATCH", f"/repos/{repo}/git/refs/heads/{branch}", token,
+                       {"sha": commit["sha"], "force": False})
+    return commit, entries
+
+
+async def export_files(token: str, repo: str, branch: str, files: List[Dict[str, str]], message: str,
+                       base_branch: str = "", pull_request: Optional[dict] = None) -> dict:
+    """Commit many files to a branch as one commit through the git data API.
+
+    With warm metadata this is three calls (tree, commit, ref update) however
+    many files there are. The cached branch head is only a guess: if the branch
+    moved, the fast-forward update is rejected and the commit is rebuilt on the
+    real head once. Files keep their mode in the branch (e.g. executables)
+    unless given one ("100644" or "100755"). In a repository without commits
+    the export is the root commit and creates the branch. pull_request
+    ({"title", "body", "base"}) opens a PR from the branch afterwards.
+    """
+    entries = _tree_entries(files)
+    if not entries:
+        raise GitHubAPIError("No files to export", 400)
+
+    with stage("github_export"):
+        meta = await _cached_meta(token, repo)
+        info = await _repo_info(token, repo, meta)
+        head = await _branch_head(token, repo, branch, meta, base_branch)
+        try:
+            commit, committed = await _commit_to_branch(token, repo, branch, head, entries, message, meta)
+        except GitHubAPIError as e:
+            if e.status_code not in (409, 422):
+                raise
+            head = await _branch_head(token, repo, branch, meta, base_branch, refresh=True)
+            commit, committed = await _commit_to_branch(token, repo, branch, head, entries, message, meta)
+        fields = {f"branch:{branch}": {"commit": commit["sha"], "tree": commit["tree"]["sha"]}}
+        modes = _known_modes(head, meta)
+        if modes is not None:
+            # The new tree's modes follow from the old ones, so the next export needn't read the tree.
+            for entry in committed:
+                if entry["mode"] == FILE_MODE:
+                    modes.pop(entry["path"], None)
+                else:
+                    modes[entry["path"]] = entry["mode"]
+            fields["modes"] = {"tree": commit["tree"]["sha"], "modes": modes}
+        await _cache_meta(token, repo, fields)
+
+        data = {
+            "commit_sha": commit["sha"],
+            "commit_url": commit.get("html_url") or f"{info['html_url']}/commit/{commit['sha']}",
+            "files": [
+                {"path": entry["path"], "file_url": f"{info['html_url']}/blob/{branch}/{entry['path']}"}
+                for entry in entries
+            ],
+        }
+        if pull_request:
+            # The commit has landed either way; report a failed PR alongside it.
+            try:
+                data.update(await create_pull_request(
+                    token, repo, pull_request["title"], pull_request.get("body") or "", branch,
+                    pull_request.get("base") or base_branch or info["default_branch"],
+                ))
+            except GitHubAPIError as e:
+                data["pr_error"] = str(e)
+    return data
+
+
+async def create_pull_request(token: str, repo: str, title: str, body: str, head: str, base: str) -> dict:
+    pr = await _request("POST", f"/repos/{repo}/pulls", token, {"title": title, "body": body, "head": head, "base": base})
+    return {"pr_url": pr["html_url"], "pr_number": pr["number"]}
@@ -0,0 +1,166 @@
+import hashlib
+
+import httpx
+import redis
+
+from config import settings
+from cache import redis_client, async_redis_client
+from metrics import stage
+
+CACHE_PREFIX = "source_cache:"
+
+
+def to_raw_url(url: str) -> str:
+    """Convert a github.com blob URL to its raw.githubusercontent.com form."""
+    if "github.com" in url and "raw.githubusercontent.com" not in url:
+        return url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+    return url
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=settings.SOURCE_MAX_CONNECTIONS, max_keepalive_connections=20)
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.SOURCE_FETCH_TIMEOUT, connect=10)
+
+
+# Shared keep-alive clients, one per execution model.
+client = httpx.Client(limits=_limits(), timeout=_timeout(), follow_redirects=True)
+async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout(), follow_redirects=True)
+
+
+async def close_fetch_clients():
+    await async_client.aclose()
+    client.close()
+
+
+def _cache_key(url: str) -> str:
+    return CACHE_PREFIX + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _decode(entry: dict) -> dict:
+    return {k.decode(): v for k, v in entry.items()}
+
+
+def _conditional_headers(entry: dict) -> dict:
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"].decode()
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"].decode()
+    return headers
+
+
+def _entry_mapping(response: httpx.Response, body: bytes) -> dict:
+    return {
+        "etag": response.headers.get("etag", ""),
+        "last_modified": response.headers.get("last-modified", ""),
+        "body": body,
+    }
+
+
+class SourceTooLargeError(ValueError):
+    """The source file is bigger than SOURCE_MAX_BYTES; the API answers 413."""
+
+
+def _too_large() -> SourceTooLargeError:
+    return SourceTooLargeError(f"Source file exceeds {settings.SOURCE_MAX_BYTES} bytes")
+
+
+def _check_length(response: httpx.Response):
+    length = response.headers.get("content-length")
+    if length and length.isdigit() and int(length) > settings.SOURCE_MAX_BYTES:
+        raise _too_large()
+
+
+def fetch_source(url: str) -> str:
+    """Fetch a source file, revalidating a cached copy with a conditional GET."""
+    with stage("github_fetch"):
+        return _fetch_source(url)
+
+
+async def fetch_source_async(url: str) -> str:
+    """Async variant of fetch_source for the API event loop."""
+    with stage("github_fetch"):
+        return await _fetch_source_async(url)
+
+
+def _fetch_source(url: str) -> str:
+    raw_url = to_raw_url(url)
+    key = _cache_key(raw_url)
+    try:
+        entry = _decode(redis_client.hgetall(key))
+    except redis.RedisError:
+        entry = {}
+
+    with client.stream("GET", raw_url, headers=_conditional_headers(entry)) as response:
+        if response.status_code == 304 and entry.get("body") is not None:
+            body = entry["body"]
+            try:
+                redis_client.expire(key, settings.SOURCE_CACHE_TTL)
+            except redis.RedisError:
+                pass
+            return body.decode("utf-8", errors="replace")
+
+        response.raise_for_status()
+        _check_length(response)
+        chunks = []
+        size = 0
+        for block in response.iter_bytes():
+            size += len(block)
+            if size > settings.SOURCE_MAX_BYTES:
+                raise _too_large()
+            chunks.append(block)
+        body = b"".join(chunks)
+
+        if response.headers.get("etag") or response.headers.get("last-modified"):
+            try:
+                pipe = redis_client.pipeline()
+                pipe.hset(key, mapping=_entry_mapping(response, body))
+                pipe.expire(key, settings.SOURCE_CACHE_TTL)
+                pipe.execute()
+            except redis.RedisError:
+                pass
+
+    return body.decode("utf-8", errors="replace")
+
+
+async def _fetch_source_async(url: str) -> str:
+    raw_url = to_raw_url(url)
+    key = _cache_key(raw_url)
+    try:
+        entry = _decode(await async_redis_client.hgetall(key))
+    except redis.RedisError:
+        entry = {}
+
+    async with async_client.stream("GET", raw_url, headers=_conditional_headers(entry)) as response:
+        if response.status_code == 304 and entry.get("body") is not None:
+            body = entry["body"]
+            try:
+                await async_redis_client.expire(key, settings.SOURCE_CACHE_TTL)
+            except redis.RedisError:
+                pass
+            return body.decode("utf-8", errors="replace")
+
+        response.raise_for_status()
+        _check_length(response)
+        chunks = []
+        size = 0
+        async for block in response.aiter_bytes():
+            size += len(block)
+            if size > settings.SOURCE_MAX_BYTES:
+                raise _too_large()
+            chunks.append(block)
+        body = b"".join(chunks)
+
+        if response.headers.get("etag") or response.headers.get("last-modified"):
+            try:
+                pipe = async_redis_client.pipeline()
+                pipe.hset(key, mapping=_entry_mapping(response, body))
+                pipe.expire(key, settings.SOURCE_CACHE_TTL)
+                await pipe.execute()
+            except redis.RedisError:
+                pass
+
+    return body.decode("utf-8", errors="replace")
@@ -1,19 +1,79 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import Callable, Dict, Optional, List
+from uuid import uuid4
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+import httpx
 import redis
-from celery.result import AsyncResult
+from celery.states import READY_STATES
 
 from config import settings
 from celery_app import celery_app
-from tasks import debug_code, refactor_code, optimize_code, test_code, generate_pr, analyze_all
-from ai_service import analyze_with_ai, PROMPTS
+from tasks import (
+    debug_code, refactor_code, optimize_code, test_code, generate_pr, analyze_all, analyze_repo, analyze_upload,
+    TOOL_TASKS,
+)
+from ai_service import analyze_with_ai, stream_with_ai, build_system_prompt, close_ai_clients, PROMPTS, MODEL, TEMPERATURE
+from cache import async_redis_client, cache_stats, close_cache, make_cache_key
+from singleflight import claim_job
+from events import job_event_stream, jobs_event_stream, format_sse, publish_job_event
+from chunking import should_chunk, analyze_chunked
+from repo_pipeline import get_file_results
+from uploads import UploadError, receive_upload, remove_upload
+from github_fetch import SourceTooLargeError, fetch_source_async, close_fetch_clients
+from github_export import GitHubAPIError, export_files, create_pull_request, close_github_clients
+from pr_diff import MAX_CONTEXT_LINES, build_pr_prompt
+from projection import project_result
+from chat_sessions import (
+    build_chat_prompt, create_session, get_session, update_code, delete_session, chat_turn, compact_history
+)
+from token_budget import PromptTooLargeError
+from rate_limit import UpstreamUnavailableError, RateLimitedError, rate_limit_stats
+from cancellation import cancel_jobs, cancelled_among, is_cancelled
+from preanalysis import pre_analyze, is_blocking, blocking_result, with_hints, merge_issues, preanalysis_stats
+from model_router import router_stats
+from task_states import TaskState, task_state, fetch_task_states
+from metrics import (
+    track_timings, server_timing_header, render_metrics, CONTENT_TYPE_LATEST, QUEUE_DEPTH, QUEUE_HELD
+)
+from scheduling import (
+    submit_job, release_job, resolve_queue, sweep_stale_slots, tenant_id, queue_stats,
+    INTERACTIVE_QUEUE, BATCH_QUEUE, REPO_QUEUE,
+)
+
+
+async def _sweep_slots_periodically():
+    while True:
+        await asyncio.sleep(settings.FAIR_SWEEP_SECONDS)
+        await run_in_threadpool(sweep_stale_slots)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(_sweep_slots_periodically()) if settings.FAIR_SWEEP_SECONDS > 0 else None
+    yield
+    if sweeper is not None:
+        sweeper.cancel()
+    await close_ai_clients()
+    await close_fetch_clients()
+    await close_github_clients()
+    await close_cache()
+
 
 app = FastAPI(
     title="Code Assistant API",
     description="AI-powered code analysis: Debug, Refactor, Optimize, Test, and PR Generation",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -25,10 +85,20 @@ app.add_middleware(
     allow_credentials=not allow_all_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# Redis connection
-redis_client = redis.from_url(settings.REDIS_URL)
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Report where a request's time went (fetch, prompt build, model call, ...) in a Server-Timing header."""
+    started = time.perf_counter()
+    with track_timings() as timings:
+        response = await call_next(request)
+    # Streaming responses send headers before any stage has run.
+    if settings.METRICS_ENABLED and not response.headers.get("content-type", "").startswith("text/event-stream"):
+        response.headers["Server-Timing"] = server_timing_header(timings, time.perf_counter() - started)
+    return response
 
 
 # Request/Response Models
@@ -36,6 +106,14 @@ class CodeRequest(BaseModel):
     code: str = ""
     language: Optional[str] = ""
     github_url: Optional[str] = ""
+    no_cache: Optional[bool] = False
+    # None chunks automatically above CHUNK_MAX_LINES (debug/optimize/test only)
+    chunked: Optional[bool] = None
+    # None lets the router pick a model from the tool, input size and latency target
+    model: Optional[str] = None
+    latency_target_ms: Optional[int] = None
+    # Job queue for /api/jobs/*: interactive, batch or repo
+    priority: Optional[str] = None
 
 
 class RefactorRequest(CodeRequest):
@@ -56,19 +134,72 @@ class PRRequest(BaseModel):
     changes: Optional[str] = ""
     language: Optional[str] = ""
     title: Optional[str] = ""
+    no_cache: Optional[bool] = False
+    filename: Optional[str] = ""
+    context_lines: int = Field(3, ge=0, le=MAX_CONTEXT_LINES)
+    priority: Optional[str] = None
+
+
+class PRFile(BaseModel):
+    filename: str
+    original_code: str = ""
+    modified_code: str = ""
+
+
+class MultiFilePRRequest(BaseModel):
+    files: List[PRFile]
+    changes: Optional[str] = ""
+    language: Optional[str] = ""
+    title: Optional[str] = ""
+    no_cache: Optional[bool] = False
+    context_lines: int = Field(3, ge=0, le=MAX_CONTEXT_LINES)
+    priority: Optional[str] = None
 
 
 class MultiAnalysisRequest(CodeRequest):
     tools: Optional[List[str]] = None
+    mode: Optional[str] = "fanout"
+
+
+class RepoAnalysisRequest(BaseModel):
+    repo_url: str
+    ref: Optional[str] = ""
+    tools: Optional[List[str]] = None
+    languages: Optional[List[str]] = None
+    max_file_bytes: Optional[int] = None
+    max_files: Optional[int] = None
+    github_token: Optional[str] = ""
+    no_cache: Optional[bool] = False
+    priority: Optional[str] = None
+
+
+class ExportFile(BaseModel):
+    path: str
+    content: str
+    # "100644" or "100755"; by default an existing file keeps its mode and a new one is 100644
+    mode: Optional[str] = None
+
+
+class ExportPullRequest(BaseModel):
+    title: str
+    body: Optional[str] = ""
+    # Defaults to base_branch, else the repository's default branch
+    base: Optional[str] = ""
 
 
 class GitHubExportRequest(BaseModel):
-    code: str
-    filename: str
+    # One file (code + filename) or many (files); either way one commit
+    code: Optional[str] = None
+    filename: Optional[str] = None
+    mode: Optional[str] = None
+    files: Optional[List[ExportFile]] = None
     repo: str
     branch: Optional[str] = "main"
+    # Branch to create `branch` from if it does not exist (default: the repository's default branch)
+    base_branch: Optional[str] = ""
     commit_message: Optional[str] = ""
     github_token: str
+    create_pr: Optional[ExportPullRequest] = None
 
 
 class GitHubPRRequest(BaseModel):
@@ -83,6 +214,17 @@ class GitHubPRRequest(BaseModel):
 class JobResponse(BaseModel):
     job_id: str
     status: str
+    coalesced: Optional[bool] = False
+    queue: Optional[str] = None
+    # Uploaded files (or zip members) left out of the analysis, as {"path", "reason"}
+    skipped: Optional[List[Dict[str, str]]] = None
+
+
+class JobStatusBatchRequest(BaseModel):
+    job_ids: List[str]
+    # job_id -> "version" from an earlier response; matching jobs return no result
+    since: Optional[Dict[str, str]] = None
+    fields: Optional[str] = None
 
 
 class ChatMessage(BaseModel):
@@ -95,6 +237,16 @@ class ChatRequest(BaseModel):
     code: Optional[str] = ""
     language: Optional[str] = ""
     history: Optional[List[ChatMessage]] = None
+    session_id: Optional[str] = None
+
+
+class ChatSessionRequest(BaseModel):
+    code: Optional[str] = ""
+    language: Optional[str] = ""
+
+
+class ChatTurnRequest(BaseModel):
+    message: str
 
 
 # Health check
@@ -102,7 +254,7 @@ class ChatRequest(BaseModel):
 async def health_check():
     redis_status = "connected"
     try:
-        redis_client.ping()
+        await async_redis_client.ping()
     except:
         redis_status = "disconnected"
 
@@ -113,118 +265,546 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus metrics: stage histograms, token and cache counters, queue depth."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    try:
+        for queue, stats in queue_stats().items():
+            if stats["depth"] is not None:
+                QUEUE_DEPTH.labels(queue).set(stats["depth"])
+            QUEUE_HELD.labels(queue).set(stats["held"])
+    except redis.RedisError:
+        pass
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Result cache hit/miss counters."""
+    try:
+        return await cache_stats()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/preanalysis/stats")
+def get_preanalysis_stats():
+    """How many debug requests were checked locally and how many model calls that avoided."""
+    try:
+        return preanalysis_stats()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/ratelimit/stats")
+def get_rate_limit_stats():
+    """Shared OpenAI quota, calls waiting for it, and circuit breaker state."""
+    try:
+        return rate_limit_stats()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/queues/stats")
+def get_queue_stats():
+    """Per-queue depth, jobs held for fairness, and submit-to-start wait times."""
+    try:
+        return queue_stats()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/router/stats")
+def get_router_stats():
+    """Models the router can pick from and their rolling latency percentiles."""
+    return {
+        "default": settings.MODEL_DEFAULT,
+        "fast": settings.MODEL_FAST,
+        "enabled": settings.ROUTER_ENABLED,
+        "models": router_stats(),
+    }
+
+
 # ==================== ASYNC JOB ENDPOINTS ====================
 
+def _job_active(job_id: str) -> bool:
+    """True while a job (including a fanned-out analyze_all) is still running."""
+    if is_cancelled(job_id):
+        return False
+    state, result = task_state(job_id)
+    if state not in READY_STATES:
+        return True
+    if _is_fanout(state, result):
+        return task_state(result["callback_id"])[0] not in READY_STATES
+    return False
+
+
+def get_tenant(request: Request) -> str:
+    """Tenant for fair scheduling: X-Tenant-ID, else the API key, else the client address."""
+    identity = request.headers.get("X-Tenant-ID") or request.headers.get("X-API-Key")
+    if not identity:
+        identity = request.client.host if request.client else "anonymous"
+    return tenant_id(identity)
+
+
+def _job_queue(priority: Optional[str], default: str) -> str:
+    try:
+        return resolve_queue(priority, default)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _submit_job(task, tool: str, system_prompt: str, content: str, queue: str, tenant: str,
+                **kwargs) -> JobResponse:
+    """Enqueue a task, attaching to an identical job that is already in flight."""
+    coalesce_key = make_cache_key(tool, system_prompt, MODEL, TEMPERATURE, content)
+    job_id = str(uuid4())
+    existing = claim_job(coalesce_key, job_id, _job_active)
+    if existing:
+        return JobResponse(job_id=existing, status="pending", coalesced=True)
+
+    submit_job(task.name, kwargs, job_id, queue, tenant)
+    return JobResponse(job_id=job_id, status="pending", queue=queue)
+
+
+def _unavailable(e: UpstreamUnavailableError) -> HTTPException:
+    """429 (quota, with queue position if queued) or 503 (circuit open, upstream down) with a Retry-After header."""
+    headers = {"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+    if isinstance(e, RateLimitedError) and e.queue_position:
+        headers["X-Queue-Position"] = str(e.queue_position)
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+
+def _code_content(request: CodeRequest) -> str:
+    return f"{request.language}\n{request.model or ''}\n{request.github_url}\n{request.code}"
+
+
 @app.post("/api/jobs/debug", response_model=JobResponse)
-async def create_debug_job(request: CodeRequest):
+def create_debug_job(request: CodeRequest, tenant: str = Depends(get_tenant)):
     """Create an async debug job."""
-    task = debug_code.delay(
+    return _submit_job(
+        debug_code, "debug", PROMPTS["debug"], _code_content(request),
+        _job_queue(request.priority, INTERACTIVE_QUEUE), tenant,
         code=request.code,
         language=request.language,
-        github_url=request.github_url
+        github_url=request.github_url,
+        no_cache=request.no_cache,
+        chunked=request.chunked,
+        model=request.model,
+        latency_target_ms=request.latency_target_ms
     )
-    return JobResponse(job_id=task.id, status="pending")
 
 
 @app.post("/api/jobs/refactor", response_model=JobResponse)
-async def create_refactor_job(request: RefactorRequest):
+def create_refactor_job(request: RefactorRequest, tenant: str = Depends(get_tenant)):
     """Create an async refactor job."""
-    task = refactor_code.delay(
+    system_prompt = build_system_prompt("refactor", principles=request.principles)
+    return _submit_job(
+        refactor_code, "refactor", system_prompt, _code_content(request),
+        _job_queue(request.priority, INTERACTIVE_QUEUE), tenant,
         code=request.code,
         language=request.language,
         github_url=request.github_url,
-        principles=request.principles
+        principles=request.principles,
+        no_cache=request.no_cache,
+        model=request.model,
+        latency_target_ms=request.latency_target_ms
     )
-    return JobResponse(job_id=task.id, status="pending")
 
 
 @app.post("/api/jobs/optimize", response_model=JobResponse)
-async def create_optimize_job(request: OptimizeRequest):
+def create_optimize_job(request: OptimizeRequest, tenant: str = Depends(get_tenant)):
     """Create an async optimize job."""
-    task = optimize_code.delay(
+    system_prompt = build_system_prompt("optimize", focus_areas=request.focus_areas)
+    return _submit_job(
+        optimize_code, "optimize", system_prompt, _code_content(request),
+        _job_queue(request.priority, INTERACTIVE_QUEUE), tenant,
         code=request.code,
         language=request.language,
         github_url=request.github_url,
-        focus_areas=request.focus_areas
+        focus_areas=request.focus_areas,
+        no_cache=request.no_cache,
+        chunked=request.chunked,
+        model=request.model,
+        latency_target_ms=request.latency_target_ms
     )
-    return JobResponse(job_id=task.id, status="pending")
 
 
 @app.post("/api/jobs/test", response_model=JobResponse)
-async def create_test_job(request: TestRequest):
+def create_test_job(request: TestRequest, tenant: str = Depends(get_tenant)):
     """Create an async test generation job."""
-    task = test_code.delay(
+    system_prompt = build_system_prompt("test", test_framework=request.test_framework)
+    return _submit_job(
+        test_code, "test", system_prompt, _code_content(request),
+        _job_queue(request.priority, INTERACTIVE_QUEUE), tenant,
         code=request.code,
         language=request.language,
         github_url=request.github_url,
-        test_framework=request.test_framework
+        test_framework=request.test_framework,
+        no_cache=request.no_cache,
+        chunked=request.chunked,
+        model=request.model,
+        latency_target_ms=request.latency_target_ms
     )
-    return JobResponse(job_id=task.id, status="pending")
 
 
 @app.post("/api/jobs/pr", response_model=JobResponse)
-async def create_pr_job(request: PRRequest):
+def create_pr_job(request: PRRequest, tenant: str = Depends(get_tenant)):
     """Create an async PR generation job."""
-    task = generate_pr.delay(
+    content = "\n".join([
+        request.language or "", request.title or "", request.changes or "", request.filename or "",
+        str(request.context_lines), request.original_code, request.modified_code,
+    ])
+    return _submit_job(
+        generate_pr, "pr", PROMPTS["pr"], content,
+        _job_queue(request.priority, INTERACTIVE_QUEUE), tenant,
         original_code=request.original_code,
         modified_code=request.modified_code,
         changes=request.changes,
         language=request.language,
-        title=request.title
+        title=request.title,
+        no_cache=request.no_cache,
+        filename=request.filename,
+        context_lines=request.context_lines
+    )
+
+
+@app.post("/api/jobs/pr-multi", response_model=JobResponse)
+def create_multi_pr_job(request: MultiFilePRRequest, tenant: str = Depends(get_tenant)):
+    """Create an async PR generation job covering several files."""
+    if not request.files:
+        raise HTTPException(status_code=400, detail="At least one file is required")
+    files = [f.model_dump() for f in request.files]
+    content = "\n".join([
+        request.language or "", request.title or "", request.changes or "", str(request.context_lines),
+    ] + [f"{f['filename']}\n{f['original_code']}\n{f['modified_code']}" for f in files])
+    return _submit_job(
+        generate_pr, "pr-multi", PROMPTS["pr"], content,
+        _job_queue(request.priority, INTERACTIVE_QUEUE), tenant,
+        files=files,
+        changes=request.changes,
+        language=request.language,
+        title=request.title,
+        no_cache=request.no_cache,
+        context_lines=request.context_lines
     )
-    return JobResponse(job_id=task.id, status="pending")
 
 
 @app.post("/api/jobs/analyze-all", response_model=JobResponse)
-async def create_multi_analysis_job(request: MultiAnalysisRequest):
+def create_multi_analysis_job(request: MultiAnalysisRequest, tenant: str = Depends(get_tenant)):
     """Create an async multi-tool analysis job."""
-    task = analyze_all.delay(
+    mode = request.mode or "fanout"
+    tools = ",".join(request.tools or [])
+    return _submit_job(
+        analyze_all, f"analyze-all:{mode}:{tools}", "", _code_content(request),
+        _job_queue(request.priority, BATCH_QUEUE), tenant,
         code=request.code,
         language=request.language,
         github_url=request.github_url,
-        tools=request.tools
+        tools=request.tools,
+        mode=mode,
+        no_cache=request.no_cache
     )
-    return JobResponse(job_id=task.id, status="pending")
 
 
-@app.get("/api/jobs/{job_id}")
-async def get_job_status(job_id: str):
-    """Get the status and result of a job."""
-    task = AsyncResult(job_id, app=celery_app)
+@app.post("/api/jobs/analyze-repo", response_model=JobResponse)
+def create_repo_analysis_job(request: RepoAnalysisRequest, tenant: str = Depends(get_tenant)):
+    """Create an async whole-repository analysis job."""
+    job_id = str(uuid4())
+    queue = _job_queue(request.priority, REPO_QUEUE)
+    submit_job(analyze_repo.name, {
+        "repo_url": request.repo_url,
+        "ref": request.ref,
+        "tools": request.tools,
+        "languages": request.languages,
+        "max_file_bytes": request.max_file_bytes,
+        "max_files": request.max_files,
+        "github_token": request.github_token,
+        "no_cache": request.no_cache,
+    }, job_id, queue, tenant)
+    return JobResponse(job_id=job_id, status="pending", queue=queue)
+
+
+@app.post("/api/jobs/upload", response_model=JobResponse)
+async def create_upload_analysis_job(request: Request, tenant: str = Depends(get_tenant)):
+    """Analyze uploaded files, or zips of them, as one batched job.
+
+    Takes multipart/form-data: one or more "files" parts plus optional
+    "tools", "languages" (comma-separated or repeated), "priority" and
+    "no_cache" fields. Files are streamed to disk; per-file results are paged
+    through /api/jobs/{job_id}/files.
+    """
+    job_id = str(uuid4())
+    upload_dir = os.path.join(settings.UPLOAD_DIR, job_id)
+    try:
+        upload = await receive_upload(request.headers.get("content-type", ""), request.stream(), upload_dir)
+        if not upload.files:
+            detail = "No source files uploaded"
+            if upload.skipped:
+                detail += "; skipped: " + ", ".join(f"{item['path']} ({item['reason']})" for item in upload.skipped)
+            raise HTTPException(status_code=400, detail=detail)
+        tools = upload.list_field("tools") or ["debug"]
+        unknown = [tool for tool in tools if tool not in TOOL_TASKS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown tools: {', '.join(unknown)}")
+        queue = _job_queue(upload.field("priority"), REPO_QUEUE)
+        await run_in_threadpool(submit_job, analyze_upload.name, {
+            "upload_dir": upload_dir,
+            "tools": tools,
+            "languages": upload.list_field("languages") or None,
+            "no_cache": (upload.field("no_cache") or "").lower() in ("1", "true", "yes"),
+            "skipped": upload.skipped,
+        }, job_id, queue, tenant)
+    except UploadError as e:
+        remove_upload(upload_dir)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except BaseException:
+        remove_upload(upload_dir)
+        raise
+    return JobResponse(job_id=job_id, status="pending", queue=queue, skipped=upload.skipped)
+
+
+@app.get("/api/jobs/{job_id}/files")
+def get_repo_job_files(job_id: str, offset: int = 0, limit: int = 50):
+    """Page through per-file results of a repository job, including while it runs."""
+    if offset < 0 or not 0 < limit <= 500:
+        raise HTTPException(status_code=400, detail="Invalid offset or limit")
+    return get_file_results(job_id, offset, limit)
+
+
+def _fanout_status(job_id: str, meta: dict, states: Callable[[str], TaskState] = task_state) -> dict:
+    """Aggregate per-tool progress for a fanned-out analyze_all job."""
+    callback_state, callback_result = states(meta["callback_id"])
+    if callback_state == "SUCCESS":
+        result = callback_result
+        result["data"].update(meta.get("errors") or {})
+        return {"job_id": job_id, "status": "completed", "result": result}
+
+    progress = {}
+    data = dict(meta.get("errors") or {})
+    for tool, child_id in meta["children"].items():
+        child_state, child_result = states(child_id)
+        if child_state == "SUCCESS":
+            progress[tool] = "completed"
+            data[tool] = child_result
+        elif child_state == "FAILURE":
+            progress[tool] = "failed"
+            data[tool] = {"success": False, "error": str(child_result)}
+        elif child_state == "STARTED":
+            progress[tool] = "running"
+        else:
+            progress[tool] = "pending"
+
+    if callback_state == "FAILURE" or all(state in ("completed", "failed") for state in progress.values()):
+        # The merge callback does not run when a subtask fails, so finish here.
+        status = "completed"
+    elif any(state in ("completed", "failed") for state in progress.values()):
+        status = "partial"
+    else:
+        status = "running"
+
+    return {
+        "job_id": job_id,
+        "status": status,
+        "progress": progress,
+        "result": {"success": True, "data": data, "tool": "multi-analysis"} if data else None,
+    }
+
 
-    if task.state == "PENDING":
+def _is_fanout(state: str, result) -> bool:
+    return state == "SUCCESS" and isinstance(result, dict) and bool(result.get("fanout"))
+
+
+def _job_status(job_id: str, state: str, result, cancelled: bool,
+                states: Callable[[str], TaskState] = task_state) -> dict:
+    if state == "REVOKED" or cancelled:
+        return {"job_id": job_id, "status": "cancelled", "result": None}
+    if state == "PENDING":
         return {"job_id": job_id, "status": "pending", "result": None}
-    elif task.state == "STARTED":
+    elif state == "STARTED":
         return {"job_id": job_id, "status": "running", "result": None}
-    elif task.state == "SUCCESS":
-        return {"job_id": job_id, "status": "completed", "result": task.result}
-    elif task.state == "FAILURE":
-        return {"job_id": job_id, "status": "failed", "error": str(task.result)}
+    elif state == "SUCCESS":
+        if _is_fanout(state, result):
+            return _fanout_status(job_id, result, states)
+        return {"job_id": job_id, "status": "completed", "result": result}
+    elif state == "FAILURE":
+        return {"job_id": job_id, "status": "failed", "error": str(result)}
     else:
-        return {"job_id": job_id, "status": task.state, "result": None}
+        return {"job_id": job_id, "status": state, "result": None}
+
+
+def _project(status: dict, fields: Optional[str]) -> dict:
+    if status.get("result") is not None:
+        status["result"] = project_result(status["result"], fields)
+    return status
+
+
+def _job_statuses(job_ids: List[str]) -> Dict[str, dict]:
+    """Statuses for many jobs: one MGET for the jobs, one for fan-out subtasks, one for cancel flags."""
+    states = fetch_task_states(job_ids)
+    subtasks = [
+        task_id
+        for state, result in states.values() if _is_fanout(state, result)
+        for task_id in [*result["children"].values(), result["callback_id"]]
+    ]
+    states.update(fetch_task_states(subtasks))
+    cancelled = cancelled_among(job_ids)
+    return {
+        job_id: _job_status(job_id, *states[job_id], job_id in cancelled, states.__getitem__)
+        for job_id in job_ids
+    }
+
+
+def _status_version(status: dict) -> str:
+    """Short fingerprint of a status payload, for change detection by clients."""
+    payload = json.dumps(status, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _unique_job_ids(job_ids: List[str]) -> List[str]:
+    job_ids = list(dict.fromkeys(job_id for job_id in job_ids if job_id))
+    if not job_ids:
+        raise HTTPException(status_code=400, detail="No job ids provided")
+    if len(job_ids) > settings.JOB_STATUS_BATCH_MAX:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {settings.JOB_STATUS_BATCH_MAX} job ids per request")
+    return job_ids
+
+
+@app.post("/api/jobs/status")
+def get_job_statuses(request: JobStatusBatchRequest):
+    """Get the status and result of many jobs at once.
+
+    Each job carries a "version"; jobs whose version matches the one passed
+    in ``since`` come back as a bare status line with "unchanged": true.
+    """
+    job_ids = _unique_job_ids(request.job_ids)
+    since = request.since or {}
+    jobs = []
+    for job_id, status in _job_statuses(job_ids).items():
+        version = _status_version(status)
+        if since.get(job_id) == version:
+            jobs.append({"job_id": job_id, "status": status["status"], "version": version, "unchanged": True})
+        else:
+            jobs.append({**_project(status, request.fields), "version": version})
+    return {"jobs": jobs}
+
+
+@app.get("/api/jobs/events")
+async def stream_jobs_events(ids: str, fields: Optional[str] = None):
+    """Stream status changes and model tokens for several jobs over one connection.
+
+    ``ids`` is a comma-separated list of job ids; every event payload carries
+    its job_id. The stream ends once every job has finished.
+    """
+    job_ids = _unique_job_ids(ids.split(","))
+
+    async def snapshot(changed: List[str]) -> Dict[str, dict]:
+        statuses = await run_in_threadpool(_job_statuses, changed)
+        return {job_id: _project(status, fields) for job_id, status in statuses.items()}
+
+    return StreamingResponse(
+        jobs_event_stream(job_ids, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job_status(job_id: str, fields: Optional[str] = None):
+    """Get the status and result of a job.
+
+    ``fields`` (e.g. "summary,refactor.refactoredCode") limits the result to
+    those keys; the rest are listed under "omitted".
+    """
+    state, result = task_state(job_id)
+    return _project(_job_status(job_id, state, result, is_cancelled(job_id)), fields)
+
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a job and, for a fanned-out analyze_all, its subtasks.
+
+    Queued tasks are revoked; running ones stop at their next stream check and
+    close the model connection, so the rest of the completion is not generated.
+    """
+    if not _job_active(job_id):
+        status = "cancelled" if is_cancelled(job_id) else "finished"
+        raise HTTPException(status_code=409, detail=f"Job already {status}")
+
+    job_ids = [job_id]
+    state, result = task_state(job_id)
+    if _is_fanout(state, result):
+        job_ids += list(result["children"].values()) + [result["callback_id"]]
+
+    try:
+        cancel_jobs(job_ids)
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    celery_app.control.revoke(job_ids)
+    release_job(job_id)
+    publish_job_event(job_id, "cancelled")
+    return {"job_id": job_id, "status": "cancelled", "cancelled_tasks": len(job_ids)}
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, fields: Optional[str] = None):
+    """Stream job state changes and model tokens as Server-Sent Events.
+
+    Emits pending/running/partial/completed/failed status events with the same
+    payload as GET /api/jobs/{job_id}, plus "token" events with model output.
+    """
+    return StreamingResponse(
+        job_event_stream(job_id, lambda: run_in_threadpool(get_job_status, job_id, fields)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # ==================== SYNC ENDPOINTS (for quick operations) ====================
 
+async def _load_source(request: CodeRequest) -> str:
+    source_code = request.code
+    if request.github_url:
+        try:
+            source_code = await fetch_source_async(request.github_url)
+        except SourceTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except (httpx.HTTPError, ValueError) as e:
+            raise HTTPException(status_code=502, detail=f"Failed to fetch source: {e}")
+
+    if not source_code:
+        raise HTTPException(status_code=400, detail="No code provided")
+    return source_code
+
+
 @app.post("/api/debug")
 async def debug_sync(request: CodeRequest):
     """Synchronous debug endpoint."""
+    source_code = await _load_source(request)
     try:
-        source_code = request.code
-        if request.github_url:
-            import httpx
-            raw_url = request.github_url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(raw_url)
-                source_code = response.text
-
-        if not source_code:
-            raise HTTPException(status_code=400, detail="No code provided")
-
-        user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = await analyze_with_ai(PROMPTS["debug"], user_prompt)
+        static_issues = pre_analyze(source_code, request.language)
+        if is_blocking(static_issues):
+            return {"success": True, "data": blocking_result(static_issues), "tool": "debugger"}
+
+        if should_chunk("debug", source_code, request.chunked):
+            result = await analyze_chunked("debug", PROMPTS["debug"], source_code, request.language,
+                                           use_cache=not request.no_cache, model=request.model,
+                                           latency_target_ms=request.latency_target_ms)
+        else:
+            user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+            user_prompt = with_hints(user_prompt, static_issues)
+            result = await analyze_with_ai(PROMPTS["debug"], user_prompt, tool="debug", use_cache=not request.no_cache,
+                                           model=request.model, latency_target_ms=request.latency_target_ms)
+        result = merge_issues(result, static_issues)
 
         return {"success": True, "data": result, "tool": "debugger"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -232,22 +812,18 @@ async def debug_sync(request: CodeRequest):
 @app.post("/api/refactor")
 async def refactor_sync(request: RefactorRequest):
     """Synchronous refactor endpoint."""
+    source_code = await _load_source(request)
     try:
-        source_code = request.code
-        if request.github_url:
-            import httpx
-            raw_url = request.github_url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(raw_url)
-                source_code = response.text
-
-        if not source_code:
-            raise HTTPException(status_code=400, detail="No code provided")
-
         user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = await analyze_with_ai(PROMPTS["refactor"], user_prompt)
+        system_prompt = build_system_prompt("refactor", principles=request.principles)
+        result = await analyze_with_ai(system_prompt, user_prompt, tool="refactor", use_cache=not request.no_cache,
+                                       model=request.model, latency_target_ms=request.latency_target_ms)
 
         return {"success": True, "data": result, "tool": "refactorizer"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -255,22 +831,23 @@ async def refactor_sync(request: RefactorRequest):
 @app.post("/api/optimize")
 async def optimize_sync(request: OptimizeRequest):
     """Synchronous optimize endpoint."""
+    source_code = await _load_source(request)
     try:
-        source_code = request.code
-        if request.github_url:
-            import httpx
-            raw_url = request.github_url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(raw_url)
-                source_code = response.text
-
-        if not source_code:
-            raise HTTPException(status_code=400, detail="No code provided")
-
-        user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = await analyze_with_ai(PROMPTS["optimize"], user_prompt)
+        system_prompt = build_system_prompt("optimize", focus_areas=request.focus_areas)
+        if should_chunk("optimize", source_code, request.chunked):
+            result = await analyze_chunked("optimize", system_prompt, source_code, request.language,
+                                           use_cache=not request.no_cache, model=request.model,
+                                           latency_target_ms=request.latency_target_ms)
+        else:
+            user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+            result = await analyze_with_ai(system_prompt, user_prompt, tool="optimize", use_cache=not request.no_cache,
+                                           model=request.model, latency_target_ms=request.latency_target_ms)
 
         return {"success": True, "data": result, "tool": "optimizer"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -278,22 +855,23 @@ async def optimize_sync(request: OptimizeRequest):
 @app.post("/api/test")
 async def test_sync(request: TestRequest):
     """Synchronous test generation endpoint."""
+    source_code = await _load_source(request)
     try:
-        source_code = request.code
-        if request.github_url:
-            import httpx
-            raw_url = request.github_url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(raw_url)
-                source_code = response.text
-
-        if not source_code:
-            raise HTTPException(status_code=400, detail="No code provided")
-
-        user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = await analyze_with_ai(PROMPTS["test"], user_prompt)
+        system_prompt = build_system_prompt("test", test_framework=request.test_framework)
+        if should_chunk("test", source_code, request.chunked):
+            result = await analyze_chunked("test", system_prompt, source_code, request.language,
+                                           use_cache=not request.no_cache, model=request.model,
+                                           latency_target_ms=request.latency_target_ms)
+        else:
+            user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+            result = await analyze_with_ai(system_prompt, user_prompt, tool="test", use_cache=not request.no_cache,
+                                           model=request.model, latency_target_ms=request.latency_target_ms)
 
         return {"success": True, "data": result, "tool": "tester"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -310,35 +888,90 @@ Language: {request.language or 'auto-detect'}
 Prompt:
 {request.code}
 """
-        result = await analyze_with_ai(PROMPTS["generate"], user_prompt)
+        result = await analyze_with_ai(PROMPTS["generate"], user_prompt, tool="generate", use_cache=not request.no_cache,
+                                       model=request.model, latency_target_ms=request.latency_target_ms)
         return {"success": True, "data": result, "tool": "generate"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/chat-assistant")
-async def chat_assistant(request: ChatRequest):
-    """Chat assistant endpoint with optional code context."""
+async def chat_assistant(request: ChatRequest, background_tasks: BackgroundTasks):
+    """Chat assistant endpoint with optional code context.
+
+    With a ``session_id`` the stored code and history are used and the
+    ``code``/``history`` fields are ignored.
+    """
+    if request.session_id:
+        return await chat_session_turn(request.session_id, ChatTurnRequest(message=request.message), background_tasks)
     try:
-        history = request.history or []
-        history_text = "\n".join([f"{item.role}: {item.content}" for item in history])
-        code_block = request.code or ""
-        user_prompt = f"""
-Language: {request.language or 'auto-detect'}
+        history = [item.model_dump() for item in request.history or []]
+        user_prompt = build_chat_prompt(request.message, request.code or "", request.language, history)
+        result = await analyze_with_ai(PROMPTS["assistant"], user_prompt, tool="assistant")
+        return {"success": True, "data": result, "tool": "assistant"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-Code:
-{code_block}
 
-History:
-{history_text or 'None'}
+@app.post("/api/chat/sessions")
+async def create_chat_session(request: ChatSessionRequest):
+    """Upload code once and get a session id for later chat turns."""
+    session_id = await create_session(request.code or "", request.language or "")
+    return {"session_id": session_id, "ttl": settings.CHAT_SESSION_TTL}
 
-User Question:
-{request.message}
-"""
-        result = await analyze_with_ai(PROMPTS["assistant"], user_prompt)
-        return {"success": True, "data": result, "tool": "assistant"}
+
+@app.get("/api/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """Return a session's rolling summary and recent history (code omitted)."""
+    session = await get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {
+        "session_id": session_id,
+        "language": session["language"],
+        "summary": session["summary"],
+        "history": session["history"],
+    }
+
+
+@app.put("/api/chat/sessions/{session_id}/code")
+async def update_chat_session_code(session_id: str, request: ChatSessionRequest):
+    """Replace the code a session is discussing."""
+    if not await update_code(session_id, request.code or "", request.language or None):
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {"session_id": session_id}
+
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    await delete_session(session_id)
+    return {"session_id": session_id, "deleted": True}
+
+
+@app.post("/api/chat/sessions/{session_id}/messages")
+async def chat_session_turn(session_id: str, request: ChatTurnRequest, background_tasks: BackgroundTasks):
+    """Send one message in a server-side chat session."""
+    try:
+        result = await chat_turn(session_id, request.message)
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+
+    background_tasks.add_task(compact_history, session_id)
+    return {"success": True, "data": result, "tool": "assistant", "session_id": session_id}
 
 
 @app.post("/api/generate-pr")
@@ -348,97 +981,162 @@ async def generate_pr_sync(request: PRRequest):
         if not request.original_code and not request.modified_code:
             raise HTTPException(status_code=400, detail="Original and modified code required")
 
-        user_prompt = f"""
-Language: {request.language or 'auto-detect'}
-Suggested Title: {request.title or 'Auto-generated PR'}
-Changes Summary: {request.changes or 'See code diff'}
+        files = [{
+            "filename": request.filename,
+            "original_code": request.original_code,
+            "modified_code": request.modified_code,
+        }]
+        user_prompt = build_pr_prompt(files, request.language, request.title, request.changes, request.context_lines)
+        result = await analyze_with_ai(PROMPTS["pr"], user_prompt, tool="pr", use_cache=not request.no_cache)
+
+        return {"success": True, "data": result, "tool": "pr-generator"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-Original Code:
-{request.original_code}
 
-Modified Code:
-{request.modified_code}
-"""
-        result = await analyze_with_ai(PROMPTS["pr"], user_prompt)
+@app.post("/api/generate-pr/multi")
+async def generate_multi_pr_sync(request: MultiFilePRRequest):
+    """Synchronous PR generation for several changed files."""
+    if not request.files:
+        raise HTTPException(status_code=400, detail="At least one file is required")
+    try:
+        files = [f.model_dump() for f in request.files]
+        user_prompt = build_pr_prompt(files, request.language, request.title, request.changes, request.context_lines)
+        result = await analyze_with_ai(PROMPTS["pr"], user_prompt, tool="pr", use_cache=not request.no_cache)
 
         return {"success": True, "data": result, "tool": "pr-generator"}
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ==================== STREAMING ENDPOINTS ====================
+
+def _stream_analysis(system_prompt: str, user_prompt: str, tool: str, tool_name: str,
+                     request: CodeRequest, http_request: Request) -> StreamingResponse:
+    """Wrap stream_with_ai as Server-Sent Events.
+
+    The final "done" event carries the same envelope as the matching sync
+    endpoint; failures after the stream has started arrive as an "error" event.
+    When the client goes away the model stream is closed instead of being
+    read to the end.
+    """
+    async def events():
+        try:
+            async with aclosing(stream_with_ai(system_prompt, user_prompt, tool=tool,
+                                               use_cache=not request.no_cache, model=request.model,
+                                               latency_target_ms=request.latency_target_ms)) as stream:
+                async for event, data in stream:
+                    if await http_request.is_disconnected():
+                        return
+                    if event == "done":
+                        data = {"success": True, "data": data["data"], "tool": tool_name, "cached": data["cached"]}
+                    yield format_sse(event, data)
+        except Exception as e:
+            yield format_sse("error", {"success": False, "detail": str(e), "tool": tool_name})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/debug/stream")
+async def debug_stream(request: CodeRequest, http_request: Request):
+    """Streaming debug endpoint."""
+    source_code = await _load_source(request)
+    user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+    return _stream_analysis(PROMPTS["debug"], user_prompt, "debug", "debugger", request, http_request)
+
+
+@app.post("/api/refactor/stream")
+async def refactor_stream(request: RefactorRequest, http_request: Request):
+    """Streaming refactor endpoint."""
+    source_code = await _load_source(request)
+    user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+    system_prompt = build_system_prompt("refactor", principles=request.principles)
+    return _stream_analysis(system_prompt, user_prompt, "refactor", "refactorizer", request, http_request)
+
+
+@app.post("/api/optimize/stream")
+async def optimize_stream(request: OptimizeRequest, http_request: Request):
+    """Streaming optimize endpoint."""
+    source_code = await _load_source(request)
+    user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+    system_prompt = build_system_prompt("optimize", focus_areas=request.focus_areas)
+    return _stream_analysis(system_prompt, user_prompt, "optimize", "optimizer", request, http_request)
+
+
+@app.post("/api/test/stream")
+async def test_stream(request: TestRequest, http_request: Request):
+    """Streaming test generation endpoint."""
+    source_code = await _load_source(request)
+    user_prompt = f"Language: {request.language or 'auto-detect'}\n\nCode:\n{source_code}"
+    system_prompt = build_system_prompt("test", test_framework=request.test_framework)
+    return _stream_analysis(system_prompt, user_prompt, "test", "tester", request, http_request)
+
+
+@app.post("/api/generate/stream")
+async def generate_stream(request: CodeRequest, http_request: Request):
+    """Streaming code generation endpoint."""
+    if not request.code:
+        raise HTTPException(status_code=400, detail="No prompt provided")
+
+    user_prompt = f"""
+Language: {request.language or 'auto-detect'}
+Prompt:
+{request.code}
+"""
+    return _stream_analysis(PROMPTS["generate"], user_prompt, "generate", "generate", request, http_request)
+
+
 # ==================== GITHUB INTEGRATION ====================
 
 @app.post("/api/github/export")
 async def export_to_github(request: GitHubExportRequest):
-    """Export code to GitHub repository."""
+    """Export one or many files to a GitHub branch as a single commit, optionally opening a PR."""
+    files = [f.model_dump() for f in request.files or []]
+    if request.filename and request.code is not None:
+        files.append({"path": request.filename, "content": request.code, "mode": request.mode})
+    if not files:
+        raise HTTPException(status_code=400, detail="Provide files, or code and filename")
+    if request.commit_message:
+        message = request.commit_message
+    elif len(files) == 1:
+        message = f"Update {files[0]['path']} via Code Assistant"
+    else:
+        message = f"Update {len(files)} files via Code Assistant"
     try:
-        from github import Github
-
-        g = Github(request.github_token)
-        repo = g.get_repo(request.repo)
-
-        # Check if file exists
-        sha = None
-        try:
-            contents = repo.get_contents(request.filename, ref=request.branch)
-            sha = contents.sha
-        except:
-            pass
-
-        commit_message = request.commit_message or f"Update {request.filename} via Code Assistant"
-
-        if sha:
-            result = repo.update_file(
-                path=request.filename,
-                message=commit_message,
-                content=request.code,
-                sha=sha,
-                branch=request.branch
-            )
-        else:
-            result = repo.create_file(
-                path=request.filename,
-                message=commit_message,
-                content=request.code,
-                branch=request.branch
-            )
-
-        return {
-            "success": True,
-            "data": {
-                "commit_url": result["commit"].html_url,
-                "file_url": result["content"].html_url
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        data = await export_files(
+            request.github_token, request.repo, request.branch or "main", files, message,
+            base_branch=request.base_branch or "",
+            pull_request=request.create_pr.model_dump() if request.create_pr else None,
+        )
+    except GitHubAPIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if len(data["files"]) == 1:
+        data["file_url"] = data["files"][0]["file_url"]
+    return {"success": True, "data": data}
 
 
 @app.post("/api/github/create-pr")
 async def create_github_pr(request: GitHubPRRequest):
     """Create a pull request on GitHub."""
     try:
-        from github import Github
-
-        g = Github(request.github_token)
-        repo = g.get_repo(request.repo)
-
-        pr = repo.create_pull(
-            title=request.title,
-            body=request.body,
-            head=request.head,
-            base=request.base
+        data = await create_pull_request(
+            request.github_token, request.repo, request.title, request.body or "", request.head, request.base or "main"
         )
-
-        return {
-            "success": True,
-            "data": {
-                "pr_url": pr.html_url,
-                "pr_number": pr.number
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except GitHubAPIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"success": True, "data": data}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+    start_http_server,
+)
+
+from config import settings
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "codeassistant_stage_seconds", "Time spent in each stage of an analysis",
+    ["stage", "tool", "model"], buckets=STAGE_BUCKETS,
+)
+TOKENS = Counter("codeassistant_tokens_total", "Model tokens sent and received", ["direction", "tool", "model"])
+CACHE_LOOKUPS = Counter("codeassistant_cache_lookups_total", "Result cache lookups", ["tool", "result"])
+PARSE_FALLBACKS = Counter(
+    "codeassistant_parse_fallbacks_total", "Model replies that were not valid JSON and came back as raw text",
+    ["tool", "model"],
+)
+PARSE_RESULTS = Counter(
+    "codeassistant_parse_results_total",
+    "Model replies by parse path: fast (single json.loads), lenient, salvaged (partial) or raw",
+    ["tool", "path"],
+)
+FIELD_REPAIRS = Counter(
+    "codeassistant_field_repairs_total", "Response fields re-requested after failing schema validation",
+    ["tool", "field", "outcome"],
+)
+TASK_WAIT_SECONDS = Histogram(
+    "codeassistant_task_wait_seconds", "Time between a task being sent and a worker starting it",
+    ["queue"], buckets=STAGE_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "codeassistant_queue_depth", "Messages waiting in each Celery queue", ["queue"], multiprocess_mode="liveall",
+)
+QUEUE_HELD = Gauge(
+    "codeassistant_queue_held", "Jobs held back by per-tenant fair scheduling", ["queue"], multiprocess_mode="liveall",
+)
+
+# Per-request stage durations for the Server-Timing header; None outside a request.
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("server_timings", default=None)
+
+
+@contextmanager
+def stage(name: str, tool: str = "", model: str = "") -> Iterator[None]:
+    """Time a block into the stage histogram and the current request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name, tool or "", model or "").observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def track_timings() -> Iterator[Dict[str, float]]:
+    """Collect stage durations recorded while handling one request."""
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def record_tokens(tool: str, model: str, input_tokens: int, output_tokens: int):
+    TOKENS.labels("in", tool or "", model).inc(input_tokens)
+    TOKENS.labels("out", tool or "", model).inc(output_tokens)
+
+
+def _registry() -> CollectorRegistry:
+    """Merge metrics from every process when PROMETHEUS_MULTIPROC_DIR is set (prefork workers, uvicorn --workers)."""
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> bytes:
+    return generate_latest(_registry())
+
+
+def start_worker_exporter():
+    """Serve worker metrics over HTTP on WORKER_METRICS_PORT (0 disables it).
+
+    Tasks run in forked pool processes, so their metrics only reach the
+    exporter when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Files left by a previous run would be added to this run's totals.
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".db"):
+                os.remove(os.path.join(path, name))
+    if settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT, registry=_registry())
+
+
+def mark_process_dead(pid: int):
+    """Drop a finished pool process's live gauges."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
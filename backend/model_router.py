@@ -0,0 +1,129 @@
+import time
+from typing import Dict, List, Optional
+
+import redis
+
+from config import settings
+from cache import redis_client
+from token_budget import count_tokens
+
+LATENCY_KEY = "model_router:latency:{model}"
+ERRORS_KEY = "model_router:errors:{model}"
+
+# Tools whose answers are short enough for the fast model regardless of input size.
+FAST_TOOLS = ("assistant", "chat-summary", "generate")
+# Tools that rewrite whole files (or several tools' output at once) and benefit most from the large model.
+HEAVY_TOOLS = ("refactor", "optimize", "test", "fused")
+
+_snapshots: Dict[str, dict] = {}
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def available_models() -> List[str]:
+    models = [settings.MODEL_DEFAULT, settings.MODEL_FAST] + _split(settings.MODEL_ALLOWED)
+    return list(dict.fromkeys(models))
+
+
+def record_latency(model: str, seconds: float, ok: bool = True):
+    """Add one call's latency to the model's rolling window (shared through Redis)."""
+    key = (LATENCY_KEY if ok else ERRORS_KEY).format(model=model)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lpush(key, round(seconds * 1000, 1))
+        pipe.ltrim(key, 0, settings.ROUTER_WINDOW - 1)
+        pipe.expire(key, 3600)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    snapshot = _snapshots.get(model)
+    if snapshot:
+        snapshot["recorded"] += 1
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_stats(model: str) -> dict:
+    """p50/p95/p99 latency in ms over the rolling window.
+
+    Cached in-process until ROUTER_REFRESH_SECONDS pass or this process records
+    ROUTER_REFRESH_SAMPLES more calls, so routing doesn't re-read Redis per call.
+    """
+    snapshot = _snapshots.get(model)
+    if (snapshot and time.monotonic() - snapshot["at"] < settings.ROUTER_REFRESH_SECONDS
+            and snapshot["recorded"] < settings.ROUTER_REFRESH_SAMPLES):
+        return snapshot["stats"]
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lrange(LATENCY_KEY.format(model=model), 0, -1)
+        pipe.llen(ERRORS_KEY.format(model=model))
+        samples, errors = pipe.execute()
+        samples = [float(sample) for sample in samples]
+    except redis.RedisError:
+        samples, errors = [], 0
+
+    stats = {"samples": len(samples), "errors": errors}
+    if samples:
+        stats.update({
+            "p50": _percentile(samples, 0.50),
+            "p95": _percentile(samples, 0.95),
+            "p99": _percentile(samples, 0.99),
+        })
+    _snapshots[model] = {"at": time.monotonic(), "recorded": 0, "stats": stats}
+    return stats
+
+
+def _degraded(model: str) -> bool:
+    stats = latency_stats(model)
+    return stats["samples"] >= settings.ROUTER_MIN_SAMPLES and stats["p95"] > settings.ROUTER_DEGRADED_P95_MS
+
+
+def _p95(model: str) -> Optional[float]:
+    stats = latency_stats(model)
+    return stats.get("p95") if stats["samples"] >= settings.ROUTER_MIN_SAMPLES else None
+
+
+def route_model(tool: str, user_prompt: str, requested: Optional[str] = None,
+                latency_target_ms: Optional[int] = None) -> str:
+    """Pick a model for one call from the tool, input size and caller's latency target.
+
+    An explicitly requested model that this deployment serves always wins.
+    Otherwise small inputs and conversational tools go to MODEL_FAST and large
+    rewrites to MODEL_DEFAULT, moving to the other model when the preferred
+    one's rolling p95 misses the latency target or marks it as degraded.
+    """
+    models = available_models()
+    if requested and requested in models:
+        return requested
+
+    fast, default = settings.MODEL_FAST, settings.MODEL_DEFAULT
+    if not settings.ROUTER_ENABLED or fast == default:
+        return default
+
+    input_tokens = count_tokens(user_prompt, default)
+    if tool in FAST_TOOLS or (tool not in HEAVY_TOOLS and input_tokens <= settings.ROUTER_SMALL_INPUT_TOKENS):
+        preferred, alternate = fast, default
+    else:
+        preferred, alternate = default, fast
+
+    if latency_target_ms:
+        p95 = _p95(preferred)
+        if p95 is not None and p95 > latency_target_ms:
+            alternate_p95 = _p95(alternate)
+            if alternate_p95 is None or alternate_p95 < p95:
+                return alternate
+
+    if _degraded(preferred) and not _degraded(alternate):
+        return alternate
+    return preferred
+
+
+def router_stats() -> dict:
+    return {model: latency_stats(model) for model in available_models()}
@@ -0,0 +1,89 @@
+import ast
+import difflib
+import re
+from typing import List
+
+OUTLINE_RE = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|static\s+)*(?:async\s+)?"
+    r"(?:def|class|function|func|fn|interface|struct|enum|impl)\b"
+)
+MAX_OUTLINE_ENTRIES = 40
+# Beyond this a diff is close to the whole file again.
+MAX_CONTEXT_LINES = 50
+
+
+def file_outline(code: str, language: str = "") -> List[str]:
+    """Compact list of top-level definitions with their line numbers."""
+    entries = []
+    if not language or language.lower() in ("python", "py", "auto-detect"):
+        try:
+            tree = ast.parse(code)
+            for node in tree.body:
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    entries.append(f"L{node.lineno} def {node.name}()")
+                elif isinstance(node, ast.ClassDef):
+                    methods = [n.name for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+                    entries.append(f"L{node.lineno} class {node.name}: {', '.join(methods)}")
+            return entries[:MAX_OUTLINE_ENTRIES]
+        except SyntaxError:
+            entries = []
+
+    for number, line in enumerate(code.split("\n"), start=1):
+        if OUTLINE_RE.match(line):
+            entries.append(f"L{number} {line.strip()[:100]}")
+    return entries[:MAX_OUTLINE_ENTRIES]
+
+
+def unified_diff(original: str, modified: str, filename: str = "code", context_lines: int = 3) -> str:
+    return "".join(difflib.unified_diff(
+        original.splitlines(keepends=True),
+        modified.splitlines(keepends=True),
+        fromfile=f"a/{filename}",
+        tofile=f"b/{filename}",
+        n=context_lines,
+    ))
+
+
+def file_change_section(original: str, modified: str, filename: str = "", language: str = "",
+                        context_lines: int = 3) -> str:
+    """Describe one file's change as a diff plus outline, or as full text when the diff is larger."""
+    name = filename or "code"
+    diff = unified_diff(original, modified, name, context_lines)
+    if len(diff) >= len(original) + len(modified):
+        return f"""File: {name}
+
+Original Code:
+{original}
+
+Modified Code:
+{modified}
+"""
+
+    outline = file_outline(modified or original, language)
+    outline_text = "\n".join(outline) if outline else "(no top-level definitions found)"
+    return f"""File: {name}
+Outline of modified file:
+{outline_text}
+
+Unified diff ({context_lines} lines of context):
+{diff or '(no changes)'}
+"""
+
+
+def build_pr_prompt(files: List[dict], language: str = "", title: str = "", changes: str = "",
+                    context_lines: int = 3) -> str:
+    """User prompt for the PR generator from (filename, original_code, modified_code) dicts."""
+    sections = "\n".join(
+        file_change_section(
+            f.get("original_code") or "", f.get("modified_code") or "", f.get("filename") or "",
+            language, context_lines,
+        )
+        for f in files
+    )
+    return f"""
+Language: {language or 'auto-detect'}
+Suggested Title: {title or 'Auto-generated PR'}
+Changes Summary: {changes or 'See code diff'}
+Files Changed: {len(files)}
+
+{sections}"""
@@ -0,0 +1,251 @@
+import ast
+import builtins
+from typing import Callable, Dict, List
+
+import redis
+
+from config import settings
+from cache import redis_client
+from token_budget import close_code
+
+STATS_KEY = "preanalysis:stats"
+
+BRACKETS = {")": "(", "]": "[", "}": "{"}
+# Line comment / string delimiters for the tokenizer-based checker.
+C_STYLE = {"line_comment": "//", "block_comment": ("/*", "*/"), "quotes": "\"'`"}
+HASH_STYLE = {"line_comment": "#", "block_comment": None, "quotes": "\"'"}
+
+
+def _issue(category: str, line: int, issue: str, suggestion: str, source: str = "static") -> dict:
+    """An issue shaped like the debug schema's.
+
+    source is "static" for findings from a real parser or AST, and "heuristic"
+    for the bracket tokenizer, which has no grammar and can misread valid code
+    (Rust lifetimes, string templates, regex literals, shell case patterns).
+    """
+    return {"category": category, "line": line, "issue": issue, "suggestion": suggestion, "source": source}
+
+
+def _heuristic(line: int, issue: str, suggestion: str) -> dict:
+    return _issue("syntax", line, issue, suggestion, source="heuristic")
+
+
+def check_python(code: str) -> List[dict]:
+    """Syntax errors via compile(), then unused imports and locals via ast."""
+    try:
+        tree = compile(code, "<input>", "exec", flags=ast.PyCF_ONLY_AST, dont_inherit=True)
+        compile(tree, "<input>", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return [_issue("syntax", e.lineno or 1, f"SyntaxError: {e.msg}", "Fix the syntax error at this line")]
+
+    loaded = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+    # Attribute roots such as os.path count as uses of "os".
+    loaded |= {node.value.id for node in ast.walk(tree)
+               if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)}
+    exported = set()
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "__all__" for t in node.targets):
+            if isinstance(node.value, (ast.List, ast.Tuple)):
+                exported |= {elt.value for elt in node.value.elts if isinstance(elt, ast.Constant)}
+
+    issues = []
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module == "__future__":
+            # Compiler directives, not names the code is meant to use.
+            continue
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                name = (alias.asname or alias.name).split(".")[0]
+                if name != "*" and name not in loaded and name not in exported and not name.startswith("_"):
+                    issues.append(_issue("logic", node.lineno, f"'{name}' is imported but never used",
+                                         f"Remove the unused import '{name}'"))
+
+    for func in ast.walk(tree):
+        if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        declared = set()
+        for node in ast.walk(func):
+            if isinstance(node, (ast.Global, ast.Nonlocal)):
+                declared |= set(node.names)
+        # Loop targets are routinely unused ("for i in range(n)").
+        loop_targets = {
+            target.id
+            for node in ast.walk(func) if isinstance(node, (ast.For, ast.AsyncFor, ast.comprehension))
+            for target in ast.walk(node.target) if isinstance(target, ast.Name)
+        }
+        assigned = {}
+        used = set()
+        for node in ast.walk(func):
+            if isinstance(node, ast.Name):
+                if isinstance(node.ctx, ast.Store):
+                    assigned.setdefault(node.id, node.lineno)
+                else:
+                    used.add(node.id)
+        for name, line in sorted(assigned.items(), key=lambda item: item[1]):
+            if name in used or name in declared or name in loop_targets or name.startswith("_"):
+                continue
+            issues.append(_issue("logic", line, f"Local variable '{name}' is assigned but never used",
+                                 f"Remove '{name}' or use it"))
+
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and not node.decorator_list:
+            if node.name in definitions and node.name not in dir(builtins):
+                issues.append(_issue("logic", node.lineno, f"'{node.name}' redefines the definition on line "
+                                     f"{definitions[node.name]}", "Rename or remove one of the definitions"))
+            definitions[node.name] = node.lineno
+    return issues
+
+
+def make_bracket_checker(syntax: dict) -> Callable[[str], List[dict]]:
+    """Build a tokenizer-based checker for unbalanced brackets and unterminated strings.
+
+    Its findings are heuristic: they are passed to the model as hints but never
+    block the model call or appear in results on their own.
+    """
+    line_comment = syntax["line_comment"]
+    block_comment = syntax["block_comment"]
+    quotes = syntax["quotes"]
+
+    def check(code: str) -> List[dict]:
+        stack = []
+        line = 1
+        i = 0
+        length = len(code)
+        while i < length:
+            ch = code[i]
+            if ch == "\n":
+                line += 1
+            elif code.startswith(line_comment, i):
+                end = code.find("\n", i)
+                i = length if end == -1 else end
+                continue
+            elif block_comment and code.startswith(block_comment[0], i):
+                end = code.find(block_comment[1], i + len(block_comment[0]))
+                if end == -1:
+                    return [_heuristic(line, "Unterminated block comment", f"Close it with {block_comment[1]}")]
+                line += code.count("\n", i, end)
+                i = end + len(block_comment[1])
+                continue
+            elif ch in quotes:
+                start_line = line
+                i += 1
+                while i < length and code[i] != ch:
+                    if code[i] == "\\":
+                        i += 1
+                    elif code[i] == "\n":
+                        if ch != "`":
+                            return [_heuristic(start_line, "Unterminated string literal",
+                                               f"Close the string with {ch}")]
+                        line += 1
+                    i += 1
+                if i >= length:
+                    return [_heuristic(start_line, "Unterminated string literal", f"Close the string with {ch}")]
+            elif ch in "([{":
+                stack.append((ch, line))
+            elif ch in BRACKETS:
+                if not stack or stack[-1][0] != BRACKETS[ch]:
+                    return [_heuristic(line, f"Unmatched '{ch}'", "Remove it or add the matching opening bracket")]
+                stack.pop()
+            i += 1
+        if stack:
+            opener, opened_at = stack[-1]
+            return [_heuristic(opened_at, f"'{opener}' is never closed", "Add the matching closing bracket")]
+        return []
+
+    return check
+
+
+CHECKERS: Dict[str, Callable[[str], List[dict]]] = {
+    "python": check_python,
+    "py": check_python,
+}
+for _language in ("javascript", "js", "typescript", "ts", "java", "c", "cpp", "c++", "csharp", "c#", "go", "rust",
+                  "kotlin", "swift", "php", "scala"):
+    CHECKERS[_language] = make_bracket_checker(C_STYLE)
+for _language in ("ruby", "rb", "shell", "bash"):
+    CHECKERS[_language] = make_bracket_checker(HASH_STYLE)
+
+
+def register_checker(language: str, checker: Callable[[str], List[dict]]):
+    """Plug in a checker for another language; it returns issues shaped like the debug schema."""
+    CHECKERS[language.lower()] = checker
+
+
+def pre_analyze(code: str, language: str = "") -> List[dict]:
+    """Run the local checker for a language; unknown or auto-detect languages are skipped."""
+    checker = CHECKERS.get((language or "").strip().lower())
+    if not settings.PREANALYSIS_ENABLED or checker is None:
+        return []
+    _record("checked")
+    return checker(code)
+
+
+def _confirmed(issues: List[dict]) -> List[dict]:
+    return [issue for issue in issues if issue.get("source") != "heuristic"]
+
+
+def is_blocking(issues: List[dict]) -> bool:
+    """Syntax errors from a real parser are answered locally without a model call."""
+    return settings.PREANALYSIS_SHORT_CIRCUIT and any(issue["category"] == "syntax" for issue in _confirmed(issues))
+
+
+def blocking_result(issues: List[dict]) -> dict:
+    _record("avoided")
+    return {
+        "summary": "The code does not parse. Fix the syntax error below and run the debugger again.",
+        "severity": "critical",
+        "issues": _confirmed(issues),
+        "fixedCode": "",
+        "preAnalysis": True,
+    }
+
+
+def with_hints(user_prompt: str, issues: List[dict]) -> str:
+    """Append local findings so the model can skip re-deriving them."""
+    if not issues:
+        return user_prompt
+    _record("hinted")
+    confirmed = _confirmed(issues)
+    possible = [issue for issue in issues if issue not in confirmed]
+    user_prompt = close_code(user_prompt)
+    if confirmed:
+        findings = "\n".join(f"- line {issue['line']}: {issue['issue']}" for issue in confirmed)
+        user_prompt = (
+            f"{user_prompt}\nStatic analysis already found these issues (exact line numbers). "
+            f"Do not repeat them in \"issues\"; focus on logic, runtime and edge-case problems:\n{findings}"
+        )
+    if possible:
+        findings = "\n".join(f"- line {issue['line']}: {issue['issue']}" for issue in possible)
+        user_prompt = (
+            f"{user_prompt}\n\nA bracket/quote scan without a parser flagged these; they may be false "
+            f"positives. Report them in \"issues\" only if they are real:\n{findings}"
+        )
+    return user_prompt
+
+
+def merge_issues(result: dict, issues: List[dict]) -> dict:
+    """Add local findings to a model result, skipping lines the model already reported."""
+    issues = _confirmed(issues)
+    if not issues or not isinstance(result, dict) or "raw" in result:
+        return result
+    model_issues = result.get("issues") if isinstance(result.get("issues"), list) else []
+    reported = {(i.get("line"), i.get("category")) for i in model_issues if isinstance(i, dict)}
+    extra = [issue for issue in issues if (issue["line"], issue["category"]) not in reported]
+    return {**result, "issues": sorted(model_issues + extra, key=lambda i: i.get("line") or 0)}
+
+
+def _record(stat: str):
+    try:
+        redis_client.hincrby(STATS_KEY, stat, 1)
+    except redis.RedisError:
+        pass
+
+
+def preanalysis_stats() -> dict:
+    stats = {k.decode(): int(v) for k, v in redis_client.hgetall(STATS_KEY).items()}
+    return {
+        "checked": stats.get("checked", 0),
+        "model_calls_avoided": stats.get("avoided", 0),
+        "hinted": stats.get("hinted", 0),
+    }
@@ -0,0 +1,48 @@
+from typing import Dict, List, Optional, Set
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Dict[Optional[str], Set[str]]]:
+    """Parse "summary,refactor.refactoredCode" into {None: {"summary"}, "refactor": {"refactoredCode"}}.
+
+    Unqualified names apply to every tool; "tool.name" to one tool only.
+    """
+    if not fields:
+        return None
+    parsed: Dict[Optional[str], Set[str]] = {}
+    for field in fields.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        tool, _, name = field.rpartition(".")
+        parsed.setdefault(tool or None, set()).add(name)
+    return parsed or None
+
+
+def _project_envelope(envelope, tool: Optional[str], fields: Dict[Optional[str], Set[str]]):
+    """Keep the selected keys of a {"success", "data", "tool"} envelope's data."""
+    if not isinstance(envelope, dict) or not isinstance(envelope.get("data"), dict):
+        return envelope
+    wanted = fields.get(None, set()) | fields.get(tool, set())
+    data = envelope["data"]
+    omitted: List[str] = [key for key in data if key not in wanted]
+    return {
+        **envelope,
+        "data": {key: value for key, value in data.items() if key in wanted},
+        "omitted": omitted,
+    }
+
+
+def project_result(result, fields: Optional[str]):
+    """Apply a fields= projection to a job result.
+
+    Single-tool results project their "data" (tool qualifiers are ignored);
+    multi-analysis results project each tool's section. Dropped keys are
+    listed under "omitted" so clients can fetch them later.
+    """
+    parsed = parse_fields(fields)
+    if parsed is None or not isinstance(result, dict):
+        return result
+    if result.get("tool") == "multi-analysis" and isinstance(result.get("data"), dict):
+        sections = {tool: _project_envelope(section, tool, parsed) for tool, section in result["data"].items()}
+        return {**result, "data": sections}
+    return _project_envelope(result, None, {None: set().union(*parsed.values())})
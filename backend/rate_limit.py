@@ -0,0 +1,374 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+from uuid import uuid4
+
+import openai
+import redis
+
+from config import settings
+from cache import redis_client, async_redis_client
+
+T = TypeVar("T")
+
+REQUEST_BUCKET_KEY = "ratelimit:openai:requests"
+TOKEN_BUCKET_KEY = "ratelimit:openai:tokens"
+WAITERS_KEY = "ratelimit:openai:waiters"
+BREAKER_FAILURES_KEY = "breaker:openai:failures"
+BREAKER_OPEN_KEY = "breaker:openai:open_until"
+
+# Refills both buckets, then takes one request and `cost` tokens if both have
+# enough. Returns "0" on success, otherwise the seconds until they would.
+BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = math.min(tonumber(ARGV[4]), tonumber(ARGV[3]))
+local function refill(key, capacity)
+  local data = redis.call('HMGET', key, 'level', 'ts')
+  local level = tonumber(data[1]) or capacity
+  local ts = tonumber(data[2]) or now
+  local rate = capacity / 60
+  return math.min(capacity, level + math.max(0, now - ts) * rate), rate
+end
+local requests, request_rate = refill(KEYS[1], tonumber(ARGV[2]))
+local tokens, token_rate = refill(KEYS[2], tonumber(ARGV[3]))
+local wait = 0
+if requests < 1 then wait = (1 - requests) / request_rate end
+if tokens < cost then wait = math.max(wait, (cost - tokens) / token_rate) end
+if wait == 0 then
+  requests = requests - 1
+  tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'level', tostring(requests), 'ts', tostring(now))
+redis.call('HSET', KEYS[2], 'level', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return tostring(wait)
+"""
+
+_bucket = redis_client.register_script(BUCKET_SCRIPT)
+_bucket_async = async_redis_client.register_script(BUCKET_SCRIPT)
+
+
+class UpstreamUnavailableError(Exception):
+    """The model API cannot take this call right now; retry after ``retry_after`` seconds."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(UpstreamUnavailableError):
+    """Our shared quota is used up (queue_position > 0) or OpenAI kept answering 429."""
+
+    status_code = 429
+
+    def __init__(self, retry_after: float, queue_position: int = 0, message: str = ""):
+        super().__init__(
+            message or f"OpenAI quota exhausted; {queue_position} call(s) queued, retry in about {retry_after:.0f}s",
+            retry_after,
+        )
+        self.queue_position = queue_position
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"OpenAI is unavailable; retry in about {retry_after:.0f}s", retry_after)
+
+
+def _bucket_args(tokens: int) -> list:
+    return [time.time(), settings.OPENAI_RPM, settings.OPENAI_TPM, tokens]
+
+
+def _queue_position(rank: Optional[int]) -> int:
+    return (rank or 0) + 1
+
+
+def acquire(tokens: int, max_wait: float = None):
+    """Block until the shared bucket has room for one request of ``tokens`` tokens.
+
+    Raises RateLimitedError when the wait would exceed ``max_wait``.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    max_wait = settings.RATE_LIMIT_WORKER_MAX_WAIT if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    waiter = None
+    try:
+        while True:
+            wait = float(_bucket(keys=[REQUEST_BUCKET_KEY, TOKEN_BUCKET_KEY], args=_bucket_args(tokens)))
+            if wait <= 0:
+                return
+            if waiter is None:
+                waiter = uuid4().hex
+                redis_client.zremrangebyscore(WAITERS_KEY, "-inf", time.time() - settings.RATE_LIMIT_WORKER_MAX_WAIT)
+                redis_client.zadd(WAITERS_KEY, {waiter: time.time()})
+            if time.monotonic() + wait > deadline:
+                raise RateLimitedError(wait, _queue_position(redis_client.zrank(WAITERS_KEY, waiter)))
+            time.sleep(min(wait, 1.0) + random.uniform(0, 0.05))
+    except redis.RedisError:
+        # Fail open: without Redis the upstream 429 handling still applies.
+        return
+    finally:
+        if waiter is not None:
+            try:
+                redis_client.zrem(WAITERS_KEY, waiter)
+            except redis.RedisError:
+                pass
+
+
+async def acquire_async(tokens: int, max_wait: float = None):
+    """Async variant of acquire for the API event loop.
+
+    New callers are turned away at once while RATE_LIMIT_MAX_QUEUE others wait.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    max_wait = settings.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    waiter = None
+    try:
+        while True:
+            wait = float(await _bucket_async(keys=[REQUEST_BUCKET_KEY, TOKEN_BUCKET_KEY], args=_bucket_args(tokens)))
+            if wait <= 0:
+                return
+            if waiter is None:
+                await async_redis_client.zremrangebyscore(
+                    WAITERS_KEY, "-inf", time.time() - settings.RATE_LIMIT_WORKER_MAX_WAIT
+                )
+                queued = await async_redis_client.zcard(WAITERS_KEY)
+                if queued >= settings.RATE_LIMIT_MAX_QUEUE:
+                    raise RateLimitedError(wait, queued + 1)
+                waiter = uuid4().hex
+                await async_redis_client.zadd(WAITERS_KEY, {waiter: time.time()})
+            if time.monotonic() + wait > deadline:
+                raise RateLimitedError(wait, _queue_position(await async_redis_client.zrank(WAITERS_KEY, waiter)))
+            await asyncio.sleep(min(wait, 1.0) + random.uniform(0, 0.05))
+    except redis.RedisError:
+        return
+    finally:
+        if waiter is not None:
+            try:
+                await async_redis_client.zrem(WAITERS_KEY, waiter)
+            except redis.RedisError:
+                pass
+
+
+def _drain_pipeline(client):
+    now = str(time.time())
+    pipe = client.pipeline()
+    pipe.hset(REQUEST_BUCKET_KEY, mapping={"level": "0", "ts": now})
+    pipe.hset(TOKEN_BUCKET_KEY, mapping={"level": "0", "ts": now})
+    return pipe
+
+
+def _drain_buckets():
+    """After an upstream 429 our estimate of the quota was too generous; empty both buckets."""
+    try:
+        _drain_pipeline(redis_client).execute()
+    except redis.RedisError:
+        pass
+
+
+async def _drain_buckets_async():
+    try:
+        await _drain_pipeline(async_redis_client).execute()
+    except redis.RedisError:
+        pass
+
+
+def _raise_if_open(open_until):
+    if open_until and float(open_until) > time.time():
+        raise CircuitOpenError(float(open_until) - time.time())
+
+
+def check_breaker():
+    """Raise CircuitOpenError while the breaker is open."""
+    try:
+        open_until = redis_client.get(BREAKER_OPEN_KEY)
+    except redis.RedisError:
+        return
+    _raise_if_open(open_until)
+
+
+async def check_breaker_async():
+    try:
+        open_until = await async_redis_client.get(BREAKER_OPEN_KEY)
+    except redis.RedisError:
+        return
+    _raise_if_open(open_until)
+
+
+def _failure_pipeline(client):
+    pipe = client.pipeline()
+    pipe.incr(BREAKER_FAILURES_KEY)
+    pipe.expire(BREAKER_FAILURES_KEY, int(settings.BREAKER_RESET_SECONDS * 2))
+    return pipe
+
+
+def _open_breaker_args() -> dict:
+    # Half-open after the reset period: the next failure re-opens it at once.
+    return {"name": BREAKER_OPEN_KEY, "value": time.time() + settings.BREAKER_RESET_SECONDS,
+            "ex": int(settings.BREAKER_RESET_SECONDS) + 1}
+
+
+def _record_failure():
+    try:
+        failures = _failure_pipeline(redis_client).execute()[0]
+        if failures >= settings.BREAKER_FAILURE_THRESHOLD:
+            redis_client.set(**_open_breaker_args())
+    except redis.RedisError:
+        pass
+
+
+async def _record_failure_async():
+    try:
+        failures = (await _failure_pipeline(async_redis_client).execute())[0]
+        if failures >= settings.BREAKER_FAILURE_THRESHOLD:
+            await async_redis_client.set(**_open_breaker_args())
+    except redis.RedisError:
+        pass
+
+
+def _record_success():
+    try:
+        redis_client.delete(BREAKER_FAILURES_KEY)
+    except redis.RedisError:
+        pass
+
+
+async def _record_success_async():
+    try:
+        await async_redis_client.delete(BREAKER_FAILURES_KEY)
+    except redis.RedisError:
+        pass
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, settings.RETRY_MAX_DELAY))
+    return delay
+
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _max_attempts() -> int:
+    # Zero or negative settings still make the call once rather than returning nothing.
+    return max(1, settings.RETRY_MAX_ATTEMPTS)
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Delay before the next attempt; once attempts run out, raise the typed error for the API to map."""
+    retry_after = _retry_after(error)
+    if attempt + 1 < _max_attempts():
+        return backoff_delay(attempt, retry_after)
+    wait = retry_after if retry_after is not None else settings.RETRY_MAX_DELAY
+    attempts = _max_attempts()
+    if isinstance(error, openai.RateLimitError):
+        raise RateLimitedError(
+            wait, message=f"OpenAI rate limit persisted after {attempts} attempts; retry in about {wait:.0f}s",
+        ) from error
+    raise UpstreamUnavailableError(f"OpenAI failed after {attempts} attempts: {error}", wait) from error
+
+
+def _handle_failure(error: Exception, attempt: int) -> Optional[float]:
+    """Record a failed call; return the delay before retrying, or None if it is not retryable."""
+    if not isinstance(error, RETRYABLE_ERRORS):
+        return None
+    if isinstance(error, openai.RateLimitError):
+        _drain_buckets()
+    else:
+        _record_failure()
+    return _retry_delay(error, attempt)
+
+
+async def _handle_failure_async(error: Exception, attempt: int) -> Optional[float]:
+    if not isinstance(error, RETRYABLE_ERRORS):
+        return None
+    if isinstance(error, openai.RateLimitError):
+        await _drain_buckets_async()
+    else:
+        await _record_failure_async()
+    return _retry_delay(error, attempt)
+
+
+def call_with_retries(call: Callable[[], T], tokens: int) -> T:
+    """Run one model API call under the shared quota, retrying 429s, 5xx and connection errors.
+
+    Raises RateLimitedError or UpstreamUnavailableError once retries are exhausted.
+    """
+    for attempt in range(_max_attempts()):
+        check_breaker()
+        acquire(tokens)
+        try:
+            result = call()
+        except Exception as e:
+            delay = _handle_failure(e, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        _record_success()
+        return result
+
+
+async def call_with_retries_async(call: Callable[[], Awaitable[T]], tokens: int) -> T:
+    """Async variant of call_with_retries for the API event loop."""
+    for attempt in range(_max_attempts()):
+        await check_breaker_async()
+        await acquire_async(tokens)
+        try:
+            result = await call()
+        except Exception as e:
+            delay = await _handle_failure_async(e, attempt)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        await _record_success_async()
+        return result
+
+
+def rate_limit_stats() -> dict:
+    level, ts = redis_client.hmget(TOKEN_BUCKET_KEY, "level", "ts")
+    open_until = redis_client.get(BREAKER_OPEN_KEY)
+    tokens_available = float(settings.OPENAI_TPM)
+    if level is not None:
+        refilled = float(level) + (time.time() - float(ts)) * settings.OPENAI_TPM / 60
+        tokens_available = min(tokens_available, refilled)
+    return {
+        "rpm": settings.OPENAI_RPM,
+        "tpm": settings.OPENAI_TPM,
+        "tokensAvailable": round(tokens_available),
+        "queued": redis_client.zcard(WAITERS_KEY),
+        "breakerOpen": bool(open_until and float(open_until) > time.time()),
+        "recentFailures": int(redis_client.get(BREAKER_FAILURES_KEY) or 0),
+    }
@@ -0,0 +1,222 @@
+import json
+import os
+import re
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from config import settings
+from cache import redis_client, pack, unpack
+from ai_service import analyze_with_ai_sync, build_system_prompt
+from metrics import stage
+from cancellation import JobCancelledError, cancel_watcher, raise_if_cancelled
+
+LANGUAGE_EXTENSIONS = {
+    ".py": "python",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".java": "java",
+    ".go": "go",
+    ".rb": "ruby",
+    ".rs": "rust",
+    ".c": "c",
+    ".h": "c",
+    ".cpp": "cpp",
+    ".cc": "cpp",
+    ".hpp": "cpp",
+    ".cs": "csharp",
+    ".php": "php",
+    ".kt": "kotlin",
+    ".swift": "swift",
+    ".scala": "scala",
+}
+SKIPPED_DIRS = {".git", "node_modules", "vendor", "dist", "build", "__pycache__", ".venv", "venv", "target"}
+NOT_SOURCE = "not a source file"
+
+RESULTS_KEY = "repo_job:{job_id}:files"
+META_KEY = "repo_job:{job_id}:meta"
+
+GITHUB_REPO_RE = re.compile(r"^(?:https?://github\.com/)?([\w.-]+)/([\w.-]+?)(?:\.git)?(?:/tree/(.+?))?/?$")
+
+
+def archive_url(repo_url: str, ref: str = "") -> str:
+    """Tarball download URL for a GitHub repository URL or owner/repo string."""
+    match = GITHUB_REPO_RE.match(repo_url.strip())
+    if not match:
+        raise ValueError(f"Unsupported repository URL: {repo_url}")
+    owner, repo, tree_ref = match.groups()
+    return f"https://api.github.com/repos/{owner}/{repo}/tarball/{ref or tree_ref or ''}".rstrip("/")
+
+
+def download_archive(url: str, dest_path: str, token: str = ""):
+    """Stream a repository archive to disk, enforcing REPO_MAX_ARCHIVE_BYTES."""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    written = 0
+    with stage("github_fetch", "repo"), \
+            httpx.stream("GET", url, headers=headers, follow_redirects=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(dest_path, "wb") as archive:
+            for block in response.iter_bytes():
+                written += len(block)
+                if written > settings.REPO_MAX_ARCHIVE_BYTES:
+                    raise ValueError("Repository archive exceeds size limit")
+                archive.write(block)
+
+
+def extract_archive(archive_path: str, dest_dir: str) -> str:
+    """Extract a tarball, refusing members that escape dest_dir. Returns the source root."""
+    os.makedirs(dest_dir, exist_ok=True)
+    dest_root = os.path.realpath(dest_dir)
+    with tarfile.open(archive_path) as archive:
+        members = []
+        for member in archive.getmembers():
+            if not (member.isfile() or member.isdir()):
+                continue
+            target = os.path.realpath(os.path.join(dest_root, member.name))
+            if not target.startswith(dest_root + os.sep):
+                continue
+            members.append(member)
+        archive.extractall(dest_root, members=members)
+
+    # GitHub tarballs wrap everything in a single <owner>-<repo>-<sha>/ directory.
+    entries = os.listdir(dest_root)
+    if len(entries) == 1 and os.path.isdir(os.path.join(dest_root, entries[0])):
+        return os.path.join(dest_root, entries[0])
+    return dest_root
+
+
+def skipped_file(path: str, reason: str) -> Dict[str, str]:
+    return {"path": path, "reason": reason}
+
+
+def iter_source_files(root: str, languages: Optional[List[str]] = None, max_file_bytes: int = None,
+                      skipped: Optional[List[Dict[str, str]]] = None) -> Iterator[Tuple[str, str, str]]:
+    """Yield (absolute path, relative path, language) for analyzable files.
+
+    Source files left out (another language, empty or too large) are appended
+    to ``skipped`` when given; files that are not source code are not listed.
+    """
+    max_file_bytes = max_file_bytes or settings.REPO_MAX_FILE_BYTES
+    wanted = {language.lower() for language in languages} if languages else None
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIPPED_DIRS and not d.startswith("."))
+        for filename in sorted(filenames):
+            language = LANGUAGE_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+            if not language:
+                continue
+            path = os.path.join(dirpath, filename)
+            relative = os.path.relpath(path, root)
+            size = os.path.getsize(path)
+            if wanted and language not in wanted:
+                reason = f"{language} not among the selected languages"
+            elif size == 0:
+                reason = "empty"
+            elif size > max_file_bytes:
+                reason = f"over {max_file_bytes} bytes"
+            else:
+                yield path, relative, language
+                continue
+            if skipped is not None:
+                skipped.append(skipped_file(relative, reason))
+
+
+def append_file_result(job_id: str, item: dict):
+    """Append one file's results so clients can page through them mid-job."""
+    pipe = redis_client.pipeline()
+    pipe.rpush(RESULTS_KEY.format(job_id=job_id), pack(item))
+    pipe.hincrby(META_KEY.format(job_id=job_id), "completed", 1)
+    pipe.expire(RESULTS_KEY.format(job_id=job_id), settings.REPO_RESULTS_TTL)
+    pipe.execute()
+
+
+def set_job_meta(job_id: str, **fields):
+    key = META_KEY.format(job_id=job_id)
+    redis_client.hset(key, mapping={k: json.dumps(v) if not isinstance(v, (str, int)) else v for k, v in fields.items()})
+    redis_client.expire(key, settings.REPO_RESULTS_TTL)
+
+
+def get_file_results(job_id: str, offset: int = 0, limit: int = 50) -> dict:
+    """Page through per-file results written so far."""
+    pipe = redis_client.pipeline()
+    pipe.lrange(RESULTS_KEY.format(job_id=job_id), offset, offset + limit - 1)
+    pipe.hgetall(META_KEY.format(job_id=job_id))
+    items, meta = pipe.execute()
+    meta = {k.decode(): v.decode() for k, v in meta.items()}
+    files = [unpack(item) for item in items]
+    return {
+        "job_id": job_id,
+        "status": meta.get("status", "pending"),
+        "total": int(meta.get("total", 0)),
+        "completed": int(meta.get("completed", 0)),
+        "offset": offset,
+        "files": files,
+        "next_offset": offset + len(files),
+    }
+
+
+def _analyze_file(path: str, relative: str, language: str, tools: List[str], use_cache: bool,
+                  job_id: str = "") -> dict:
+    # Cache hits never stream, so the watcher alone would not stop a cancelled job.
+    raise_if_cancelled(job_id)
+    with open(path, encoding="utf-8", errors="replace") as source:
+        code = source.read()
+    user_prompt = f"Language: {language}\n\nCode:\n{code}"
+    results = {}
+    for tool in tools:
+        raise_if_cancelled(job_id)
+        try:
+            results[tool] = analyze_with_ai_sync(build_system_prompt(tool), user_prompt, tool=tool, use_cache=use_cache,
+                                                 on_delta=cancel_watcher(job_id))
+        except JobCancelledError:
+            raise
+        except Exception as e:
+            results[tool] = {"error": str(e)}
+    return {"path": relative, "language": language, "results": results}
+
+
+def run_repo_pipeline(job_id: str, archive_path: str, work_dir: str, tools: List[str],
+                      languages: Optional[List[str]] = None, max_file_bytes: int = None,
+                      max_files: int = None, use_cache: bool = True,
+                      on_file: Optional[Callable[[dict], None]] = None) -> dict:
+    """Analyze every matching file in a repository tarball with bounded concurrency.
+
+    Works on any local tarball, so it can run against fixtures without network
+    access; the Celery task only adds the download step.
+    """
+    root = extract_archive(archive_path, work_dir)
+    return run_file_pipeline(job_id, root, tools, languages, max_file_bytes, max_files, use_cache, on_file)
+
+
+def run_file_pipeline(job_id: str, root: str, tools: List[str], languages: Optional[List[str]] = None,
+                      max_file_bytes: int = None, max_files: int = None, use_cache: bool = True,
+                      on_file: Optional[Callable[[dict], None]] = None) -> dict:
+    """Analyze every matching file under a directory, appending per-file results as they finish."""
+    skipped = []
+    files = list(iter_source_files(root, languages, max_file_bytes, skipped))
+    max_files = max_files or settings.REPO_MAX_FILES
+    skipped += [skipped_file(relative, f"over the {max_files}-file limit") for _, relative, _ in files[max_files:]]
+    files = files[:max_files]
+    set_job_meta(job_id, status="running", total=len(files), completed=0)
+
+    with ThreadPoolExecutor(max_workers=settings.REPO_CONCURRENCY) as pool:
+        futures = [
+            pool.submit(_analyze_file, path, relative, language, tools, use_cache, job_id)
+            for path, relative, language in files
+        ]
+        try:
+            for future in as_completed(futures):
+                item = future.result()
+                append_file_result(job_id, item)
+                if on_file:
+                    on_file(item)
+        except JobCancelledError:
+            pool.shutdown(wait=False, cancel_futures=True)
+            set_job_meta(job_id, status="cancelled")
+            raise
+
+    set_job_meta(job_id, status="completed")
+    return {"files": len(files), "skipped": skipped, "tools": tools}
@@ -0,0 +1,31 @@
+import zlib
+
+from celery.backends.redis import RedisBackend
+
+from config import settings
+from cache import COMPRESSED_PREFIX
+from metrics import stage
+
+
+class CompressedRedisBackend(RedisBackend):
+    """Redis result backend that zlib-compresses large results.
+
+    Uses the same marker as the result cache, so results stored before
+    compression was enabled still decode.
+    """
+
+    def encode(self, data):
+        payload = super().encode(data)
+        raw = payload.encode("utf-8") if isinstance(payload, str) else payload
+        if len(raw) < settings.RESULT_COMPRESS_MIN_BYTES:
+            return payload
+        return COMPRESSED_PREFIX + zlib.compress(raw)
+
+    def _store_result(self, task_id, result, state, traceback=None, request=None, **kwargs):
+        with stage("job_store"):
+            return super()._store_result(task_id, result, state, traceback, request, **kwargs)
+
+    def decode(self, payload):
+        if isinstance(payload, bytes) and payload[:2] == COMPRESSED_PREFIX:
+            payload = zlib.decompress(payload[2:])
+        return super().decode(payload)
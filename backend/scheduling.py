@@ -0,0 +1,253 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from celery_app import celery_app
+from config import settings
+from cache import redis_client
+from cancellation import is_cancelled
+
+INTERACTIVE_QUEUE = "interactive"
+BATCH_QUEUE = "batch"
+REPO_QUEUE = "repo"
+QUEUES = (INTERACTIVE_QUEUE, BATCH_QUEUE, REPO_QUEUE)
+
+JOB_KEY = "fair:job:{job_id}"
+INFLIGHT_KEY = "fair:inflight:{queue}:{tenant}"
+PENDING_KEY = "fair:pending:{queue}:{tenant}"
+RING_KEY = "fair:ring:{queue}"
+RING_MEMBERS_KEY = "fair:ring_members:{queue}"
+WAIT_KEY = "queue_wait:{queue}"
+
+WAIT_WINDOW = 500
+JOB_TTL = 86400
+# Slack past a task's time limit before its in-flight slot counts as leaked.
+SLOT_GRACE_SECONDS = 60
+# kombu's Redis transport stores priority levels 3/6/9 in suffixed lists.
+BROKER_PRIORITY_SUFFIXES = ("", "\x06\x163", "\x06\x166", "\x06\x169")
+
+_broker = redis.from_url(settings.CELERY_BROKER_URL) if settings.CELERY_BROKER_URL.startswith("redis") else None
+
+
+def tenant_id(identity: str) -> str:
+    """Stable, non-reversible tenant key for an API key or client address."""
+    return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+
+def resolve_queue(priority: Optional[str], default: str) -> str:
+    if not priority:
+        return default
+    if priority not in QUEUES:
+        raise ValueError(f"Unknown priority '{priority}'; expected one of {', '.join(QUEUES)}")
+    return priority
+
+
+def _dispatch(task_name: str, kwargs: dict, job_id: str, queue: str):
+    celery_app.send_task(task_name, kwargs=kwargs, task_id=job_id, queue=queue)
+
+
+def _dispatch_released(task_name: str, kwargs: dict, job_id: str, queue: str):
+    """Send a held job as a root task of its own.
+
+    Jobs are released from the task_postrun of the job that freed the slot,
+    and send_task would record that task as the released job's parent (its
+    parent_id even overrides an explicit None). Celery's current-task stack is
+    thread-local, so sending from a short-lived thread leaves it out.
+    """
+    errors = []
+
+    def send():
+        try:
+            _dispatch(task_name, kwargs, job_id, queue)
+        except Exception as e:
+            errors.append(e)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    sender.join()
+    if errors:
+        raise errors[0]
+
+
+def _slot_lifetime(task_name: str) -> float:
+    """How long a job's slot may be held: its task's time limit plus SLOT_GRACE_SECONDS."""
+    task = celery_app.tasks.get(task_name)
+    limit = getattr(task, "time_limit", None) or celery_app.conf.task_time_limit or settings.REPO_TIME_LIMIT
+    return limit + SLOT_GRACE_SECONDS
+
+
+def _claim_slot(queue: str, tenant: str, job_id: str, task_name: str) -> bool:
+    """Count a job against the tenant's in-flight limit for a queue, if there is room.
+
+    Entries are scored by the time the slot expires, so a worker that died or
+    a lost completion signal cannot hold a slot past the task's time limit.
+    """
+    key = INFLIGHT_KEY.format(queue=queue, tenant=tenant)
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.zremrangebyscore(key, "-inf", now)
+    pipe.zadd(key, {job_id: now + _slot_lifetime(task_name)})
+    pipe.zcard(key)
+    pipe.expire(key, JOB_TTL)
+    inflight = pipe.execute()[2]
+    if inflight <= settings.TENANT_MAX_INFLIGHT:
+        return True
+    redis_client.zrem(key, job_id)
+    return False
+
+
+def submit_job(task_name: str, kwargs: dict, job_id: str, queue: str, tenant: str):
+    """Send a job to its priority queue, or hold it until the tenant has a free slot.
+
+    Each tenant may have TENANT_MAX_INFLIGHT jobs queued or running per queue;
+    held jobs are released round-robin across tenants as jobs finish, so one
+    tenant's burst cannot take every worker in a queue.
+    """
+    if not settings.FAIR_SCHEDULING_ENABLED:
+        _dispatch(task_name, kwargs, job_id, queue)
+        return
+    try:
+        sweep_stale_slots(queue)
+        redis_client.hset(JOB_KEY.format(job_id=job_id), mapping={
+            "queue": queue, "tenant": tenant, "submitted_at": time.time(), "task": task_name,
+        })
+        redis_client.expire(JOB_KEY.format(job_id=job_id), JOB_TTL)
+        if _claim_slot(queue, tenant, job_id, task_name):
+            _dispatch(task_name, kwargs, job_id, queue)
+            return
+
+        spec = json.dumps({"task": task_name, "kwargs": kwargs, "job_id": job_id})
+        redis_client.rpush(PENDING_KEY.format(queue=queue, tenant=tenant), spec)
+        if redis_client.sadd(RING_MEMBERS_KEY.format(queue=queue), tenant):
+            redis_client.rpush(RING_KEY.format(queue=queue), tenant)
+    except redis.RedisError:
+        _dispatch(task_name, kwargs, job_id, queue)
+
+
+def _fill(queue: str):
+    """Dispatch held jobs round-robin across tenants while they have free slots."""
+    ring = RING_KEY.format(queue=queue)
+    idle = 0
+    while idle < redis_client.llen(ring):
+        tenant = redis_client.rpoplpush(ring, ring)
+        if tenant is None:
+            return
+        tenant = tenant.decode()
+        pending = PENDING_KEY.format(queue=queue, tenant=tenant)
+        raw = redis_client.lpop(pending)
+        if raw is None:
+            redis_client.lrem(ring, 0, tenant)
+            redis_client.srem(RING_MEMBERS_KEY.format(queue=queue), tenant)
+            continue
+        spec = json.loads(raw)
+        if is_cancelled(spec["job_id"]):
+            continue
+        if not _claim_slot(queue, tenant, spec["job_id"], spec["task"]):
+            redis_client.lpush(pending, raw)
+            idle += 1
+            continue
+        idle = 0
+        _dispatch_released(spec["task"], spec["kwargs"], spec["job_id"], queue)
+
+
+def release_job(job_id: str):
+    """Free a finished job's slot and let held jobs through."""
+    if not settings.FAIR_SCHEDULING_ENABLED:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hgetall(JOB_KEY.format(job_id=job_id))
+        pipe.delete(JOB_KEY.format(job_id=job_id))
+        meta = pipe.execute()[0]
+        if not meta:
+            return
+        queue, tenant = meta[b"queue"].decode(), meta[b"tenant"].decode()
+        redis_client.zrem(INFLIGHT_KEY.format(queue=queue, tenant=tenant), job_id)
+        _fill(queue)
+    except redis.RedisError:
+        pass
+
+
+def sweep_stale_slots(queue: Optional[str] = None):
+    """Free slots held past their task's time limit and let the affected tenants' held jobs through.
+
+    Runs on every submission and periodically from the API, so a tenant whose
+    worker died is not left waiting for one of its own jobs to finish.
+    """
+    if not settings.FAIR_SCHEDULING_ENABLED:
+        return
+    try:
+        for name in (queue,) if queue else QUEUES:
+            tenants = redis_client.smembers(RING_MEMBERS_KEY.format(queue=name))
+            if not tenants:
+                continue
+            now = time.time()
+            pipe = redis_client.pipeline()
+            for tenant in tenants:
+                pipe.zremrangebyscore(INFLIGHT_KEY.format(queue=name, tenant=tenant.decode()), "-inf", now)
+            if any(pipe.execute()):
+                _fill(name)
+    except redis.RedisError:
+        pass
+
+
+def record_job_started(job_id: str):
+    """Record how long a job waited between submission and a worker picking it up.
+
+    The job's slot is renewed from its start, so time spent queued does not
+    count toward the time limit it may hold the slot for.
+    """
+    try:
+        submitted_at, queue, tenant, task_name = redis_client.hmget(
+            JOB_KEY.format(job_id=job_id), "submitted_at", "queue", "tenant", "task")
+        if submitted_at is None or queue is None:
+            return
+        now = time.time()
+        key = WAIT_KEY.format(queue=queue.decode())
+        pipe = redis_client.pipeline()
+        pipe.lpush(key, round((now - float(submitted_at)) * 1000))
+        pipe.ltrim(key, 0, WAIT_WINDOW - 1)
+        if tenant is not None and task_name is not None:
+            pipe.zadd(INFLIGHT_KEY.format(queue=queue.decode(), tenant=tenant.decode()),
+                      {job_id: now + _slot_lifetime(task_name.decode())}, xx=True)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def _percentile(samples: list, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def queue_stats() -> dict:
+    """Per-queue broker depth, held jobs by tenant count, and recent wait times."""
+    stats = {}
+    for queue in QUEUES:
+        depth = None
+        if _broker is not None:
+            pipe = _broker.pipeline()
+            for suffix in BROKER_PRIORITY_SUFFIXES:
+                pipe.llen(queue + suffix)
+            depth = sum(pipe.execute())
+
+        tenants = [t.decode() for t in redis_client.smembers(RING_MEMBERS_KEY.format(queue=queue))]
+        held = sum(redis_client.llen(PENDING_KEY.format(queue=queue, tenant=t)) for t in tenants)
+        waits = [float(w) for w in redis_client.lrange(WAIT_KEY.format(queue=queue), 0, -1)]
+        stats[queue] = {
+            "depth": depth,
+            "held": held,
+            "tenantsWaiting": len(tenants),
+            "waitMs": {
+                "samples": len(waits),
+                "p50": _percentile(waits, 0.50),
+                "p95": _percentile(waits, 0.95),
+            },
+        }
+    return stats
@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional
+
+from config import settings
+
+
+def _string(nullable: bool = False) -> dict:
+    return {"type": ["string", "null"]} if nullable else {"type": "string"}
+
+
+def _enum(*values: str) -> dict:
+    return {"type": "string", "enum": list(values)}
+
+
+def _integer() -> dict:
+    return {"type": "integer"}
+
+
+def _array(items: dict) -> dict:
+    return {"type": "array", "items": items}
+
+
+def _object(**properties: dict) -> dict:
+    """A strict-mode object: every property required, no others allowed."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+_STRINGS = _array(_string())
+
+# Response schemas for the tools in ai_service.PROMPTS; keep them in step with
+# the JSON examples in the prompts.
+SCHEMAS: Dict[str, dict] = {
+    "debug": _object(
+        summary=_string(),
+        severity=_enum("low", "medium", "high", "critical"),
+        issues=_array(_object(
+            category=_enum("syntax", "logic", "runtime", "edge", "type"),
+            line=_integer(),
+            issue=_string(),
+            suggestion=_string(),
+        )),
+        fixedCode=_string(nullable=True),
+    ),
+    "refactor": _object(
+        summary=_string(),
+        refactoredCode=_string(),
+        keyChanges=_STRINGS,
+        principlesApplied=_array(_object(principle=_string(), why=_string())),
+        beforeAfter=_array(_object(title=_string(), before=_string(), after=_string())),
+    ),
+    "optimize": _object(
+        summary=_string(),
+        optimizedCode=_string(),
+        complexity=_object(
+            original=_object(time=_string(), space=_string()),
+            optimized=_object(time=_string(), space=_string()),
+        ),
+        keyChanges=_STRINGS,
+        tradeoffs=_STRINGS,
+        benchmarkSuggestions=_STRINGS,
+    ),
+    "test": _object(
+        summary=_string(),
+        testCode=_string(),
+        testCases=_array(_object(
+            name=_string(),
+            type=_enum("unit", "integration", "e2e", "edge"),
+            inputs=_string(),
+            expected=_string(),
+        )),
+        edgeCases=_STRINGS,
+        coverageAnalysis=_object(untested=_STRINGS, recommendations=_STRINGS),
+        executionPlan=_object(frameworks=_STRINGS, commands=_STRINGS, notes=_STRINGS),
+        bugDetection=_array(_object(test=_string(), likelyCause=_string(), location=_string())),
+        testingSuggestions=_STRINGS,
+        mocks=_STRINGS,
+        fixtures=_STRINGS,
+    ),
+    "pr": _object(
+        title=_string(),
+        summary=_string(),
+        changes=_STRINGS,
+        testing=_STRINGS,
+        fullMarkdown=_string(),
+    ),
+    "assistant": _object(reply=_string(), items=_STRINGS),
+    "chat-summary": _object(summary=_string()),
+    "generate": _object(summary=_string(), language=_string(), generatedCode=_string()),
+}
+
+
+def fused_schema(tools: List[str]) -> dict:
+    """Schema for a fused reply: one section per tool."""
+    return _object(**{tool: SCHEMAS[tool] for tool in tools})
+
+
+def subset_schema(schema: dict, keys: List[str]) -> dict:
+    """A schema asking for only some of an object's properties (for repairs)."""
+    return _object(**{key: schema["properties"][key] for key in keys})
+
+
+def supports_json_schema(model: str) -> bool:
+    models = [m.strip() for m in settings.STRUCTURED_OUTPUT_MODELS.split(",") if m.strip()]
+    return any(model == m or model.startswith(m + "-") for m in models)
+
+
+def response_format(schema: Optional[dict], model: str, name: str, system_prompt: str) -> Optional[dict]:
+    """The response_format for a call: a strict JSON schema where the model supports one, else JSON mode."""
+    if not settings.STRUCTURED_OUTPUT_ENABLED:
+        return None
+    if schema is not None and supports_json_schema(model):
+        return {"type": "json_schema", "json_schema": {"name": name or "response", "schema": schema, "strict": True}}
+    # JSON mode requires the word "JSON" somewhere in the messages.
+    if "JSON" in system_prompt:
+        return {"type": "json_object"}
+    return None
+
+
+def _valid(value, schema: dict) -> bool:
+    """Loose structural check; enums are left to constrained decoding."""
+    types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+    if value is None:
+        return "null" in types
+    if "string" in types:
+        return isinstance(value, str)
+    if "integer" in types:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if "array" in types:
+        return isinstance(value, list) and all(_valid(item, schema["items"]) for item in value)
+    if "object" in types:
+        return isinstance(value, dict) and all(
+            key in value and _valid(value[key], sub) for key, sub in schema["properties"].items()
+        )
+    return True
+
+
+def invalid_fields(result, schema: dict) -> List[str]:
+    """Top-level properties that are missing or do not match the schema."""
+    if not isinstance(result, dict):
+        return list(schema["properties"])
+    return [key for key, sub in schema["properties"].items() if key not in result or not _valid(result[key], sub)]
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import threading
+import time
+from uuid import uuid4
+from typing import Awaitable, Callable, Optional
+
+import redis
+
+from cache import redis_client, async_redis_client
+from cancellation import JobCancelledError
+from config import settings
+from rate_limit import CircuitOpenError, RateLimitedError, UpstreamUnavailableError
+from token_budget import PromptTooLargeError
+
+LOCK_PREFIX = "singleflight:lock:"
+RESULT_PREFIX = "singleflight:result:"
+CHANNEL_PREFIX = "singleflight:done:"
+JOB_PREFIX = "singleflight:job:"
+
+# How long followers can still pick up a finished leader's result.
+RESULT_GRACE_SECONDS = 30
+
+# The lock holds the leader's token. Renewal and release only touch a lock the
+# caller still owns, so a leader that stalled past its TTL can't extend or
+# delete the lock of whoever took over.
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_renew = redis_client.register_script(RENEW_SCRIPT)
+_renew_async = async_redis_client.register_script(RENEW_SCRIPT)
+_release_lock = redis_client.register_script(RELEASE_SCRIPT)
+_release_lock_async = async_redis_client.register_script(RELEASE_SCRIPT)
+
+
+def claim_job(key: str, job_id: str, is_active: Callable[[str], bool]) -> Optional[str]:
+    """Register job_id as the in-flight job for key.
+
+    Returns the id of an identical job that is still running, in which case the
+    caller should hand that id out instead of enqueueing a new task.
+    """
+    job_key = JOB_PREFIX + key
+    try:
+        if redis_client.set(job_key, job_id, nx=True, ex=settings.SINGLEFLIGHT_TTL):
+            return None
+        existing = redis_client.get(job_key)
+        if existing and is_active(existing.decode()):
+            return existing.decode()
+        redis_client.set(job_key, job_id, ex=settings.SINGLEFLIGHT_TTL)
+    except redis.RedisError:
+        pass
+    return None
+
+
+class CoalescedCallError(Exception):
+    """The leader computing a coalesced result failed; raised in every follower waiting on it.
+
+    Quota, availability and prompt-size errors reach followers as their own types instead.
+    """
+
+
+def _payload(result: dict = None, error: Exception = None) -> str:
+    if error is None:
+        return json.dumps({"result": result})
+    return json.dumps({"error": {
+        "type": type(error).__name__,
+        "message": str(error),
+        "retry_after": getattr(error, "retry_after", None),
+        "queue_position": getattr(error, "queue_position", 0),
+        "input_tokens": getattr(error, "input_tokens", None),
+        "limit": getattr(error, "limit", None),
+    }})
+
+
+def _rebuild_error(error: dict) -> Exception:
+    """The leader's exception as followers should see it: typed errors keep their status and Retry-After."""
+    kind = error["type"]
+    if kind == "RateLimitedError":
+        return RateLimitedError(error["retry_after"], error["queue_position"], error["message"])
+    if kind == "CircuitOpenError":
+        return CircuitOpenError(error["retry_after"])
+    if kind == "UpstreamUnavailableError":
+        return UpstreamUnavailableError(error["message"], error["retry_after"])
+    if kind == "PromptTooLargeError":
+        return PromptTooLargeError(error["input_tokens"], error["limit"])
+    return CoalescedCallError(error["message"])
+
+
+def _unwrap(raw) -> dict:
+    payload = json.loads(raw)
+    if "error" in payload:
+        raise _rebuild_error(payload["error"])
+    return payload["result"]
+
+
+def _heartbeat_interval() -> float:
+    return max(settings.SINGLEFLIGHT_LOCK_TTL / 3, 0.1)
+
+
+def run_coalesced(key: str, compute: Callable[[], dict]) -> dict:
+    """Run compute once across all processes for identical in-flight keys.
+
+    The leader holds a short lock that a heartbeat keeps renewing while it
+    computes, so a crashed leader is noticed within SINGLEFLIGHT_LOCK_TTL.
+    Followers wait up to SINGLEFLIGHT_TTL and take over if the lock goes away
+    without a result.
+    """
+    if not settings.SINGLEFLIGHT_ENABLED:
+        return compute()
+    deadline = time.monotonic() + settings.SINGLEFLIGHT_TTL
+    while True:
+        token = uuid4().hex
+        try:
+            is_leader = redis_client.set(LOCK_PREFIX + key, token, nx=True, ex=settings.SINGLEFLIGHT_LOCK_TTL)
+        except redis.RedisError:
+            return compute()
+        if is_leader:
+            return _lead(key, token, compute)
+        raw = _follow(key, deadline)
+        if raw is not None:
+            return _unwrap(raw)
+        if time.monotonic() >= deadline:
+            return compute()
+
+
+def _lead(key: str, token: str, compute: Callable[[], dict]) -> dict:
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(key, token, stop), daemon=True)
+    heartbeat.start()
+    try:
+        result = compute()
+    except JobCancelledError:
+        # Only this caller's job was cancelled; followers from other jobs take over.
+        _release(key, token)
+        raise
+    except Exception as e:
+        _publish(key, token, _payload(error=e))
+        raise
+    finally:
+        stop.set()
+        heartbeat.join()
+    _publish(key, token, _payload(result=result))
+    return result
+
+
+def _heartbeat(key: str, token: str, stop: threading.Event):
+    while not stop.wait(_heartbeat_interval()):
+        try:
+            if not _renew(keys=[LOCK_PREFIX + key], args=[token, settings.SINGLEFLIGHT_LOCK_TTL]):
+                return
+        except redis.RedisError:
+            pass
+
+
+def _release(key: str, token: str):
+    try:
+        _release_lock(keys=[LOCK_PREFIX + key], args=[token])
+    except redis.RedisError:
+        pass
+
+
+def _publish(key: str, token: str, payload: str):
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(RESULT_PREFIX + key, payload, ex=RESULT_GRACE_SECONDS)
+        pipe.publish(CHANNEL_PREFIX + key, payload)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    _release(key, token)
+
+
+def _follow(key: str, deadline: float):
+    """Wait for the leader's result.
+
+    None means no result is coming: the lock disappeared without one (the
+    caller should try to take over) or the deadline passed.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe before checking the result key so a publish can't slip between.
+        pubsub.subscribe(CHANNEL_PREFIX + key)
+        raw = redis_client.get(RESULT_PREFIX + key)
+        if raw is not None:
+            return raw
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=min(1.0, _heartbeat_interval()))
+            if message is not None:
+                return message["data"]
+            if not redis_client.exists(LOCK_PREFIX + key):
+                # Leader finished without us seeing the message, was cancelled or died.
+                return redis_client.get(RESULT_PREFIX + key)
+        return None
+    except redis.RedisError:
+        return None
+    finally:
+        pubsub.close()
+
+
+async def run_coalesced_async(key: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+    """Async variant of run_coalesced for the API event loop."""
+    if not settings.SINGLEFLIGHT_ENABLED:
+        return await compute()
+    deadline = time.monotonic() + settings.SINGLEFLIGHT_TTL
+    while True:
+        token = uuid4().hex
+        try:
+            is_leader = await async_redis_client.set(LOCK_PREFIX + key, token, nx=True,
+                                                     ex=settings.SINGLEFLIGHT_LOCK_TTL)
+        except redis.RedisError:
+            return await compute()
+        if is_leader:
+            return await _lead_async(key, token, compute)
+        raw = await _follow_async(key, deadline)
+        if raw is not None:
+            return _unwrap(raw)
+        if time.monotonic() >= deadline:
+            return await compute()
+
+
+async def _lead_async(key: str, token: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+    heartbeat = asyncio.create_task(_heartbeat_async(key, token))
+    try:
+        result = await compute()
+    except (JobCancelledError, asyncio.CancelledError):
+        await _release_async(key, token)
+        raise
+    except Exception as e:
+        await _publish_async(key, token, _payload(error=e))
+        raise
+    finally:
+        heartbeat.cancel()
+    await _publish_async(key, token, _payload(result=result))
+    return result
+
+
+async def _heartbeat_async(key: str, token: str):
+    while True:
+        await asyncio.sleep(_heartbeat_interval())
+        try:
+            if not await _renew_async(keys=[LOCK_PREFIX + key], args=[token, settings.SINGLEFLIGHT_LOCK_TTL]):
+                return
+        except redis.RedisError:
+            pass
+
+
+async def _release_async(key: str, token: str):
+    try:
+        await _release_lock_async(keys=[LOCK_PREFIX + key], args=[token])
+    except redis.RedisError:
+        pass
+
+
+async def _publish_async(key: str, token: str, payload: str):
+    try:
+        pipe = async_redis_client.pipeline()
+        pipe.set(RESULT_PREFIX + key, payload, ex=RESULT_GRACE_SECONDS)
+        pipe.publish(CHANNEL_PREFIX + key, payload)
+        await pipe.execute()
+    except redis.RedisError:
+        pass
+    await _release_async(key, token)
+
+
+async def _follow_async(key: str, deadline: float):
+    pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(CHANNEL_PREFIX + key)
+        raw = await async_redis_client.get(RESULT_PREFIX + key)
+        if raw is not None:
+            return raw
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(timeout=min(1.0, _heartbeat_interval()))
+            if message is not None:
+                return message["data"]
+            if not await async_redis_client.exists(LOCK_PREFIX + key):
+                return await async_redis_client.get(RESULT_PREFIX + key)
+        return None
+    except redis.RedisError:
+        return None
+    finally:
+        await pubsub.aclose()
@@ -0,0 +1,141 @@
+import json
+from typing import List, Optional, Tuple
+
+WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """Incrementally scan a streamed JSON object and report completed fields.
+
+    Text before the first ``{`` (such as a code fence) is ignored. ``feed``
+    returns events as soon as they close:
+
+    - ``("item", key, index, value)`` for each element of a top-level array
+    - ``("field", key, value)`` for each top-level key once its value is complete
+
+    Scanning resumes where the previous call stopped, so each character is
+    inspected once. The authoritative final object still comes from
+    ``_parse_ai_json`` over the full text.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.stack: List[str] = []
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.expect = "key"
+        self.key: Optional[str] = None
+        self.key_start = 0
+        self.value_start: Optional[int] = None
+        self.item_start: Optional[int] = None
+        self.item_index = 0
+
+    def feed(self, text: str) -> List[Tuple]:
+        self.buffer += text
+        events: List[Tuple] = []
+        buf = self.buffer
+        for i in range(self.pos, len(buf)):
+            if self.finished:
+                break
+            self._step(buf, i, buf[i], events)
+        self.pos = len(buf)
+        return events
+
+    def _in_top_array(self) -> bool:
+        return len(self.stack) == 2 and self.stack[-1] == "["
+
+    def _loads(self, raw: str):
+        try:
+            return True, json.loads(raw)
+        except json.JSONDecodeError:
+            return False, None
+
+    def _emit_field(self, buf: str, end: int, events: List[Tuple]):
+        ok, value = self._loads(buf[self.value_start:end].strip())
+        if ok and self.key is not None:
+            events.append(("field", self.key, value))
+        self.value_start = None
+        self.expect = "after_value"
+
+    def _emit_item(self, buf: str, end: int, events: List[Tuple]):
+        if self.item_start is None:
+            return
+        ok, value = self._loads(buf[self.item_start:end].strip())
+        if ok:
+            events.append(("item", self.key, self.item_index, value))
+            self.item_index += 1
+        self.item_start = None
+
+    def _step(self, buf: str, i: int, ch: str, events: List[Tuple]):
+        depth = len(self.stack)
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if depth == 1 and self.expect == "in_key":
+                    ok, key = self._loads(buf[self.key_start:i + 1])
+                    self.key = key if ok else None
+                    self.expect = "colon"
+                elif depth == 1 and self.expect == "in_value":
+                    self._emit_field(buf, i + 1, events)
+            return
+
+        if not self.started:
+            if ch == "{":
+                self.started = True
+                self.stack.append(ch)
+            return
+
+        if ch in WHITESPACE:
+            return
+
+        if depth == 1 and self.expect == "value":
+            self.value_start = i
+            self.expect = "in_value"
+            self.item_index = 0
+        elif self._in_top_array() and self.item_start is None and ch not in ",]":
+            self.item_start = i
+
+        if ch == '"':
+            self.in_string = True
+            if depth == 1 and self.expect == "key":
+                self.key_start = i
+                self.expect = "in_key"
+        elif ch in "{[":
+            self.stack.append(ch)
+        elif ch in "}]":
+            if self._in_top_array() and ch == "]":
+                self._emit_item(buf, i, events)
+            if depth == 1 and self.expect == "in_value":
+                # Scalar value closed by the end of the object.
+                self._emit_field(buf, i, events)
+            self.stack.pop()
+            if len(self.stack) == 1 and self.expect == "in_value":
+                self._emit_field(buf, i + 1, events)
+            elif not self.stack:
+                self.finished = True
+        elif ch == ":" and depth == 1 and self.expect == "colon":
+            self.expect = "value"
+        elif ch == ",":
+            if depth == 1:
+                if self.expect == "in_value":
+                    self._emit_field(buf, i, events)
+                self.expect = "key"
+            elif self._in_top_array():
+                self._emit_item(buf, i, events)
+
+
+def complete_fields(text: str) -> dict:
+    """Top-level fields that closed cleanly in possibly truncated or malformed JSON text."""
+    fields = {}
+    for event in IncrementalJSONParser().feed(text):
+        if event[0] == "field":
+            fields[event[1]] = event[2]
+    return fields
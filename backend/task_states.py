@@ -0,0 +1,38 @@
+from typing import Any, Dict, Iterable, Tuple
+
+from celery.result import AsyncResult
+
+from celery_app import celery_app
+
+TaskState = Tuple[str, Any]
+
+
+def task_state(task_id: str) -> TaskState:
+    """(state, result) of one task, as AsyncResult reports them."""
+    task = AsyncResult(task_id, app=celery_app)
+    return task.state, task.result
+
+
+def fetch_task_states(task_ids: Iterable[str]) -> Dict[str, TaskState]:
+    """(state, result) for many tasks with a single MGET on the result backend.
+
+    Tasks with no stored result are PENDING, as with AsyncResult. Backends
+    without MGET fall back to one lookup per task.
+    """
+    task_ids = list(dict.fromkeys(task_id for task_id in task_ids if task_id))
+    if not task_ids:
+        return {}
+    backend = celery_app.backend
+    try:
+        values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    except NotImplementedError:
+        return {task_id: task_state(task_id) for task_id in task_ids}
+
+    states = {}
+    for task_id, value in zip(task_ids, values):
+        if value is None:
+            states[task_id] = ("PENDING", None)
+            continue
+        meta = backend.decode_result(value)
+        states[task_id] = (meta["status"], meta["result"])
+    return states
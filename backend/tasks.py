@@ -1,21 +1,52 @@
+from celery import chord
+from celery.signals import (
+    before_task_publish, task_failure, task_prerun, task_postrun, task_revoked, worker_init, worker_process_shutdown
+)
 from celery_app import celery_app
-from ai_service import analyze_with_ai_sync, PROMPTS
-import httpx
+from config import settings
+from ai_service import analyze_with_ai_sync, build_system_prompt, PROMPTS
+from chunking import should_chunk, analyze_chunked_sync
+from fused import analyze_fused_sync
+from events import publish_job_event, token_publisher
+from pr_diff import build_pr_prompt
+from preanalysis import pre_analyze, is_blocking, blocking_result, with_hints, merge_issues
+from repo_pipeline import archive_url, download_archive, run_file_pipeline, run_repo_pipeline, set_job_meta
+from github_fetch import fetch_source
+from scheduling import record_job_started, release_job, BATCH_QUEUE
+from cancellation import JobCancelledError, cancel_watcher, raise_if_cancelled
+from metrics import start_worker_exporter, mark_process_dead, TASK_WAIT_SECONDS
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
 
 
 def fetch_github_code(url: str) -> str:
     """Fetch code from a GitHub URL."""
-    raw_url = url
-    if "github.com" in url and "raw.githubusercontent.com" not in url:
-        raw_url = url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+    return fetch_source(url)
 
-    response = httpx.get(raw_url, timeout=30)
-    response.raise_for_status()
-    return response.text
+
+def _job_id(task, job_id: str = "") -> str:
+    """Job id that events for this task belong to: the parent job for fan-out subtasks, else the task itself."""
+    return job_id or task.request.id
+
+
+def _parent_job(task) -> Optional[str]:
+    """The analyze_all job a tool task was fanned out from, or None for a job of its own.
+
+    Fan-out subtasks carry their job explicitly; Celery's parent_id cannot be
+    used, as it is also set on any task sent from inside another (such as a
+    held job released when the previous one finishes).
+    """
+    if task.name not in TASK_TOOLS:
+        return None
+    return (task.request.kwargs or {}).get("job_id") or None
 
 
 @celery_app.task(bind=True, name="tasks.debug_code")
-def debug_code(self, code: str, language: str = "", github_url: str = ""):
+def debug_code(self, code: str, language: str = "", github_url: str = "", no_cache: bool = False,
+               chunked: bool = None, model: str = None, latency_target_ms: int = None, job_id: str = ""):
     """Debug code task."""
     try:
         source_code = code
@@ -25,16 +56,32 @@ def debug_code(self, code: str, language: str = "", github_url: str = ""):
         if not source_code:
             return {"error": "No code provided"}
 
-        user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = analyze_with_ai_sync(PROMPTS["debug"], user_prompt)
+        static_issues = pre_analyze(source_code, language)
+        if is_blocking(static_issues):
+            return {"success": True, "data": blocking_result(static_issues), "tool": "debugger"}
+
+        if should_chunk("debug", source_code, chunked):
+            result = analyze_chunked_sync("debug", PROMPTS["debug"], source_code, language, use_cache=not no_cache,
+                                          model=model, latency_target_ms=latency_target_ms,
+                                          on_delta=cancel_watcher(_job_id(self, job_id)))
+        else:
+            user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
+            user_prompt = with_hints(user_prompt, static_issues)
+            result = analyze_with_ai_sync(PROMPTS["debug"], user_prompt, tool="debug", use_cache=not no_cache,
+                                          on_delta=token_publisher(_job_id(self, job_id), "debug"),
+                                          model=model, latency_target_ms=latency_target_ms)
+        result = merge_issues(result, static_issues)
 
         return {"success": True, "data": result, "tool": "debugger"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "debugger"}
     except Exception as e:
         return {"success": False, "error": str(e), "tool": "debugger"}
 
 
 @celery_app.task(bind=True, name="tasks.refactor_code")
-def refactor_code(self, code: str, language: str = "", github_url: str = "", principles: list = None):
+def refactor_code(self, code: str, language: str = "", github_url: str = "", principles: list = None,
+                  no_cache: bool = False, model: str = None, latency_target_ms: int = None, job_id: str = ""):
     """Refactor code task."""
     try:
         source_code = code
@@ -44,22 +91,24 @@ def refactor_code(self, code: str, language: str = "", github_url: str = "", pri
         if not source_code:
             return {"error": "No code provided"}
 
-        selected_principles = principles or ["SOLID", "DRY", "KISS", "Clean Code"]
-        system_prompt = PROMPTS["refactor"].replace(
-            "SOLID, DRY, KISS, Clean Code",
-            ", ".join(selected_principles)
-        )
+        system_prompt = build_system_prompt("refactor", principles=principles)
 
         user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = analyze_with_ai_sync(system_prompt, user_prompt)
+        result = analyze_with_ai_sync(system_prompt, user_prompt, tool="refactor", use_cache=not no_cache,
+                                      on_delta=token_publisher(_job_id(self, job_id), "refactor"),
+                                      model=model, latency_target_ms=latency_target_ms)
 
         return {"success": True, "data": result, "tool": "refactorizer"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "refactorizer"}
     except Exception as e:
         return {"success": False, "error": str(e), "tool": "refactorizer"}
 
 
 @celery_app.task(bind=True, name="tasks.optimize_code")
-def optimize_code(self, code: str, language: str = "", github_url: str = "", focus_areas: list = None):
+def optimize_code(self, code: str, language: str = "", github_url: str = "", focus_areas: list = None,
+                  no_cache: bool = False, chunked: bool = None, model: str = None,
+                  latency_target_ms: int = None, job_id: str = ""):
     """Optimize code task."""
     try:
         source_code = code
@@ -69,22 +118,29 @@ def optimize_code(self, code: str, language: str = "", github_url: str = "", foc
         if not source_code:
             return {"error": "No code provided"}
 
-        areas = focus_areas or ["time complexity", "space complexity", "memory usage", "execution speed"]
-        system_prompt = PROMPTS["optimize"].replace(
-            "time complexity, space complexity, memory usage, execution speed",
-            ", ".join(areas)
-        )
+        system_prompt = build_system_prompt("optimize", focus_areas=focus_areas)
 
-        user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = analyze_with_ai_sync(system_prompt, user_prompt)
+        if should_chunk("optimize", source_code, chunked):
+            result = analyze_chunked_sync("optimize", system_prompt, source_code, language, use_cache=not no_cache,
+                                          model=model, latency_target_ms=latency_target_ms,
+                                          on_delta=cancel_watcher(_job_id(self, job_id)))
+        else:
+            user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
+            result = analyze_with_ai_sync(system_prompt, user_prompt, tool="optimize", use_cache=not no_cache,
+                                          on_delta=token_publisher(_job_id(self, job_id), "optimize"),
+                                          model=model, latency_target_ms=latency_target_ms)
 
         return {"success": True, "data": result, "tool": "optimizer"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "optimizer"}
     except Exception as e:
         return {"success": False, "error": str(e), "tool": "optimizer"}
 
 
 @celery_app.task(bind=True, name="tasks.test_code")
-def test_code(self, code: str, language: str = "", github_url: str = "", test_framework: str = ""):
+def test_code(self, code: str, language: str = "", github_url: str = "", test_framework: str = "",
+              no_cache: bool = False, chunked: bool = None, model: str = None,
+              latency_target_ms: int = None, job_id: str = ""):
     """Generate tests task."""
     try:
         source_code = code
@@ -94,48 +150,196 @@ def test_code(self, code: str, language: str = "", github_url: str = "", test_fr
         if not source_code:
             return {"error": "No code provided"}
 
-        framework = test_framework or "auto-detect"
-        system_prompt = PROMPTS["test"].replace(
-            "Generate comprehensive test cases",
-            f"Generate comprehensive test cases using {framework} framework"
-        )
+        system_prompt = build_system_prompt("test", test_framework=test_framework)
 
-        user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
-        result = analyze_with_ai_sync(system_prompt, user_prompt)
+        if should_chunk("test", source_code, chunked):
+            result = analyze_chunked_sync("test", system_prompt, source_code, language, use_cache=not no_cache,
+                                          model=model, latency_target_ms=latency_target_ms,
+                                          on_delta=cancel_watcher(_job_id(self, job_id)))
+        else:
+            user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
+            result = analyze_with_ai_sync(system_prompt, user_prompt, tool="test", use_cache=not no_cache,
+                                          on_delta=token_publisher(_job_id(self, job_id), "test"),
+                                          model=model, latency_target_ms=latency_target_ms)
 
         return {"success": True, "data": result, "tool": "tester"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "tester"}
     except Exception as e:
         return {"success": False, "error": str(e), "tool": "tester"}
 
 
 @celery_app.task(bind=True, name="tasks.generate_pr")
-def generate_pr(self, original_code: str, modified_code: str, changes: str = "", language: str = "", title: str = ""):
-    """Generate PR description task."""
+def generate_pr(self, original_code: str = "", modified_code: str = "", changes: str = "", language: str = "",
+                title: str = "", no_cache: bool = False, filename: str = "", context_lines: int = 3,
+                files: list = None):
+    """Generate PR description task.
+
+    Sends a unified diff and file outline rather than both full files; pass
+    ``files`` (dicts with filename/original_code/modified_code) for one
+    description covering several files.
+    """
     try:
-        if not original_code and not modified_code:
-            return {"error": "Original and modified code required"}
-
-        user_prompt = f"""
-Language: {language or 'auto-detect'}
-Suggested Title: {title or 'Auto-generated PR'}
-Changes Summary: {changes or 'See code diff'}
-
-Original Code:
-{original_code}
+        if files is None:
+            if not original_code and not modified_code:
+                return {"error": "Original and modified code required"}
+            files = [{"filename": filename, "original_code": original_code, "modified_code": modified_code}]
+        elif not files:
+            return {"error": "At least one file is required"}
 
-Modified Code:
-{modified_code}
-"""
-        result = analyze_with_ai_sync(PROMPTS["pr"], user_prompt)
+        user_prompt = build_pr_prompt(files, language, title, changes, context_lines)
+        result = analyze_with_ai_sync(PROMPTS["pr"], user_prompt, tool="pr", use_cache=not no_cache,
+                                      on_delta=token_publisher(_job_id(self), "pr"))
 
         return {"success": True, "data": result, "tool": "pr-generator"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "pr-generator"}
     except Exception as e:
         return {"success": False, "error": str(e), "tool": "pr-generator"}
 
 
+TOOL_TASKS = {
+    "debug": debug_code,
+    "refactor": refactor_code,
+    "optimize": optimize_code,
+    "test": test_code,
+}
+
+
+TOOL_NAMES = {
+    "debug": "debugger",
+    "refactor": "refactorizer",
+    "optimize": "optimizer",
+    "test": "tester",
+}
+
+
+def _run_metrics(mode: str, started_at: float, data: dict, input_tokens: int = None) -> dict:
+    """Input-token and wall-clock cost of a multi-analysis run, for comparing modes."""
+    if input_tokens is None:
+        input_tokens = sum(
+            ((result.get("data") or {}).get("tokenUsage") or {}).get("inputTokens", 0)
+            for result in data.values() if isinstance(result, dict) and isinstance(result.get("data"), dict)
+        )
+    return {"mode": mode, "inputTokens": input_tokens, "wallTimeMs": round((time.time() - started_at) * 1000)}
+
+
+@celery_app.task(name="tasks.merge_analysis_results")
+def merge_analysis_results(results: list, tools: list, job_id: str = "", started_at: float = None):
+    """Chord callback: merge per-tool subtask results into one multi-analysis result."""
+    data = dict(zip(tools, results))
+    merged = {"success": True, "data": data, "tool": "multi-analysis"}
+    if started_at:
+        merged["metrics"] = _run_metrics("fanout", started_at, data)
+    return merged
+
+
+@celery_app.task(name="tasks.fail_fanout_job")
+def fail_fanout_job(job_id: str):
+    """Chord error callback: a subtask failed, was revoked or its worker died, so merge never runs."""
+    publish_job_event(job_id, "failed")
+    release_job(job_id)
+
+
+TASK_TOOLS = {task.name: tool for tool, task in TOOL_TASKS.items()}
+# Chord bookkeeping tasks that finish a fan-out job rather than being jobs themselves.
+FANOUT_CALLBACKS = (merge_analysis_results.name, fail_fanout_job.name)
+
+
+@before_task_publish.connect
+def _stamp_sent_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("sent_at", time.time())
+
+
+@worker_init.connect
+def _start_metrics_exporter(**kwargs):
+    start_worker_exporter()
+
+
+@worker_process_shutdown.connect
+def _drop_process_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+
+def _observe_wait(task):
+    sent_at = getattr(task.request, "sent_at", None)
+    if sent_at:
+        queue = (task.request.delivery_info or {}).get("routing_key") or ""
+        TASK_WAIT_SECONDS.labels(queue).observe(max(0.0, time.time() - float(sent_at)))
+
+
+@task_prerun.connect
+def _publish_task_started(task_id=None, task=None, **kwargs):
+    _observe_wait(task)
+    if task.name in FANOUT_CALLBACKS:
+        return
+    parent_job = _parent_job(task)
+    if not parent_job:
+        record_job_started(task_id)
+    publish_job_event(parent_job or task_id, "running", {"status": "running", "tool": TASK_TOOLS.get(task.name, "")})
+
+
+@task_postrun.connect
+def _publish_task_finished(task_id=None, task=None, retval=None, state=None, **kwargs):
+    if task.name == merge_analysis_results.name:
+        # The chord callback finishes the parent analyze_all job.
+        publish_job_event(task.request.kwargs.get("job_id"), "completed")
+        release_job(task.request.kwargs.get("job_id"))
+        return
+    if task.name == fail_fanout_job.name:
+        return
+    if isinstance(retval, dict) and retval.get("fanout"):
+        return
+
+    parent_job = _parent_job(task)
+    if parent_job:
+        publish_job_event(parent_job, "partial", {"tool": TASK_TOOLS.get(task.name, "")})
+    else:
+        if isinstance(retval, dict) and retval.get("cancelled"):
+            # Cancelled tasks return normally (state SUCCESS) with a cancelled result.
+            status = "cancelled"
+        else:
+            status = "completed" if state == "SUCCESS" else "failed"
+        publish_job_event(task_id, status)
+        release_job(task_id)
+
+
+@task_failure.connect
+def _release_failed_subtask(sender=None, **kwargs):
+    # A subtask that raised never lets the chord callback run; free its job now
+    # rather than waiting for the chord error to reach fail_fanout_job.
+    parent_job = _parent_job(sender)
+    if parent_job:
+        publish_job_event(parent_job, "failed")
+        release_job(parent_job)
+
+
+@task_revoked.connect
+def _release_revoked_task(request=None, **kwargs):
+    # Revoked tasks never reach task_postrun.
+    if request is None:
+        return
+    if request.task_name in TASK_TOOLS and (request.kwargs or {}).get("job_id"):
+        return
+    publish_job_event(request.id, "cancelled")
+    release_job(request.id)
+
+
 @celery_app.task(bind=True, name="tasks.analyze_all")
-def analyze_all(self, code: str, language: str = "", github_url: str = "", tools: list = None):
-    """Run multiple analysis tools."""
+def analyze_all(self, code: str, language: str = "", github_url: str = "", tools: list = None, mode: str = "fanout",
+                no_cache: bool = False):
+    """Run multiple analysis tools.
+
+    In "fanout" mode each tool is queued as its own subtask and merged by a chord
+    callback; this task returns immediately with the subtask ids so the job
+    endpoint can report per-tool progress. "sequential" mode runs the tools
+    inline in this worker slot. "fused" mode sends the code once and asks for
+    every tool's section in a single call; files large enough to need chunking
+    fall back to fan-out. Results carry "metrics" with the run's input tokens
+    and wall-clock time so the modes can be compared.
+    """
+    started_at = time.time()
     try:
         source_code = code
         if github_url:
@@ -147,16 +351,73 @@ def analyze_all(self, code: str, language: str = "", github_url: str = "", tools
         selected_tools = tools or ["debug", "refactor", "optimize", "test"]
         results = {}
 
+        if mode == "fused" and should_chunk("debug", source_code, None):
+            mode = "fanout"
+
+        if mode == "fused":
+            known_tools = [tool for tool in selected_tools if tool in TOOL_TASKS]
+            for tool in selected_tools:
+                if tool not in TOOL_TASKS:
+                    results[tool] = {"error": f"Unknown tool: {tool}"}
+            if not known_tools:
+                return {"success": True, "data": results, "tool": "multi-analysis"}
+
+            user_prompt = f"Language: {language or 'auto-detect'}\n\nCode:\n{source_code}"
+            static_issues = pre_analyze(source_code, language) if "debug" in known_tools else []
+            fused = analyze_fused_sync(
+                {tool: build_system_prompt(tool) for tool in known_tools},
+                with_hints(user_prompt, static_issues),
+                use_cache=not no_cache,
+                on_delta=token_publisher(self.request.id, "fused"),
+            )
+            for tool, section in fused["data"].items():
+                if "error" in section:
+                    results[tool] = {"success": False, "error": section["error"], "tool": TOOL_NAMES[tool]}
+                else:
+                    if tool == "debug":
+                        section = merge_issues(section, static_issues)
+                    results[tool] = {"success": True, "data": section, "tool": TOOL_NAMES[tool]}
+
+            metrics = _run_metrics("fused", started_at, results, fused["inputTokens"])
+            metrics["reissued"] = fused["reissued"]
+            return {"success": True, "data": results, "tool": "multi-analysis", "metrics": metrics}
+
+        if mode == "fanout":
+            known_tools = [tool for tool in selected_tools if tool in TOOL_TASKS]
+            for tool in selected_tools:
+                if tool not in TOOL_TASKS:
+                    results[tool] = {"error": f"Unknown tool: {tool}"}
+            if not known_tools:
+                return {"success": True, "data": results, "tool": "multi-analysis"}
+
+            # Subtasks stay on the queue this job was submitted to.
+            queue = (self.request.delivery_info or {}).get("routing_key") or BATCH_QUEUE
+            signatures = [
+                TOOL_TASKS[tool].s(source_code, language, no_cache=no_cache, job_id=self.request.id).set(queue=queue)
+                for tool in known_tools
+            ]
+            merge = merge_analysis_results.s(tools=known_tools, job_id=self.request.id, started_at=started_at)
+            merge.on_error(fail_fanout_job.si(self.request.id))
+            callback = chord(signatures)(merge)
+            children = {
+                tool: child.id for tool, child in zip(known_tools, callback.parent.results)
+            }
+
+            return {
+                "success": True,
+                "fanout": True,
+                "children": children,
+                "callback_id": callback.id,
+                "errors": results,
+                "tool": "multi-analysis",
+            }
+
         for tool in selected_tools:
+            raise_if_cancelled(self.request.id)
             try:
-                if tool == "debug":
-                    result = debug_code(source_code, language)
-                elif tool == "refactor":
-                    result = refactor_code(source_code, language)
-                elif tool == "optimize":
-                    result = optimize_code(source_code, language)
-                elif tool == "test":
-                    result = test_code(source_code, language)
+                task = TOOL_TASKS.get(tool)
+                if task:
+                    result = task(source_code, language, no_cache=no_cache, job_id=self.request.id)
                 else:
                     result = {"error": f"Unknown tool: {tool}"}
 
@@ -164,6 +425,67 @@ def analyze_all(self, code: str, language: str = "", github_url: str = "", tools
             except Exception as e:
                 results[tool] = {"error": str(e)}
 
-        return {"success": True, "data": results, "tool": "multi-analysis"}
+        return {"success": True, "data": results, "tool": "multi-analysis",
+                "metrics": _run_metrics("sequential", started_at, results)}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "multi-analysis"}
     except Exception as e:
         return {"success": False, "error": str(e), "tool": "multi-analysis"}
+
+
+@celery_app.task(bind=True, name="tasks.analyze_repo", time_limit=settings.REPO_TIME_LIMIT)
+def analyze_repo(self, repo_url: str, ref: str = "", tools: list = None, languages: list = None,
+                 max_file_bytes: int = None, max_files: int = None, github_token: str = "",
+                 no_cache: bool = False):
+    """Download a repository archive once and analyze its files with bounded concurrency.
+
+    Per-file results are appended to Redis as they finish and can be paged
+    through /api/jobs/{job_id}/files while the job runs.
+    """
+    job_id = self.request.id
+    try:
+        selected_tools = tools or ["debug"]
+        with tempfile.TemporaryDirectory(prefix="repo-") as work_dir:
+            archive_path = os.path.join(work_dir, "repo.tar.gz")
+            download_archive(archive_url(repo_url, ref), archive_path, github_token or settings.GITHUB_TOKEN)
+            summary = run_repo_pipeline(
+                job_id, archive_path, os.path.join(work_dir, "src"), selected_tools,
+                languages=languages, max_file_bytes=max_file_bytes, max_files=max_files,
+                use_cache=not no_cache,
+                on_file=lambda item: publish_job_event(job_id, "partial", {"path": item["path"]}),
+            )
+
+        return {"success": True, "data": summary, "tool": "repo-analysis"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "repo-analysis"}
+    except Exception as e:
+        set_job_meta(job_id, status="failed")
+        return {"success": False, "error": str(e), "tool": "repo-analysis"}
+
+
+@celery_app.task(bind=True, name="tasks.analyze_upload", time_limit=settings.REPO_TIME_LIMIT)
+def analyze_upload(self, upload_dir: str, tools: list = None, languages: list = None, no_cache: bool = False,
+                   skipped: list = None):
+    """Analyze files uploaded to /api/jobs/upload as one batch, then delete them.
+
+    Per-file results are paged through /api/jobs/{job_id}/files, as for
+    repository jobs.
+    """
+    job_id = self.request.id
+    try:
+        summary = run_file_pipeline(
+            job_id, upload_dir, tools or ["debug"], languages=languages,
+            max_file_bytes=settings.UPLOAD_MAX_FILE_BYTES, max_files=settings.UPLOAD_MAX_FILES,
+            use_cache=not no_cache,
+            on_file=lambda item: publish_job_event(job_id, "partial", {"path": item["path"]}),
+        )
+        # Files and zip members left out at upload time, then those the pipeline left out
+        summary["skipped"] = (skipped or []) + summary["skipped"]
+        return {"success": True, "data": summary, "tool": "upload-analysis"}
+    except JobCancelledError:
+        return {"success": False, "cancelled": True, "error": "Job cancelled", "tool": "upload-analysis"}
+    except Exception as e:
+        set_job_meta(job_id, status="failed")
+        return {"success": False, "error": str(e), "tool": "upload-analysis"}
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+import redis
+import redis.asyncio
+
+# Run without a Redis server or broker: Celery talks to in-memory transports
+# and every Redis client the modules create shares one fake server.
+os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+os.environ.setdefault("CELERY_RESULT_BACKEND", "cache+memory://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SERVER = fakeredis.FakeServer()
+redis.from_url = lambda *args, **kwargs: fakeredis.FakeRedis(server=SERVER)
+redis.asyncio.from_url = lambda *args, **kwargs: fakeredis.aioredis.FakeRedis(server=SERVER)
+
+
+@pytest.fixture(autouse=True)
+def _flush_redis():
+    yield
+    fakeredis.FakeRedis(server=SERVER).flushall()
+    # Async connections belong to the event loop of the test that opened them.
+    from cache import async_redis_client
+    async_redis_client.connection_pool.reset()
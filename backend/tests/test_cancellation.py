@@ -0,0 +1,39 @@
+import pytest
+
+import repo_pipeline
+import tasks
+from cancellation import JobCancelledError, cancel_jobs
+from repo_pipeline import run_file_pipeline
+from tasks import debug_code
+
+
+def test_cancelled_task_is_published_as_cancelled(monkeypatch):
+    events = []
+
+    def cancelled(*args, **kwargs):
+        raise JobCancelledError("job-c")
+
+    monkeypatch.setattr(tasks, "analyze_with_ai_sync", cancelled)
+    monkeypatch.setattr(tasks, "publish_job_event", lambda job_id, event, data=None: events.append((job_id, event)))
+
+    result = debug_code.apply(kwargs={"code": "x = 1\n", "language": "python"}, task_id="job-c").get()
+
+    assert result["cancelled"] is True
+    assert events[-1] == ("job-c", "cancelled")
+
+
+def test_cancelled_file_pipeline_stops_before_the_next_tool(monkeypatch, tmp_path):
+    calls = []
+
+    def analyze(system_prompt, user_prompt, tool="", **kwargs):
+        calls.append(tool)
+        # A cache hit: returns at once, without streaming through on_delta.
+        cancel_jobs(["job-r"])
+        return {"summary": "cached"}
+
+    monkeypatch.setattr(repo_pipeline, "analyze_with_ai_sync", analyze)
+    (tmp_path / "a.py").write_text("x = 1\n")
+
+    with pytest.raises(JobCancelledError):
+        run_file_pipeline("job-r", str(tmp_path), ["debug", "refactor"])
+    assert calls == ["debug"]
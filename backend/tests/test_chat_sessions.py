@@ -0,0 +1,59 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import ai_service
+import chat_sessions
+from cache import async_redis_client
+from chat_sessions import HISTORY_KEY, chat_turn, compact_history, create_session, get_session
+from config import settings
+from schemas import SCHEMAS
+
+
+def test_overlapping_compactions_summarize_and_trim_once(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_HISTORY_TOKEN_BUDGET", 10)
+    monkeypatch.setattr(settings, "CHAT_KEEP_RECENT_MESSAGES", 2)
+    calls = []
+
+    async def summarize(system_prompt, user_prompt, tool=""):
+        calls.append(tool)
+        await asyncio.sleep(0.1)
+        return {"summary": "earlier turns"}
+
+    monkeypatch.setattr(chat_sessions, "analyze_with_ai", summarize)
+
+    async def run():
+        session_id = await create_session("print(1)", "python")
+        turns = [json.dumps({"role": "user", "content": f"question number {n} " * 5}) for n in range(6)]
+        await async_redis_client.rpush(HISTORY_KEY.format(session_id=session_id), *turns)
+        await asyncio.gather(compact_history(session_id), compact_history(session_id))
+        return await get_session(session_id)
+
+    session = asyncio.run(run())
+    assert calls == ["chat-summary"]
+    assert session["summary"] == "earlier turns"
+    assert [item["content"] for item in session["history"]] == [f"question number {n} " * 5 for n in (4, 5)]
+
+
+def test_chat_turn_requests_the_assistant_schema(monkeypatch):
+    requests = []
+
+    async def create(**kwargs):
+        requests.append(kwargs)
+        message = SimpleNamespace(content=json.dumps({"reply": "Use a set.", "items": ["O(1) lookups"]}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(ai_service, "async_client", fake_client)
+
+    async def run():
+        session_id = await create_session("print(1)", "python")
+        result = await chat_turn(session_id, "How do I speed this up?")
+        return result, await get_session(session_id)
+
+    result, session = asyncio.run(run())
+    response_format = requests[0]["response_format"]
+    assert response_format["json_schema"]["name"] == "assistant"
+    assert response_format["json_schema"]["schema"] == SCHEMAS["assistant"]
+    assert result["reply"] == "Use a set."
+    assert session["history"][-1]["content"] == "Use a set.\n- O(1) lookups"
@@ -0,0 +1,50 @@
+import fused
+from ai_service import MAX_TOKENS, build_system_prompt
+from fused import FUSED_TOOL, analyze_fused_sync
+from token_budget import output_limit, prepare_prompt
+
+DEBUG = {"summary": "ok", "severity": "low", "issues": [], "fixedCode": None}
+REFACTOR = {"summary": "ok", "refactoredCode": "x = 1", "keyChanges": [], "principlesApplied": [], "beforeAfter": []}
+
+
+def test_only_sections_failing_their_schema_are_reissued(monkeypatch):
+    calls = []
+
+    def fake_analyze(system_prompt, user_prompt, tool="", **kwargs):
+        calls.append(tool)
+        if tool == FUSED_TOOL:
+            # refactor's principlesApplied entries are missing their "why".
+            broken = {**REFACTOR, "principlesApplied": [{"principle": "DRY"}]}
+            return {"debug": DEBUG, "refactor": broken, "tokenUsage": {"inputTokens": 100}}
+        return {**REFACTOR, "tokenUsage": {"inputTokens": 40}}
+
+    monkeypatch.setattr(fused, "analyze_with_ai_sync", fake_analyze)
+
+    result = analyze_fused_sync({tool: build_system_prompt(tool) for tool in ("debug", "refactor")}, "Code:\nx=1")
+
+    assert calls == [FUSED_TOOL, "refactor"]
+    assert result["reissued"] == ["refactor"]
+    assert result["data"]["debug"] == DEBUG
+    assert result["inputTokens"] == 140
+
+
+def test_fused_call_is_split_to_fit_the_models_output_limit(monkeypatch):
+    calls = []
+
+    def fake_analyze(system_prompt, user_prompt, tool="", model=None, max_tokens=None, schema=None, **kwargs):
+        calls.append((model, max_tokens, sorted(schema["properties"])))
+        return {"debug": DEBUG, "refactor": REFACTOR, "tokenUsage": {"inputTokens": 50}}
+
+    monkeypatch.setattr(fused, "analyze_with_ai_sync", fake_analyze)
+
+    prompts = {tool: build_system_prompt(tool) for tool in ("debug", "refactor")}
+    result = analyze_fused_sync(prompts, "Code:\nx=1", model="gpt-4-turbo")
+
+    assert calls == [("gpt-4-turbo", MAX_TOKENS, ["debug"]), ("gpt-4-turbo", MAX_TOKENS, ["refactor"])]
+    assert result["reissued"] == []
+    assert result["inputTokens"] == 100
+
+
+def test_max_tokens_never_exceeds_the_models_output_limit():
+    prepared = prepare_prompt("system", "Code:\nx = 1", "gpt-4-turbo", MAX_TOKENS * 3)
+    assert prepared["max_tokens"] == output_limit("gpt-4-turbo")
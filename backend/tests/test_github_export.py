@@ -0,0 +1,50 @@
+import asyncio
+
+import httpx
+import pytest
+
+import github_export
+from bench.fake_github import FakeRepo, create_app
+from github_export import export_files
+
+
+@pytest.fixture
+def repos(monkeypatch):
+    repos = {"octo/demo": FakeRepo("octo/demo"), "octo/empty": FakeRepo("octo/empty", empty=True)}
+    transport = httpx.ASGITransport(app=create_app(repos))
+    monkeypatch.setattr(github_export, "client", httpx.AsyncClient(transport=transport, base_url="http://github.test"))
+    return repos
+
+
+def _export(repo: str, files: list) -> dict:
+    return asyncio.run(export_files("token", repo, "main", files, "Update via Code Assistant"))
+
+
+def _head_files(repo: FakeRepo) -> dict:
+    return repo.trees[repo.commits[repo.refs["main"]]["tree"]]
+
+
+def test_existing_executable_keeps_its_mode(repos):
+    _export("octo/demo", [{"path": "run.sh", "content": "#!/bin/sh\necho changed\n"},
+                          {"path": "tool.py", "content": "print(1)\n"},
+                          {"path": "bin/cli", "content": "#!/bin/sh\n", "mode": "100755"}])
+
+    files = _head_files(repos["octo/demo"])
+    assert files["run.sh"] == {"mode": "100755", "content": "#!/bin/sh\necho changed\n"}
+    assert files["tool.py"]["mode"] == "100644"
+    assert files["bin/cli"]["mode"] == "100755"
+
+
+def test_export_to_empty_repo_creates_root_commit(repos):
+    data = _export("octo/empty", [{"path": "main.py", "content": "print(1)\n"}])
+
+    repo = repos["octo/empty"]
+    assert repo.refs["main"] == data["commit_sha"]
+    assert repo.commits[data["commit_sha"]]["parents"] == []
+    assert _head_files(repo) == {"main.py": {"mode": "100644", "content": "print(1)\n"}}
+
+
+def test_invalid_mode_is_rejected(repos):
+    with pytest.raises(github_export.GitHubAPIError) as info:
+        _export("octo/demo", [{"path": "a.py", "content": "", "mode": "040000"}])
+    assert info.value.status_code == 400
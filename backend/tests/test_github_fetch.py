@@ -0,0 +1,18 @@
+import httpx
+from fastapi.testclient import TestClient
+
+import github_fetch
+from config import settings
+
+
+def test_oversized_source_is_rejected_with_413(monkeypatch):
+    monkeypatch.setattr(settings, "SOURCE_MAX_BYTES", 100)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"x = 1\n" * 50))
+    monkeypatch.setattr(github_fetch, "async_client", httpx.AsyncClient(transport=transport))
+
+    import main
+    with TestClient(main.app) as client:
+        for path in ("/api/debug", "/api/refactor", "/api/debug/stream"):
+            response = client.post(path, json={"github_url": "https://github.com/octo/demo/blob/main/big.py"})
+            assert response.status_code == 413, path
+            assert "exceeds 100 bytes" in response.json()["detail"]
@@ -0,0 +1,19 @@
+from cache import redis_client
+from config import settings
+from model_router import LATENCY_KEY, latency_stats, record_latency
+
+
+def test_snapshot_survives_single_calls_and_refreshes_after_enough_samples(monkeypatch):
+    monkeypatch.setattr(settings, "ROUTER_REFRESH_SECONDS", 3600)
+    monkeypatch.setattr(settings, "ROUTER_REFRESH_SAMPLES", 3)
+    model = "router-test-model"
+    record_latency(model, 0.1)
+    assert latency_stats(model)["samples"] == 1
+
+    record_latency(model, 0.2)
+    record_latency(model, 0.3)
+    assert latency_stats(model)["samples"] == 1
+    assert redis_client.llen(LATENCY_KEY.format(model=model)) == 3
+
+    record_latency(model, 0.4)
+    assert latency_stats(model)["samples"] == 4
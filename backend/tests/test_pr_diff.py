@@ -0,0 +1,24 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+CHANGE = {"original_code": "a = 1\n", "modified_code": "a = 2\n"}
+
+
+def test_multi_file_pr_without_files_is_a_bad_request():
+    with TestClient(main.app) as client:
+        for path in ("/api/generate-pr/multi", "/api/jobs/pr-multi"):
+            response = client.post(path, json={"files": []})
+            assert response.status_code == 400, path
+            assert response.json()["detail"] == "At least one file is required"
+
+
+@pytest.mark.parametrize("context_lines", [None, -1, 1000])
+def test_invalid_context_lines_are_rejected(context_lines):
+    with TestClient(main.app) as client:
+        single = client.post("/api/generate-pr", json={**CHANGE, "context_lines": context_lines})
+        multi = client.post("/api/generate-pr/multi",
+                            json={"files": [{"filename": "a.py", **CHANGE}], "context_lines": context_lines})
+    assert single.status_code == 422
+    assert multi.status_code == 422
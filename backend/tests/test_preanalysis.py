@@ -0,0 +1,64 @@
+from preanalysis import blocking_result, is_blocking, merge_issues, pre_analyze, with_hints
+from schemas import SCHEMAS
+
+CATEGORIES = set(SCHEMAS["debug"]["properties"]["issues"]["items"]["properties"]["category"]["enum"])
+
+RUST_LIFETIME = '''struct Pair<'a> {
+    left: &'a str,
+    right: &'a str,
+}
+'''
+KOTLIN_TEMPLATE = 'fun greet(name: String) = println("Hello, ${name.uppercase()}!")\n'
+BASH_CASE = '''case "$1" in
+  start) echo starting ;;
+  stop) echo stopping ;;
+esac
+'''
+JS_REGEX = "const quoted = /['\"]/g;\n"
+
+
+def test_python_syntax_error_blocks():
+    issues = pre_analyze("def broken(:\n    pass\n", "python")
+    assert is_blocking(issues)
+    assert blocking_result(issues)["issues"] == issues
+
+
+def test_tokenizer_findings_never_block():
+    for code, language in ((RUST_LIFETIME, "rust"), (KOTLIN_TEMPLATE, "kotlin"), (BASH_CASE, "bash"),
+                           (JS_REGEX, "javascript")):
+        issues = pre_analyze(code, language)
+        assert not is_blocking(issues), language
+        assert merge_issues({"issues": []}, issues) == {"issues": []}
+
+
+def test_tokenizer_findings_become_soft_hints():
+    issues = pre_analyze(RUST_LIFETIME, "rust")
+    assert issues
+    prompt = with_hints("Code:\n" + RUST_LIFETIME, issues)
+    assert "may be false positives" in prompt
+    assert "Do not repeat them" not in prompt
+
+
+def test_python_findings_use_schema_categories():
+    code = '''import os
+import json as _json
+
+
+def total(values):
+    unused = 1
+    for i in range(3):
+        pass
+    for _, value in values:
+        print(value)
+    _scratch = 2
+'''
+    issues = pre_analyze(code, "python")
+    assert {issue["category"] for issue in issues} <= CATEGORIES
+    flagged = {issue["issue"] for issue in issues}
+    assert flagged == {"'os' is imported but never used", "Local variable 'unused' is assigned but never used"}
+
+
+def test_future_imports_are_not_reported_unused():
+    code = "from __future__ import annotations\nimport os\n\n\ndef f(x: int) -> int:\n    return x\n"
+    messages = [issue["issue"] for issue in pre_analyze(code, "python")]
+    assert messages == ["'os' is imported but never used"]
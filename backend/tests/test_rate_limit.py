@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from cache import redis_client
+from config import settings
+from rate_limit import (
+    BREAKER_OPEN_KEY, CircuitOpenError, RateLimitedError, UpstreamUnavailableError,
+    call_with_retries, call_with_retries_async,
+)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(settings, "RETRY_MAX_DELAY", 0)
+
+
+def _response(status: int, headers: dict = None) -> httpx.Response:
+    return httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/chat"))
+
+
+def _failing(error: Exception):
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise error
+    return call, calls
+
+
+def test_exhausted_429s_raise_rate_limited_error():
+    call, calls = _failing(openai.RateLimitError("slow down", response=_response(429, {"retry-after": "7"}), body=None))
+    with pytest.raises(RateLimitedError) as info:
+        call_with_retries(call, tokens=10)
+    assert len(calls) == 3
+    assert info.value.status_code == 429
+    assert info.value.retry_after == 7
+
+
+def test_exhausted_5xx_raise_upstream_unavailable():
+    call, _ = _failing(openai.InternalServerError("boom", response=_response(500), body=None))
+    with pytest.raises(UpstreamUnavailableError) as info:
+        call_with_retries(call, tokens=10)
+    assert info.value.status_code == 503
+
+
+def test_other_errors_are_not_retried():
+    call, calls = _failing(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        call_with_retries(call, tokens=10)
+    assert len(calls) == 1
+
+
+def test_async_path_trips_the_shared_breaker(monkeypatch):
+    monkeypatch.setattr(settings, "BREAKER_FAILURE_THRESHOLD", 2)
+
+    async def call():
+        raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat"))
+
+    async def run():
+        with pytest.raises(UpstreamUnavailableError):
+            await call_with_retries_async(call, tokens=10)
+        assert redis_client.exists(BREAKER_OPEN_KEY)
+        with pytest.raises(CircuitOpenError):
+            await call_with_retries_async(call, tokens=10)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("attempts", [0, -1])
+def test_calls_are_made_once_without_retries_configured(monkeypatch, attempts):
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", attempts)
+
+    async def succeed():
+        return "ok"
+
+    assert call_with_retries(lambda: "ok", tokens=10) == "ok"
+    assert asyncio.run(call_with_retries_async(succeed, tokens=10)) == "ok"
+
+    call, calls = _failing(openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com")))
+    with pytest.raises(UpstreamUnavailableError, match="after 1 attempts"):
+        call_with_retries(call, tokens=10)
+    assert len(calls) == 1
@@ -0,0 +1,98 @@
+import time
+
+from celery.signals import before_task_publish
+
+from cache import redis_client
+from config import settings
+from scheduling import BATCH_QUEUE, INFLIGHT_KEY, INTERACTIVE_QUEUE, JOB_KEY, submit_job, sweep_stale_slots
+from tasks import analyze_all, debug_code, fail_fanout_job
+
+TENANT = "tenant-a"
+# Fails to compile, so the debugger answers from pre-analysis without a model call.
+BROKEN = {"code": "def broken(:\n    pass\n", "language": "python"}
+
+
+def test_held_job_runs_as_own_job_and_frees_its_slot(monkeypatch):
+    monkeypatch.setattr(settings, "FAIR_SCHEDULING_ENABLED", True)
+    monkeypatch.setattr(settings, "TENANT_MAX_INFLIGHT", 1)
+    sent = {}
+
+    def capture(headers=None, body=None, **kwargs):
+        sent[headers["id"]] = headers
+
+    before_task_publish.connect(capture, weak=False)
+    try:
+        submit_job(debug_code.name, BROKEN, "job-1", INTERACTIVE_QUEUE, TENANT)
+        submit_job(debug_code.name, BROKEN, "job-2", INTERACTIVE_QUEUE, TENANT)
+        assert list(sent) == ["job-1"]
+
+        # Finishing job-1 releases the held job-2 from inside job-1's task_postrun.
+        debug_code.apply(kwargs=BROKEN, task_id="job-1")
+        assert "job-2" in sent
+        assert sent["job-2"]["parent_id"] is None
+
+        debug_code.apply(kwargs=BROKEN, task_id="job-2", parent_id=sent["job-2"]["parent_id"])
+    finally:
+        before_task_publish.disconnect(capture)
+
+    inflight = INFLIGHT_KEY.format(queue=INTERACTIVE_QUEUE, tenant=TENANT)
+    assert redis_client.zcard(inflight) == 0
+    assert not redis_client.exists(JOB_KEY.format(job_id="job-2"))
+
+
+def test_fanout_subtask_reports_to_its_job(monkeypatch):
+    monkeypatch.setattr(settings, "FAIR_SCHEDULING_ENABLED", True)
+    submit_job(debug_code.name, BROKEN, "parent", INTERACTIVE_QUEUE, TENANT)
+
+    # A fan-out child finishing must not release the parent job's slot.
+    debug_code.apply(kwargs={**BROKEN, "job_id": "parent"}, task_id="child")
+    assert redis_client.exists(JOB_KEY.format(job_id="parent"))
+
+
+def test_failed_fanout_frees_the_job_slot(monkeypatch):
+    monkeypatch.setattr(settings, "FAIR_SCHEDULING_ENABLED", True)
+    submit_job(analyze_all.name, BROKEN, "fanout-job", BATCH_QUEUE, TENANT)
+    sent = {}
+
+    def capture(headers=None, body=None, **kwargs):
+        sent[headers["task"]] = body
+
+    before_task_publish.connect(capture, weak=False)
+    try:
+        analyze_all.apply(kwargs=BROKEN, task_id="fanout-job")
+    finally:
+        before_task_publish.disconnect(capture)
+
+    # The merge callback rides along with the subtasks and carries the error callback.
+    merge = sent[debug_code.name][2]["chord"]
+    assert [errback["task"] for errback in merge["options"]["link_error"]] == [fail_fanout_job.name]
+    assert redis_client.exists(JOB_KEY.format(job_id="fanout-job"))
+
+    # A subtask dying hard means merge never runs; the chord error calls fail_fanout_job instead.
+    fail_fanout_job.apply(args=["fanout-job"])
+    assert redis_client.zcard(INFLIGHT_KEY.format(queue=BATCH_QUEUE, tenant=TENANT)) == 0
+    assert not redis_client.exists(JOB_KEY.format(job_id="fanout-job"))
+
+
+def test_slot_leaked_by_a_dead_worker_is_swept(monkeypatch):
+    monkeypatch.setattr(settings, "FAIR_SCHEDULING_ENABLED", True)
+    monkeypatch.setattr(settings, "TENANT_MAX_INFLIGHT", 1)
+    sent = []
+    before_task_publish.connect(lambda headers=None, **kwargs: sent.append(headers["id"]), weak=False,
+                                dispatch_uid="sweep-capture")
+    try:
+        submit_job(debug_code.name, BROKEN, "job-dead", INTERACTIVE_QUEUE, TENANT)
+        submit_job(debug_code.name, BROKEN, "job-held", INTERACTIVE_QUEUE, TENANT)
+        assert sent == ["job-dead"]
+
+        inflight = INFLIGHT_KEY.format(queue=INTERACTIVE_QUEUE, tenant=TENANT)
+        # job-dead's worker died: nothing releases it, and its slot's time limit has passed.
+        expires_at = redis_client.zscore(inflight, "job-dead")
+        assert expires_at - time.time() > debug_code.app.conf.task_time_limit
+        redis_client.zadd(inflight, {"job-dead": time.time() - 1})
+
+        sweep_stale_slots()
+        assert sent == ["job-dead", "job-held"]
+        assert redis_client.zrange(inflight, 0, -1) == [b"job-held"]
+    finally:
+        before_task_publish.disconnect(dispatch_uid="sweep-capture")
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from cache import redis_client
+from cancellation import JobCancelledError
+from config import settings
+from rate_limit import CircuitOpenError, RateLimitedError, UpstreamUnavailableError
+from singleflight import LOCK_PREFIX, CoalescedCallError, run_coalesced
+from token_budget import PromptTooLargeError
+
+
+def _run_in_thread(fn):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = fn()
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, outcome
+
+
+def _leader(key: str, release: threading.Event, fail_with: Exception):
+    def compute():
+        release.wait(5)
+        raise fail_with
+    return _run_in_thread(lambda: run_coalesced(key, compute))
+
+
+def test_cancelled_leader_hands_over_to_follower():
+    release = threading.Event()
+    leader, leader_outcome = _leader("k-cancel", release, JobCancelledError("job-a"))
+    time.sleep(0.2)
+    follower, follower_outcome = _run_in_thread(lambda: run_coalesced("k-cancel", lambda: {"ok": True}))
+    time.sleep(0.2)
+    release.set()
+    leader.join(5)
+    follower.join(10)
+
+    assert isinstance(leader_outcome["error"], JobCancelledError)
+    assert follower_outcome == {"result": {"ok": True}}
+
+
+def test_failed_leader_raises_typed_error_in_followers():
+    release = threading.Event()
+    leader, _ = _leader("k-fail", release, Exception("AI Analysis failed: boom"))
+    time.sleep(0.2)
+    follower, follower_outcome = _run_in_thread(lambda: run_coalesced("k-fail", lambda: {"ok": True}))
+    time.sleep(0.2)
+    release.set()
+    leader.join(5)
+    follower.join(10)
+
+    assert isinstance(follower_outcome["error"], CoalescedCallError)
+    with pytest.raises(CoalescedCallError, match="boom"):
+        raise follower_outcome["error"]
+
+
+@pytest.mark.parametrize("error, attributes", [
+    (RateLimitedError(12, queue_position=3), {"status_code": 429, "retry_after": 12, "queue_position": 3}),
+    (CircuitOpenError(30), {"status_code": 503, "retry_after": 30}),
+    (UpstreamUnavailableError("OpenAI kept failing", 5), {"status_code": 503, "retry_after": 5}),
+    (PromptTooLargeError(200000, 127000), {"input_tokens": 200000, "limit": 127000}),
+])
+def test_followers_get_the_leaders_typed_error(error, attributes):
+    key = f"k-{type(error).__name__}"
+    release = threading.Event()
+    leader, _ = _leader(key, release, error)
+    time.sleep(0.2)
+    follower, follower_outcome = _run_in_thread(lambda: run_coalesced(key, lambda: {"ok": True}))
+    time.sleep(0.2)
+    release.set()
+    leader.join(5)
+    follower.join(10)
+
+    raised = follower_outcome["error"]
+    assert type(raised) is type(error)
+    assert str(raised) == str(error)
+    assert {name: getattr(raised, name) for name in attributes} == attributes
+
+
+def test_heartbeat_keeps_a_slow_leader_in_charge(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLEFLIGHT_LOCK_TTL", 1)
+    calls = []
+
+    def slow():
+        calls.append("leader")
+        time.sleep(2.5)
+        return {"by": "leader"}
+
+    leader, _ = _run_in_thread(lambda: run_coalesced("k-slow", slow))
+    time.sleep(0.2)
+    follower, follower_outcome = _run_in_thread(
+        lambda: run_coalesced("k-slow", lambda: calls.append("follower") or {"by": "follower"}))
+    leader.join(10)
+    follower.join(10)
+
+    assert calls == ["leader"]
+    assert follower_outcome == {"result": {"by": "leader"}}
+
+
+def test_follower_takes_over_from_a_dead_leader(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLEFLIGHT_LOCK_TTL", 1)
+    # A leader that crashed: its lock is never renewed and nothing is published.
+    redis_client.set(LOCK_PREFIX + "k-dead", "gone", ex=1)
+
+    started = time.monotonic()
+    assert run_coalesced("k-dead", lambda: {"ok": True}) == {"ok": True}
+    assert time.monotonic() - started < 5
+    assert not redis_client.exists(LOCK_PREFIX + "k-dead")
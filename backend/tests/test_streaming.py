@@ -0,0 +1,41 @@
+import asyncio
+from types import SimpleNamespace
+
+import ai_service
+from ai_service import PROMPTS, stream_with_ai
+
+
+class _UpstreamStream:
+    def __init__(self, parts):
+        self.parts = list(parts)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.parts:
+            raise StopAsyncIteration
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.parts.pop(0)))])
+
+    async def close(self):
+        self.closed = True
+
+
+def test_upstream_stream_is_closed_when_the_consumer_stops(monkeypatch):
+    upstream = _UpstreamStream(['{"summary": "', "half", " an answer", '"}'])
+
+    async def create(**kwargs):
+        return upstream
+
+    monkeypatch.setattr(ai_service.async_client.chat.completions, "create", create)
+
+    async def run():
+        events = stream_with_ai(PROMPTS["generate"], "Prompt:\nhello", tool="generate", use_cache=False)
+        first = await events.__anext__()
+        await events.aclose()
+        return first
+
+    assert asyncio.run(run())[0] == "delta"
+    assert upstream.closed
+    assert upstream.parts
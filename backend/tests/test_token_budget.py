@@ -0,0 +1,64 @@
+import json
+from types import SimpleNamespace
+
+import ai_service
+from chat_sessions import build_chat_prompt
+from tasks import refactor_code
+from token_budget import CODE_END_MARKER, CODE_MARKER, compact_code, prepare_prompt
+
+LICENSED = """# Copyright (c) 2024 Example Corp.
+# Licensed under the Apache License, Version 2.0.
+
+def add(a, b):   
+
+
+    return a + b
+"""
+
+
+def _chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class _EchoStream(list):
+    def close(self):
+        pass
+
+
+def _echo_refactor(**kwargs):
+    """A model that returns the code it was sent as the refactored file."""
+    code = kwargs["messages"][-1]["content"].split(CODE_MARKER, 1)[1]
+    reply = json.dumps({
+        "summary": "No changes needed", "refactoredCode": code, "keyChanges": [],
+        "principlesApplied": [], "beforeAfter": [],
+    })
+    return _EchoStream([_chunk(reply)])
+
+
+def test_refactor_returns_the_file_with_its_license_header(monkeypatch):
+    monkeypatch.setattr(ai_service.client.chat.completions, "create", _echo_refactor)
+
+    result = refactor_code.apply(kwargs={"code": LICENSED, "language": "python", "no_cache": True}).get()
+
+    assert result["success"], result
+    assert result["data"]["refactoredCode"] == LICENSED
+
+
+def test_tools_that_do_not_echo_code_still_compact_it():
+    prepared = prepare_prompt("system", f"Language: python{CODE_MARKER}{LICENSED}", "gpt-4o", 1000)
+    assert "Copyright" not in prepared["user_prompt"]
+    assert prepared["line_map"][0] == 4
+
+
+def test_comments_that_only_mention_a_license_are_kept():
+    code = "# Usage: run with --license-check to verify (c) headers.\nimport sys\n"
+    assert compact_code(code)[0] == code.rstrip("\n")
+    assert compact_code("// SPDX-License-Identifier: MIT\n\nint x;\n")[0] == "int x;"
+
+
+def test_only_the_code_section_is_compacted():
+    prompt = build_chat_prompt("Why   \n\n\n\nthis?", "x = 1   \n\n\n\ny = 2\n", "python",
+                               [{"role": "user", "content": "a\n\n\n\nb"}], "Copyright (c) notes")
+    prepared = prepare_prompt("system", prompt, "gpt-4o", 1000)["user_prompt"]
+    assert f"{CODE_MARKER}x = 1\n\ny = 2{CODE_END_MARKER}" in prepared
+    assert prepared.endswith(prompt[prompt.index(CODE_END_MARKER) + len(CODE_END_MARKER):])
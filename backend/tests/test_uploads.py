@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+import repo_pipeline
+from repo_pipeline import run_file_pipeline
+from uploads import receive_upload
+
+BOUNDARY = "upload-boundary"
+
+
+def _multipart(files: dict) -> bytes:
+    parts = []
+    for name, content in files.items():
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n"
+        )
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def _stream(body: bytes):
+    for start in range(0, len(body), 7):
+        yield body[start:start + 7]
+
+
+def test_non_source_files_are_reported_as_skipped(tmp_path):
+    body = _multipart({"app.py": b"print(1)\n", "notes.txt": b"todo\n", "logo.png": b"\x89PNG" * 100})
+    upload = asyncio.run(receive_upload(f"multipart/form-data; boundary={BOUNDARY}", _stream(body), str(tmp_path)))
+
+    assert upload.files == ["app.py"]
+    assert upload.skipped == [
+        {"path": "notes.txt", "reason": "not a source file"},
+        {"path": "logo.png", "reason": "not a source file"},
+    ]
+    assert sorted(os.listdir(tmp_path)) == ["app.py"]
+
+
+def test_files_the_pipeline_leaves_out_are_reported_with_a_reason(monkeypatch, tmp_path):
+    monkeypatch.setattr(repo_pipeline, "analyze_with_ai_sync", lambda *args, **kwargs: {"summary": "ok"})
+    (tmp_path / "app.py").write_text("print(1)\n")
+    (tmp_path / "empty.py").write_text("")
+    (tmp_path / "main.go").write_text("package main\n")
+
+    summary = run_file_pipeline("job-u", str(tmp_path), ["debug"], languages=["python"])
+
+    assert summary["files"] == 1
+    assert summary["skipped"] == [
+        {"path": "empty.py", "reason": "empty"},
+        {"path": "main.go", "reason": "go not among the selected languages"},
+    ]
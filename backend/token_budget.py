@@ -0,0 +1,208 @@
+import re
+from typing import List, Optional, Tuple
+
+from config import settings
+
+CODE_MARKER = "\nCode:\n"
+# Ends the code section when more prompt text follows it; only the text in between is compacted.
+CODE_END_MARKER = "\nEnd of code.\n"
+# How license headers open; a comment block that merely mentions a license is kept.
+LICENSE_START_RE = re.compile(
+    r"^(?:copyright\b|\(c\)|©|spdx-license-identifier:|licensed (?:under|to)\b|all rights reserved"
+    r"|permission is hereby granted|this (?:file|program|library|software) is (?:free software|licensed|part of)\b)",
+    re.IGNORECASE,
+)
+COMMENT_PREFIXES = ("#", "//", "/*", "*", "--", ";", "<!--")
+
+# Context window sizes; unknown models use DEFAULT_CONTEXT_TOKENS.
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+# Most tokens a model will generate in one reply; unknown models use DEFAULT_OUTPUT_TOKENS.
+MODEL_OUTPUT_TOKENS = {
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+    "gpt-4-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 4096,
+}
+DEFAULT_OUTPUT_TOKENS = 4096
+# Per-message framing overhead of the chat format.
+MESSAGE_OVERHEAD_TOKENS = 8
+
+_encodings = {}
+
+
+class PromptTooLargeError(Exception):
+    """Raised before any network call when a prompt cannot fit the model's context."""
+
+    def __init__(self, input_tokens: int, limit: int):
+        self.input_tokens = input_tokens
+        self.limit = limit
+        super().__init__(f"Input is {input_tokens} tokens; at most {limit} fit this model with room for a reply")
+
+
+def _encoding(model: str):
+    """tiktoken encoding for a model, or None when tiktoken or its data is unavailable."""
+    if model not in _encodings:
+        try:
+            import tiktoken
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except Exception:
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        # ~4 characters per token for English text and code.
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _strip_license_header(lines: List[str]) -> int:
+    """Number of leading lines forming a license/copyright comment block (0 if none).
+
+    The block must open with a license or SPDX line; other leading comments
+    (module docs, usage notes) are kept even if they mention a license.
+    """
+    start = 1 if lines and lines[0].startswith("#!") else 0
+    end = start
+    in_block = False
+    while end < len(lines):
+        stripped = lines[end].strip()
+        if in_block:
+            in_block = "*/" not in stripped
+        elif stripped.startswith("/*"):
+            in_block = "*/" not in stripped
+        elif not stripped.startswith(COMMENT_PREFIXES):
+            break
+        end += 1
+    first = next((text for text in map(_comment_text, lines[start:end]) if text), "")
+    if LICENSE_START_RE.match(first):
+        return end - start
+    return 0
+
+
+def _comment_text(line: str) -> str:
+    text = line.strip()
+    for prefix in sorted(COMMENT_PREFIXES, key=len, reverse=True):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+            break
+    return text.strip(" *!/-#").strip()
+
+
+def compact_code(code: str) -> Tuple[str, List[int]]:
+    """Drop license headers, trailing whitespace and repeated blank lines.
+
+    Returns the compacted code and a line map: ``line_map[i]`` is the original
+    1-based line number of compacted line ``i + 1``.
+    """
+    lines = code.split("\n")
+    header_start = 1 if lines and lines[0].startswith("#!") else 0
+    header_length = _strip_license_header(lines)
+
+    kept: List[str] = []
+    line_map: List[int] = []
+    previous_blank = False
+    for index, line in enumerate(lines):
+        if header_start <= index < header_start + header_length:
+            continue
+        line = line.rstrip()
+        blank = not line
+        if blank and (previous_blank or not kept):
+            continue
+        kept.append(line)
+        line_map.append(index + 1)
+        previous_blank = blank
+    while kept and not kept[-1]:
+        kept.pop()
+        line_map.pop()
+    return "\n".join(kept), line_map
+
+
+def remap_lines(value, line_map: List[int]):
+    """Rewrite every integer "line" field to point at the original source."""
+    if not line_map:
+        return value
+    if isinstance(value, list):
+        return [remap_lines(item, line_map) for item in value]
+    if isinstance(value, dict):
+        remapped = {}
+        for key, item in value.items():
+            if key == "line" and isinstance(item, int) and 1 <= item <= len(line_map):
+                remapped[key] = line_map[item - 1]
+            else:
+                remapped[key] = remap_lines(item, line_map)
+        return remapped
+    return value
+
+
+def context_limit(model: str) -> int:
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+
+
+def output_limit(model: str) -> int:
+    return MODEL_OUTPUT_TOKENS.get(model, DEFAULT_OUTPUT_TOKENS)
+
+
+def fits_in_context(text: str, model: str = "gpt-4o") -> bool:
+    """True if text leaves room for at least PROMPT_MIN_OUTPUT_TOKENS of reply."""
+    return count_tokens(text, model) + settings.PROMPT_MIN_OUTPUT_TOKENS <= context_limit(model)
+
+
+def close_code(user_prompt: str) -> str:
+    """Mark the end of a prompt's code section before more text is appended to it."""
+    if CODE_MARKER in user_prompt and CODE_END_MARKER not in user_prompt:
+        return user_prompt + CODE_END_MARKER
+    return user_prompt
+
+
+def prepare_prompt(system_prompt: str, user_prompt: str, model: str, max_tokens: int, compact: bool = True) -> dict:
+    """Compact the code section of a prompt and size max_tokens to the remaining budget.
+
+    max_tokens is also capped at the model's output limit.
+
+    The code section runs from CODE_MARKER to CODE_END_MARKER, or to the end
+    of the prompt; text outside it is sent as is.
+
+    Pass compact=False for tools whose reply returns the code itself, so the
+    returned file keeps its license header and formatting. Raises
+    PromptTooLargeError when even a minimal reply would not fit.
+    """
+    original_tokens = count_tokens(system_prompt, model) + count_tokens(user_prompt, model)
+    line_map: Optional[List[int]] = None
+    prepared = user_prompt
+
+    marker = user_prompt.find(CODE_MARKER)
+    if compact and settings.PROMPT_COMPACTION_ENABLED and marker != -1:
+        start = marker + len(CODE_MARKER)
+        end = user_prompt.find(CODE_END_MARKER, start)
+        if end == -1:
+            end = len(user_prompt)
+        compacted, line_map = compact_code(user_prompt[start:end])
+        prepared = user_prompt[:start] + compacted + user_prompt[end:]
+
+    input_tokens = count_tokens(system_prompt, model) + count_tokens(prepared, model) + 2 * MESSAGE_OVERHEAD_TOKENS
+    available = context_limit(model) - input_tokens
+    if available < settings.PROMPT_MIN_OUTPUT_TOKENS:
+        raise PromptTooLargeError(input_tokens, context_limit(model) - settings.PROMPT_MIN_OUTPUT_TOKENS)
+
+    max_tokens = min(max_tokens, available, output_limit(model))
+    return {
+        "user_prompt": prepared,
+        "line_map": line_map,
+        "max_tokens": max_tokens,
+        "usage": {
+            "inputTokens": input_tokens,
+            "tokensSaved": max(0, original_tokens + 2 * MESSAGE_OVERHEAD_TOKENS - input_tokens),
+            "maxTokens": max_tokens,
+        },
+    }
@@ -0,0 +1,243 @@
+import os
+import shutil
+import zipfile
+from typing import AsyncIterator, Dict, List, Optional
+
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from repo_pipeline import LANGUAGE_EXTENSIONS, NOT_SOURCE, SKIPPED_DIRS, skipped_file
+
+# Form fields are small option strings; anything bigger is not a field we read.
+MAX_FIELD_BYTES = 64 * 1024
+MAX_FIELDS = 50
+COPY_BLOCK_BYTES = 64 * 1024
+
+
+class UploadError(ValueError):
+    """A malformed or oversized upload; status_code is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def safe_relative_path(filename: str) -> str:
+    """A client filename (possibly "dir/file.py") as a relative path that stays inside the upload dir."""
+    parts = [part for part in filename.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    if not parts:
+        raise UploadError(f"Invalid filename: {filename!r}")
+    return os.path.join(*parts)
+
+
+def _is_source(relative: str) -> bool:
+    parts = relative.split(os.sep)
+    if any(part in SKIPPED_DIRS or part.startswith(".") for part in parts[:-1]):
+        return False
+    return os.path.splitext(parts[-1])[1].lower() in LANGUAGE_EXTENSIONS
+
+
+class Upload:
+    """Multipart parser callbacks that write file parts straight to disk.
+
+    Per-file, total-size and file-count limits are checked as bytes arrive,
+    so an oversized upload is refused without being buffered first.
+    """
+
+    def __init__(self, dest_dir: str):
+        self.dest_dir = dest_dir
+        self.fields: Dict[str, List[str]] = {}
+        self.files: List[str] = []
+        # {"path", "reason"} for files left out of the analysis
+        self.skipped: List[Dict[str, str]] = []
+        self.total_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._name = ""
+        self._data = bytearray()
+        self._file = None
+        self._file_name = ""
+        self._file_bytes = 0
+        # The current file part is not source code: read past it without writing it.
+        self._discard = False
+
+    # ----- parser callbacks -----
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._data = bytearray()
+        self._file = None
+        self._discard = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise UploadError('Multipart part is missing a Content-Disposition "name"')
+        self._name = options[b"name"].decode("utf-8", errors="replace")
+        if b"filename" in options:
+            self._open(options[b"filename"].decode("utf-8", errors="replace"))
+        elif sum(len(values) for values in self.fields.values()) >= MAX_FIELDS:
+            raise UploadError(f"Too many form fields (max {MAX_FIELDS})")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._discard:
+            self._count_total(end - start)
+            return
+        if self._file is None:
+            self._data += data[start:end]
+            if len(self._data) > MAX_FIELD_BYTES:
+                raise UploadError(f"Form field '{self._name}' is too large", 413)
+            return
+        self._count(end - start)
+        self._file.write(data[start:end])
+
+    def on_part_end(self):
+        if self._discard:
+            return
+        if self._file is None:
+            self.fields.setdefault(self._name, []).append(self._data.decode("utf-8", errors="replace"))
+            return
+        self._file.close()
+        self._file = None
+
+    # ----- files -----
+
+    def _unique_path(self, relative: str) -> str:
+        stem, ext = os.path.splitext(relative)
+        candidate, n = relative, 1
+        while os.path.exists(os.path.join(self.dest_dir, candidate)):
+            candidate = f"{stem}-{n}{ext}"
+            n += 1
+        return candidate
+
+    def _add_file(self, filename: str) -> str:
+        if len(self.files) >= settings.UPLOAD_MAX_FILES:
+            raise UploadError(f"Too many files (max {settings.UPLOAD_MAX_FILES})", 413)
+        relative = self._unique_path(safe_relative_path(filename))
+        os.makedirs(os.path.dirname(os.path.join(self.dest_dir, relative)), exist_ok=True)
+        self.files.append(relative)
+        return relative
+
+    def _open(self, filename: str):
+        relative = safe_relative_path(filename)
+        if not relative.lower().endswith(".zip") and not _is_source(relative):
+            self.skipped.append(skipped_file(relative, NOT_SOURCE))
+            self._discard = True
+            self._file_name = relative
+            self._file_bytes = 0
+            return
+        self._file_name = self._add_file(relative)
+        self._file_bytes = 0
+        self._file = open(os.path.join(self.dest_dir, self._file_name), "wb")
+
+    def _count(self, size: int):
+        self._file_bytes += size
+        is_zip = self._file_name.lower().endswith(".zip")
+        if not is_zip and self._file_bytes > settings.UPLOAD_MAX_FILE_BYTES:
+            raise UploadError(f"{self._file_name} exceeds {settings.UPLOAD_MAX_FILE_BYTES} bytes", 413)
+        self._count_total(size)
+
+    def _count_total(self, size: int):
+        self.total_bytes += size
+        if self.total_bytes > settings.UPLOAD_MAX_TOTAL_BYTES:
+            raise UploadError(f"Upload exceeds {settings.UPLOAD_MAX_TOTAL_BYTES} bytes", 413)
+
+    def extract_zips(self):
+        """Replace each uploaded .zip with its source files, under the same limits as direct uploads.
+
+        Zip bytes count toward the total only until extracted; extracted bytes
+        are counted as they are written, so declared sizes are never trusted.
+        """
+        for zip_name in [name for name in self.files if name.lower().endswith(".zip")]:
+            zip_path = os.path.join(self.dest_dir, zip_name)
+            self.files.remove(zip_name)
+            self.total_bytes -= os.path.getsize(zip_path)
+            prefix = os.path.splitext(zip_name)[0]
+            try:
+                with zipfile.ZipFile(zip_path) as archive:
+                    for member in archive.infolist():
+                        if not member.is_dir():
+                            self._extract_member(archive, member, prefix)
+            except zipfile.BadZipFile:
+                raise UploadError(f"{zip_name} is not a valid zip archive")
+            os.remove(zip_path)
+
+    def _extract_member(self, archive: zipfile.ZipFile, member: zipfile.ZipInfo, prefix: str):
+        relative = os.path.join(prefix, safe_relative_path(member.filename))
+        if not _is_source(relative):
+            self.skipped.append(skipped_file(relative, NOT_SOURCE))
+            return
+        if member.file_size > settings.UPLOAD_MAX_FILE_BYTES:
+            self.skipped.append(skipped_file(relative, f"over {settings.UPLOAD_MAX_FILE_BYTES} bytes"))
+            return
+        self._file_name = self._add_file(relative)
+        self._file_bytes = 0
+        with archive.open(member) as source, open(os.path.join(self.dest_dir, self._file_name), "wb") as target:
+            while True:
+                block = source.read(COPY_BLOCK_BYTES)
+                if not block:
+                    break
+                self._count(len(block))
+                target.write(block)
+
+    def field(self, name: str) -> Optional[str]:
+        values = self.fields.get(name)
+        return values[-1] if values else None
+
+    def list_field(self, name: str) -> List[str]:
+        """Values sent as repeated fields and/or comma-separated lists."""
+        return [item.strip() for value in self.fields.get(name, []) for item in value.split(",") if item.strip()]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def receive_upload(content_type: str, stream: AsyncIterator[bytes], dest_dir: str) -> Upload:
+    """Stream a multipart/form-data body into dest_dir and unpack any zip archives.
+
+    Parsing and disk writes run in a worker thread, one request chunk at a
+    time. Raises UploadError; the caller removes dest_dir on failure.
+    """
+    mime, options = parse_options_header(content_type or "")
+    if mime != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError("Expected a multipart/form-data body", 415)
+    os.makedirs(dest_dir, exist_ok=True)
+    upload = Upload(dest_dir)
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": upload.on_part_begin,
+        "on_part_data": upload.on_part_data,
+        "on_part_end": upload.on_part_end,
+        "on_header_field": upload.on_header_field,
+        "on_header_value": upload.on_header_value,
+        "on_header_end": upload.on_header_end,
+        "on_headers_finished": upload.on_headers_finished,
+    })
+    try:
+        async for chunk in stream:
+            if chunk:
+                await run_in_threadpool(parser.write, chunk)
+        parser.finalize()
+        await run_in_threadpool(upload.extract_zips)
+    finally:
+        upload.close()
+    return upload
+
+
+def remove_upload(dest_dir: str):
+    shutil.rmtree(dest_dir, ignore_errors=True)
@@ -1,10 +1,11 @@
 'use client';
 
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import { motion } from 'framer-motion';
 import { Upload, Github, Link, FolderOpen, ArrowRight, Check } from 'lucide-react';
 import { DashboardLayout } from '@/components/layouts/DashboardLayout';
 import { PageHeader } from '@/components/layouts/PageHeader';
+import { api } from '@/lib/api';
 
 const IMPORT_METHODS = [
   {
@@ -35,6 +36,25 @@ export default function ImportPage() {
   const [repoUrl, setRepoUrl] = useState('');
   const [isConnecting, setIsConnecting] = useState(false);
 
+  const fileInput = useRef<HTMLInputElement>(null);
+  const [uploadJob, setUploadJob] = useState<string | null>(null);
+  const [uploadError, setUploadError] = useState<string | null>(null);
+  const [isUploading, setIsUploading] = useState(false);
+
+  const handleUpload = async (files: FileList | null) => {
+    if (!files?.length) return;
+    setIsUploading(true);
+    setUploadError(null);
+    try {
+      const job = await api.jobs.upload(Array.from(files), { tools: ['debug', 'refactor', 'optimize', 'test'] });
+      setUploadJob(job.job_id);
+    } catch (error: any) {
+      setUploadError(error?.response?.data?.detail || 'Upload failed');
+    } finally {
+      setIsUploading(false);
+    }
+  };
+
   const handleGitHubConnect = () => {
     setIsConnecting(true);
     // In a real app, this would trigger OAuth flow
@@ -147,16 +167,37 @@ export default function ImportPage() {
             <h3 className="font-semibold text-gray-900 dark:text-white mb-4">
               Upload Files
             </h3>
-            <div className="border-2 border-dashed border-gray-300 dark:border-dark-600 rounded-xl p-8 text-center hover:border-primary-500 transition-colors cursor-pointer">
+            <div
+              onClick={() => fileInput.current?.click()}
+              onDragOver={(e) => e.preventDefault()}
+              onDrop={(e) => {
+                e.preventDefault();
+                handleUpload(e.dataTransfer.files);
+              }}
+              className="border-2 border-dashed border-gray-300 dark:border-dark-600 rounded-xl p-8 text-center hover:border-primary-500 transition-colors cursor-pointer"
+            >
               <Upload className="w-12 h-12 mx-auto text-gray-400 mb-4" />
               <p className="text-gray-600 dark:text-gray-400 mb-2">
                 Drag and drop files here, or click to browse
               </p>
               <p className="text-sm text-gray-500">
-                Supports .zip, .tar.gz, or individual files
+                Supports .zip or individual files
               </p>
-              <input type="file" className="hidden" multiple />
+              <input
+                ref={fileInput}
+                type="file"
+                className="hidden"
+                multiple
+                onChange={(e) => handleUpload(e.target.files)}
+              />
             </div>
+            {isUploading && <p className="mt-4 text-sm text-gray-500">Uploading...</p>}
+            {uploadJob && (
+              <p className="mt-4 text-sm text-green-600 dark:text-green-400">
+                Analysis started (job {uploadJob})
+              </p>
+            )}
+            {uploadError && <p className="mt-4 text-sm text-red-500">{uploadError}</p>}
           </motion.div>
         )}
       </div>
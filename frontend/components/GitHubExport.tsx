@@ -64,24 +64,23 @@ export function GitHubExport({ code, results, onSuccess }: GitHubExportProps) {
         commit_message:
           formData.commitMessage || `Update ${formData.filename} via Code Assistant`,
         github_token: formData.githubToken,
+        create_pr:
+          formData.createPR && formData.prTitle
+            ? {
+                title: formData.prTitle,
+                body: formData.prBody || results?.pr?.data?.fullMarkdown || '',
+                base: 'main',
+              }
+            : undefined,
       });
 
       if (exportResult.success) {
         let message = `Code exported successfully! View commit: ${exportResult.data.commit_url}`;
 
-        if (formData.createPR && formData.prTitle) {
-          const prResult = await api.github.createPR({
-            repo: formData.repo,
-            title: formData.prTitle,
-            body: formData.prBody || results?.pr?.data?.fullMarkdown || '',
-            head: formData.branch,
-            base: 'main',
-            github_token: formData.githubToken,
-          });
-
-          if (prResult.success) {
-            message += `\n\nPR created: ${prResult.data.pr_url}`;
-          }
+        if (exportResult.data.pr_url) {
+          message += `\n\nPR created: ${exportResult.data.pr_url}`;
+        } else if (exportResult.data.pr_error) {
+          message += `\n\nPR not created: ${exportResult.data.pr_error}`;
         }
 
         setSuccess(message);
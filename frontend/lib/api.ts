@@ -9,18 +9,37 @@ export interface CodeRequest {
   code: string;
   language?: string;
   github_url?: string;
+  model?: string;
+  latency_target_ms?: number;
+  priority?: 'interactive' | 'batch' | 'repo';
 }
 
 export interface JobResponse {
   job_id: string;
   status: string;
+  coalesced?: boolean;
+  queue?: string;
 }
 
 export interface JobResult {
   job_id: string;
-  status: 'pending' | 'running' | 'completed' | 'failed';
+  status: 'pending' | 'running' | 'partial' | 'completed' | 'failed' | 'cancelled';
   result?: any;
+  progress?: Record<string, 'pending' | 'running' | 'completed' | 'failed'>;
   error?: string;
+  // Set by the bulk status endpoint; unchanged jobs carry no result
+  version?: string;
+  unchanged?: boolean;
+}
+
+export interface FileResultsPage {
+  job_id: string;
+  status: string;
+  total: number;
+  completed: number;
+  offset: number;
+  files: { path: string; language: string; results: Record<string, any> }[];
+  next_offset: number;
 }
 
 export const api = {
@@ -57,13 +76,57 @@ export const api = {
       return response.data;
     },
 
-    analyzeAll: async (data: CodeRequest & { tools?: string[] }): Promise<JobResponse> => {
+    analyzeAll: async (
+      data: CodeRequest & { tools?: string[]; mode?: 'fanout' | 'sequential' | 'fused' }
+    ): Promise<JobResponse> => {
       const response = await axios.post(`${API_BASE}/jobs/analyze-all`, data);
       return response.data;
     },
 
-    getStatus: async (jobId: string): Promise<JobResult> => {
-      const response = await axios.get(`${API_BASE}/jobs/${jobId}`);
+    // Many files (or .zip archives) analyzed as one job, sent as multipart
+    // form data so nothing is JSON-encoded. Per-file results come from getFiles.
+    upload: async (
+      files: File[],
+      options: { tools?: string[]; languages?: string[]; priority?: CodeRequest['priority'] } = {}
+    ): Promise<JobResponse> => {
+      const form = new FormData();
+      files.forEach((file) => form.append('files', file, file.webkitRelativePath || file.name));
+      if (options.tools?.length) form.append('tools', options.tools.join(','));
+      if (options.languages?.length) form.append('languages', options.languages.join(','));
+      if (options.priority) form.append('priority', options.priority);
+      const response = await axios.post(`${API_BASE}/jobs/upload`, form);
+      return response.data;
+    },
+
+    getFiles: async (jobId: string, offset = 0, limit = 50): Promise<FileResultsPage> => {
+      const response = await axios.get(`${API_BASE}/jobs/${jobId}/files`, { params: { offset, limit } });
+      return response.data;
+    },
+
+    getStatus: async (jobId: string, fields?: string[]): Promise<JobResult> => {
+      const response = await axios.get(`${API_BASE}/jobs/${jobId}`, {
+        params: fields?.length ? { fields: fields.join(',') } : undefined,
+      });
+      return response.data;
+    },
+
+    // Status of many jobs in one request. Jobs whose version matches `since`
+    // come back with `unchanged: true` and no result.
+    getStatuses: async (
+      jobIds: string[],
+      since?: Record<string, string>,
+      fields?: string[]
+    ): Promise<JobResult[]> => {
+      const response = await axios.post(`${API_BASE}/jobs/status`, {
+        job_ids: jobIds,
+        since,
+        fields: fields?.length ? fields.join(',') : undefined,
+      });
+      return response.data.jobs;
+    },
+
+    cancel: async (jobId: string) => {
+      const response = await axios.delete(`${API_BASE}/jobs/${jobId}`);
       return response.data;
     },
   },
@@ -104,26 +167,66 @@ export const api = {
       const response = await axios.post(`${API_BASE}/generate-pr`, data);
       return response.data;
     },
+
+    generateMultiPR: async (data: {
+      files: { filename: string; original_code: string; modified_code: string }[];
+      changes?: string;
+      language?: string;
+      title?: string;
+      context_lines?: number;
+    }) => {
+      const response = await axios.post(`${API_BASE}/generate-pr/multi`, data);
+      return response.data;
+    },
     chatAssistant: async (data: {
       message: string;
       code?: string;
       language?: string;
       history?: { role: string; content: string }[];
+      session_id?: string;
     }) => {
       const response = await axios.post(`${API_BASE}/chat-assistant`, data);
       return response.data;
     },
   },
 
+  // Server-side chat sessions: upload code once, then send only new messages
+  chat: {
+    createSession: async (data: { code?: string; language?: string }): Promise<{ session_id: string }> => {
+      const response = await axios.post(`${API_BASE}/chat/sessions`, data);
+      return response.data;
+    },
+
+    send: async (sessionId: string, message: string) => {
+      const response = await axios.post(`${API_BASE}/chat/sessions/${sessionId}/messages`, { message });
+      return response.data;
+    },
+
+    updateCode: async (sessionId: string, data: { code: string; language?: string }) => {
+      const response = await axios.put(`${API_BASE}/chat/sessions/${sessionId}/code`, data);
+      return response.data;
+    },
+
+    deleteSession: async (sessionId: string) => {
+      const response = await axios.delete(`${API_BASE}/chat/sessions/${sessionId}`);
+      return response.data;
+    },
+  },
+
   // GitHub Integration
   github: {
+    // One file (code + filename) or many (files), committed together. With
+    // create_pr the pull request is opened in the same request.
     export: async (data: {
-      code: string;
-      filename: string;
+      code?: string;
+      filename?: string;
+      files?: { path: string; content: string }[];
       repo: string;
       branch?: string;
+      base_branch?: string;
       commit_message?: string;
       github_token: string;
+      create_pr?: { title: string; body?: string; base?: string };
     }) => {
       const response = await axios.post(`${API_BASE}/github/export`, data);
       return response.data;
@@ -149,28 +252,113 @@ export const api = {
   },
 };
 
+export interface JobTokenEvent {
+  job_id: string;
+  tool: string;
+  delta: string;
+}
+
+const isFinished = (result: JobResult) =>
+  result.status === 'completed' || result.status === 'failed' || result.status === 'cancelled';
+
+// Cancel the job once `signal` aborts (e.g. when the results view unmounts),
+// so the backend stops paying for a completion nobody will read.
+// `stop` returns false when the job already finished and there is nothing to cancel.
+function cancelOnAbort(jobId: string, signal: AbortSignal | undefined, stop: () => boolean) {
+  if (!signal) return;
+  const onAbort = () => {
+    if (stop()) api.jobs.cancel(jobId).catch(() => undefined);
+  };
+  if (signal.aborted) onAbort();
+  else signal.addEventListener('abort', onAbort, { once: true });
+}
+
+// Stream job status over Server-Sent Events, falling back to polling if the
+// push channel is unavailable.
+export function streamJobStatus(
+  jobId: string,
+  onUpdate: (result: JobResult) => void,
+  onToken?: (event: JobTokenEvent) => void,
+  signal?: AbortSignal
+): Promise<JobResult> {
+  if (typeof window === 'undefined' || typeof EventSource === 'undefined') {
+    return pollJobStatus(jobId, onUpdate, 1000, 300, signal);
+  }
+
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE}/jobs/${jobId}/events`);
+    let finished = false;
+    const handleStatus = (event: MessageEvent) => {
+      const result: JobResult = JSON.parse(event.data);
+      onUpdate(result);
+      if (isFinished(result)) {
+        finished = true;
+        source.close();
+        resolve(result);
+      }
+    };
+
+    ['pending', 'running', 'partial', 'completed', 'failed', 'cancelled'].forEach((status) =>
+      source.addEventListener(status, handleStatus as EventListener)
+    );
+    source.addEventListener('token', ((event: MessageEvent) => {
+      onToken?.(JSON.parse(event.data));
+    }) as EventListener);
+
+    source.onerror = () => {
+      source.close();
+      if (finished || signal?.aborted) return;
+      // From here the polling fallback owns the job, including cancellation.
+      finished = true;
+      // Resume with polling; it also picks up a job that finished meanwhile.
+      pollJobStatus(jobId, onUpdate, 1000, 300, signal).then(resolve, reject);
+    };
+
+    cancelOnAbort(jobId, signal, () => {
+      if (finished) return false;
+      finished = true;
+      source.close();
+      reject(new DOMException('Job cancelled', 'AbortError'));
+      return true;
+    });
+  });
+}
+
 // Polling helper for job status
 export async function pollJobStatus(
   jobId: string,
   onUpdate: (result: JobResult) => void,
   interval = 1000,
-  maxAttempts = 300
+  maxAttempts = 300,
+  signal?: AbortSignal
 ): Promise<JobResult> {
   let attempts = 0;
 
   return new Promise((resolve, reject) => {
+    let stopped = false;
+    cancelOnAbort(jobId, signal, () => {
+      if (stopped) return false;
+      stopped = true;
+      reject(new DOMException('Job cancelled', 'AbortError'));
+      return true;
+    });
+
     const poll = async () => {
+      if (stopped) return;
       try {
         const result = await api.jobs.getStatus(jobId);
+        if (stopped) return;
         onUpdate(result);
 
-        if (result.status === 'completed' || result.status === 'failed') {
+        if (isFinished(result)) {
+          stopped = true;
           resolve(result);
           return;
         }
 
         attempts++;
         if (attempts >= maxAttempts) {
+          stopped = true;
           reject(new Error('Job timed out'));
           return;
         }
@@ -184,3 +372,67 @@ export async function pollJobStatus(
     poll();
   });
 }
+
+// Watch many jobs over one Server-Sent Events connection, falling back to
+// bulk polling. Returns a function that stops watching (without cancelling).
+export function watchJobs(
+  jobIds: string[],
+  onUpdate: (result: JobResult) => void,
+  onToken?: (event: JobTokenEvent) => void,
+  interval = 2000
+): () => void {
+  let stopped = false;
+  let timer: ReturnType<typeof setTimeout> | undefined;
+  const pending = new Set(jobIds);
+  const versions: Record<string, string> = {};
+
+  const poll = async () => {
+    if (stopped || pending.size === 0) return;
+    try {
+      const results = await api.jobs.getStatuses([...pending], versions);
+      if (stopped) return;
+      for (const result of results) {
+        if (result.version) versions[result.job_id] = result.version;
+        if (result.unchanged) continue;
+        onUpdate(result);
+        if (isFinished(result)) pending.delete(result.job_id);
+      }
+    } catch {
+      // Keep polling; the next round retries every pending job.
+    }
+    if (!stopped && pending.size > 0) timer = setTimeout(poll, interval);
+  };
+
+  if (jobIds.length === 0) return () => undefined;
+  if (typeof window === 'undefined' || typeof EventSource === 'undefined') {
+    poll();
+    return () => {
+      stopped = true;
+      clearTimeout(timer);
+    };
+  }
+
+  const source = new EventSource(`${API_BASE}/jobs/events?ids=${jobIds.map(encodeURIComponent).join(',')}`);
+  const handleStatus = (event: MessageEvent) => {
+    const result: JobResult = JSON.parse(event.data);
+    onUpdate(result);
+    if (isFinished(result)) pending.delete(result.job_id);
+    if (pending.size === 0) source.close();
+  };
+  ['pending', 'running', 'partial', 'completed', 'failed', 'cancelled'].forEach((status) =>
+    source.addEventListener(status, handleStatus as EventListener)
+  );
+  source.addEventListener('token', ((event: MessageEvent) => {
+    onToken?.(JSON.parse(event.data));
+  }) as EventListener);
+  source.onerror = () => {
+    source.close();
+    poll();
+  };
+
+  return () => {
+    stopped = true;
+    source.close();
+    clearTimeout(timer);
+  };
+}